@@ -0,0 +1,425 @@
+"""Quadtree tiled spatial index for globe search data
+
+Splits search.json (flat legend format: lat, lng, magnitude, category, ...)
+into quadtree tiles over latitude / longitude, writes every tile as its own
+flat JSON array (ready for globe.addData(data, {format: 'legend'})) and a
+manifest with tile bounds and counts, so viewers can load only the tiles
+in view instead of the whole file.
+
+-------------------------
+How to use this index
+-------------------------
+
+Build:
+
+    python search_index.py -i search.json -o index [-m max points per tile] [-d max depth]
+
+Query:
+
+    python search_index.py -x index/manifest.json -b south,west,north,east [-k top]
+    python search_index.py -x index/manifest.json -r lat,lng,km [-k top]
+    python search_index.py -x index/manifest.json -k top
+
+Notes:
+    - flags
+        -i infile                   search data (flat array of lat, lng, magnitude, category)
+        -o outdir                   output directory for manifest.json and tiles/
+        -m max points               split tiles with more points than this
+        -d max depth                don't split deeper than this
+        -x manifest                 query existing index
+        -b south,west,north,east    points in bounding box (west > east crosses 180th meridian)
+        -r lat,lng,km               points within distance (great circle)
+        -k top                      only top k points by magnitude
+
+    - by default:
+        tiles have at most 1024 points
+        max depth is 12
+
+-------------
+Tiles
+-------------
+
+Tile key is the quadkey of the tile: root is "", children append
+0 (south-west), 1 (south-east), 2 (north-west) and 3 (north-east).
+Only leaf tiles are written (tiles/<key>.json, root is tiles/root.json),
+points in tiles are sorted by magnitude, largest first.
+
+manifest.json:
+
+    {
+    "format"    : "legend",
+    "points"    : 22826,
+    "maxPoints" : 1024,
+    "tiles"     : [
+        { "key": "0", "file": "tiles/0.json", "count": 889,
+          "bounds": [-90, -180, 0, 0], "extent": [-54.79, -171.75, -0.23, -34.86],
+          "maxMagnitude": 0.63 },
+        ...
+        ]
+    }
+
+"bounds" is the tile, "extent" the bounding box of its points, both
+as [south, west, north, east].
+
+-------------
+Query API
+-------------
+
+    index = SearchIndex("index/manifest.json")
+    index.bbox(30, -10, 60, 40)             # [(lat, lng, magnitude, category), ...]
+    index.radius(48.85, 2.35, 500, k=10)
+    index.top(20)
+
+Only tiles whose extent intersects the query are loaded (and cached).
+
+"""
+
+import getopt
+import heapq
+import json
+import math
+import os
+import os.path
+import sys
+
+# #####################################################
+# Configuration
+# #####################################################
+MAX_POINTS = 1024
+MAX_DEPTH = 12
+
+EARTH_RADIUS = 6371.0
+
+STEP = 4
+
+# #####################################################
+# Quadtree
+# #####################################################
+def child_bounds(bounds, quadrant):
+    south, west, north, east = bounds
+    lat = (south + north) / 2.0
+    lng = (west + east) / 2.0
+
+    if quadrant & 2:
+        south = lat
+    else:
+        north = lat
+    if quadrant & 1:
+        west = lng
+    else:
+        east = lng
+
+    return [south, west, north, east]
+
+def quadrant(point, bounds):
+    south, west, north, east = bounds
+    q = 0
+    if point[0] >= (south + north) / 2.0:
+        q |= 2
+    if point[1] >= (west + east) / 2.0:
+        q |= 1
+    return q
+
+def split(points, key, bounds, tiles):
+    """Split points into leaf tiles, appends (key, bounds, points) to tiles.
+    """
+
+    if len(points) <= MAX_POINTS or len(key) >= MAX_DEPTH:
+        tiles.append((key, bounds, points))
+        return
+
+    children = [[], [], [], []]
+    for point in points:
+        children[quadrant(point, bounds)].append(point)
+
+    for q in xrange(4):
+        if children[q]:
+            split(children[q], key + str(q), child_bounds(bounds, q), tiles)
+
+def extent(points):
+    lats = [p[0] for p in points]
+    lngs = [p[1] for p in points]
+    return [min(lats), min(lngs), max(lats), max(lngs)]
+
+# #####################################################
+# Geometry
+# #####################################################
+def intersects(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+def inside(point, box):
+    return box[0] <= point[0] <= box[2] and box[1] <= point[1] <= box[3]
+
+def boxes(south, west, north, east):
+    """Query box split in two when it crosses 180th meridian.
+    """
+
+    if west > east:
+        return [[south, west, north, 180.0], [south, -180.0, north, east]]
+    return [[south, west, north, east]]
+
+def distance(lat1, lng1, lat2, lng2):
+    """Great circle distance in km (haversine).
+    """
+
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lng2 - lng1)
+
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+def radius_boxes(lat, lng, km):
+    """Bounding boxes of circle on the sphere.
+    """
+
+    d = km / EARTH_RADIUS
+    south = lat - math.degrees(d)
+    north = lat + math.degrees(d)
+
+    if south <= -90 or north >= 90 or d >= math.pi / 2:
+        return [[max(south, -90.0), -180.0, min(north, 90.0), 180.0]]
+
+    dlng = math.degrees(math.asin(min(1.0, math.sin(d) / math.cos(math.radians(lat)))))
+    west = lng - dlng
+    east = lng + dlng
+
+    if west < -180:
+        return boxes(south, west + 360, north, east)
+    if east > 180:
+        return boxes(south, west, north, east - 360)
+    return boxes(south, west, north, east)
+
+# #####################################################
+# Query API
+# #####################################################
+class SearchIndex(object):
+    """Queries over built index, tiles are loaded on demand.
+    """
+
+    def __init__(self, manifest):
+        self.root = os.path.dirname(os.path.abspath(manifest))
+
+        f = open(manifest, "r")
+        self.manifest = json.load(f)
+        f.close()
+
+        self.tiles = self.manifest["tiles"]
+        self.cache = {}
+
+    def load(self, tile):
+        key = tile["key"]
+        if key not in self.cache:
+            f = open(os.path.join(self.root, tile["file"]), "r")
+            data = json.load(f)
+            f.close()
+            self.cache[key] = [tuple(data[i:i + STEP]) for i in xrange(0, len(data), STEP)]
+        return self.cache[key]
+
+    def candidates(self, query):
+        return [tile for tile in self.tiles if any(intersects(tile["extent"], box) for box in query)]
+
+    def select(self, query, test, k):
+        tiles = self.candidates(query)
+
+        if k is None:
+            result = []
+            for tile in tiles:
+                result.extend(p for p in self.load(tile) if test(p))
+            return sorted(result, key=lambda p: -p[2])
+
+        if k <= 0:
+            return []
+
+        # tiles with largest points first, stop once no tile can beat the k-th point
+        heap = []
+        for tile in sorted(tiles, key=lambda t: -t["maxMagnitude"]):
+            if len(heap) == k and tile["maxMagnitude"] <= heap[0][0]:
+                break
+            for p in self.load(tile):
+                if len(heap) == k and p[2] <= heap[0][0]:
+                    break
+                if test(p):
+                    if len(heap) < k:
+                        heapq.heappush(heap, (p[2], p))
+                    else:
+                        heapq.heapreplace(heap, (p[2], p))
+
+        return [p for m, p in sorted(heap, key=lambda e: -e[0])]
+
+    def bbox(self, south, west, north, east, k=None):
+        """Points in bounding box, largest magnitude first.
+        """
+
+        query = boxes(south, west, north, east)
+        return self.select(query, lambda p: any(inside(p, box) for box in query), k)
+
+    def radius(self, lat, lng, km, k=None):
+        """Points within km of (lat, lng), largest magnitude first.
+        """
+
+        return self.select(radius_boxes(lat, lng, km), lambda p: distance(lat, lng, p[0], p[1]) <= km, k)
+
+    def top(self, k):
+        """Top k points by magnitude.
+        """
+
+        return self.select([[-90.0, -180.0, 90.0, 180.0]], lambda p: True, k)
+
+# #####################################################
+# API
+# #####################################################
+def load_points(fname):
+    f = open(fname, "r")
+    data = json.load(f)
+    f.close()
+
+    if len(data) % STEP:
+        raise ValueError("[%s] has %d numbers, not a multiple of %d" % (fname, len(data), STEP))
+
+    return [tuple(data[i:i + STEP]) for i in xrange(0, len(data), STEP)]
+
+def build_index(infile, outdir):
+    """Build tiles and manifest.json for infile in outdir.
+    """
+
+    points = load_points(infile)
+
+    tiles = []
+    split(points, "", [-90.0, -180.0, 90.0, 180.0], tiles)
+
+    tiledir = os.path.join(outdir, "tiles")
+    if not os.path.isdir(tiledir):
+        os.makedirs(tiledir)
+
+    entries = []
+    for key, bounds, tile in tiles:
+        tile = sorted(tile, key=lambda p: -p[2])
+
+        fname = "tiles/%s.json" % (key or "root")
+        data = []
+        for p in tile:
+            data.extend(p)
+
+        out = open(os.path.join(outdir, fname), "w")
+        json.dump(data, out, separators=(",", ":"))
+        out.close()
+
+        entries.append({
+            "key"          : key,
+            "file"         : fname,
+            "count"        : len(tile),
+            "bounds"       : bounds,
+            "extent"       : extent(tile),
+            "maxMagnitude" : tile[0][2]
+        })
+
+    manifest = {
+        "format"    : "legend",
+        "points"    : len(points),
+        "maxPoints" : MAX_POINTS,
+        "tiles"     : entries
+    }
+
+    out = open(os.path.join(outdir, "manifest.json"), "w")
+    json.dump(manifest, out, indent=4, sort_keys=True)
+    out.close()
+
+    depth = max(len(key) for key, bounds, tile in tiles)
+    print "%d points, %d tiles, depth %d" % (len(points), len(tiles), depth)
+
+# #####################################################
+# Helpers
+# #####################################################
+def usage():
+    print "Usage: %s -i search.json -o outdir [-m max points] [-d max depth]" % os.path.basename(sys.argv[0])
+    print "       %s -x manifest.json [-b south,west,north,east | -r lat,lng,km] [-k top]" % os.path.basename(sys.argv[0])
+
+def parse_numbers(value, count):
+    numbers = [float(v) for v in value.split(",")]
+    if len(numbers) != count:
+        raise ValueError("expected %d comma separated numbers, got [%s]" % (count, value))
+    return numbers
+
+# #####################################################
+# Main
+# #####################################################
+if __name__ == "__main__":
+
+    # get parameters from the command line
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hi:o:m:d:x:b:r:k:", ["help", "input=", "output=", "maxpoints=", "depth=", "index=", "bbox=", "radius=", "top="])
+
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    infile = outdir = manifest = ""
+    bbox = radius = top = None
+
+    try:
+        for o, a in opts:
+            if o in ("-h", "--help"):
+                usage()
+                sys.exit()
+
+            elif o in ("-i", "--input"):
+                infile = a
+
+            elif o in ("-o", "--output"):
+                outdir = a
+
+            elif o in ("-m", "--maxpoints"):
+                MAX_POINTS = max(1, int(a))
+
+            elif o in ("-d", "--depth"):
+                MAX_DEPTH = max(0, int(a))
+
+            elif o in ("-x", "--index"):
+                manifest = a
+
+            elif o in ("-b", "--bbox"):
+                bbox = parse_numbers(a, 4)
+
+            elif o in ("-r", "--radius"):
+                radius = parse_numbers(a, 3)
+
+            elif o in ("-k", "--top"):
+                top = int(a)
+
+    except ValueError, e:
+        print "ERROR: %s" % e
+        sys.exit(2)
+
+    if manifest:
+        index = SearchIndex(manifest)
+
+        if bbox:
+            result = index.bbox(*bbox, k=top)
+        elif radius:
+            result = index.radius(*radius, k=top)
+        elif top:
+            result = index.top(top)
+        else:
+            usage()
+            sys.exit(2)
+
+        print "%d points, %d of %d tiles loaded" % (len(result), len(index.cache), len(index.tiles))
+        for p in result[:20]:
+            print "%9.3f %9.3f %7.3f %3d" % p
+        if len(result) > 20:
+            print "..."
+
+    elif infile and outdir:
+        print "Indexing [%s] into [%s] ..." % (infile, outdir)
+
+        try:
+            build_index(infile, outdir)
+        except ValueError, e:
+            print "ERROR: %s" % e
+            sys.exit(1)
+
+    else:
+        usage()
+        sys.exit(2)
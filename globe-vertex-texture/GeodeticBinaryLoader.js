@@ -0,0 +1,212 @@
+/**
+ * dat.globe Javascript WebGL Globe Toolkit
+ * https://github.com/dataarts/webgl-globe
+ *
+ * Copyright 2011 Data Arts Team, Google Creative Lab
+ *
+ * Licensed under the Apache License, Version 2.0 (the 'License');
+ * you may not use this file except in compliance with the License.
+ * You may obtain a copy of the License at
+ *
+ * http://www.apache.org/licenses/LICENSE-2.0
+ */
+
+/**
+ * Loads binary models converted with convert_obj_three.py -t binary -g.
+ *
+ * Geodetic .bin files store vertices as 16 bit latitude, longitude and
+ * radial offset after a longer header, which THREE.BinaryLoader can't
+ * read. The buffer is decoded into the plain float layout and then handed
+ * to THREE.BinaryLoader, so the geometry is the same as with float
+ * vertices. With implied normals the radial normals are put back and the
+ * faces become smooth again. Plain binary models load unchanged.
+ *
+ *   var loader = new THREE.GeodeticBinaryLoader();
+ *   loader.load({ model: 'models/gridLand6.js', callback: function(g) { ... } });
+ */
+THREE.GeodeticBinaryLoader = function(showStatus) {
+  THREE.BinaryLoader.call(this, showStatus);
+};
+
+THREE.GeodeticBinaryLoader.prototype = new THREE.BinaryLoader();
+THREE.GeodeticBinaryLoader.prototype.constructor = THREE.GeodeticBinaryLoader;
+
+THREE.GeodeticBinaryLoader.prototype.load = function(parameters) {
+  var url = parameters.model,
+      callback = parameters.callback,
+      texturePath = parameters.texture_path ? parameters.texture_path :
+          THREE.Loader.prototype.extractUrlbase(url),
+      binPath = parameters.bin_path ? parameters.bin_path :
+          THREE.Loader.prototype.extractUrlbase(url);
+
+  var worker = new Worker(url);
+
+  worker.onmessage = function(event) {
+    var model = event.data;
+    var implied = !!(model.sphere && model.sphere.impliedNormals);
+
+    var xhr = new XMLHttpRequest();
+    xhr.onreadystatechange = function() {
+      if (xhr.readyState != 4) return;
+      if (xhr.status == 200 || xhr.status == 0) {
+        THREE.BinaryLoader.prototype.createBinModel(
+            THREE.GeodeticBinaryLoader.decode(xhr.responseText, implied),
+            callback, texturePath, model.materials);
+      } else {
+        alert("Couldn't load [" + binPath + '/' + model.buffers + '] [' +
+            xhr.status + ']');
+      }
+    };
+    xhr.open('GET', binPath + '/' + model.buffers, true);
+    xhr.overrideMimeType('text/plain; charset=x-user-defined');
+    xhr.setRequestHeader('Content-Type', 'text/plain');
+    xhr.send(null);
+  };
+
+  worker.postMessage(parameters);
+};
+
+/**
+ * Geodetic .bin data (binary string) as a plain float .bin binary string.
+ * Data with float vertices is returned as it is.
+ */
+THREE.GeodeticBinaryLoader.decode = function(data, impliedNormals) {
+  var HEADER_BYTES = 60;  // signature, sizes and counts, no extension
+
+  var bytes = new Uint8Array(data.length);
+  for (var i = 0; i < data.length; i++) {
+    bytes[i] = data.charCodeAt(i) & 255;
+  }
+  var view = new DataView(bytes.buffer);
+
+  if (bytes[9] != 2) return data;
+
+  var headerBytes = bytes[8],
+      normalCoordinateBytes = bytes[10],
+      uvCoordinateBytes = bytes[11],
+      vertexIndexBytes = bytes[12],
+      normalIndexBytes = bytes[13],
+      uvIndexBytes = bytes[14],
+      materialIndexBytes = bytes[15];
+
+  var counts = [];
+  for (i = 0; i < 11; i++) {
+    counts.push(view.getUint32(16 + i * 4, true));
+  }
+  var nvertices = counts[0], nnormals = counts[1], nuvs = counts[2];
+
+  var cx = view.getFloat32(60, true),
+      cy = view.getFloat32(64, true),
+      cz = view.getFloat32(68, true),
+      radius = view.getFloat32(72, true),
+      lo = view.getFloat32(76, true),
+      hi = view.getFloat32(80, true);
+
+  // Face sections in file order: [vertices per face, smooth, uv].
+  var sections = [[3, 0, 0], [3, 1, 0], [3, 0, 1], [3, 1, 1],
+                  [4, 0, 0], [4, 1, 0], [4, 0, 1], [4, 1, 1]];
+
+  function recordBytes(n, smooth, uv) {
+    return n * vertexIndexBytes + materialIndexBytes +
+        (smooth ? n * normalIndexBytes : 0) + (uv ? n * uvIndexBytes : 0);
+  }
+
+  // Implied normals: flat sections become the smooth ones.
+  var outCounts = counts.slice();
+  if (impliedNormals) {
+    outCounts[1] = nvertices;
+    for (i = 0; i < 8; i += 2) {
+      outCounts[3 + i + 1] = counts[3 + i] + counts[3 + i + 1];
+      outCounts[3 + i] = 0;
+    }
+  }
+
+  var size = HEADER_BYTES + nvertices * 12 +
+      outCounts[1] * 3 * normalCoordinateBytes + nuvs * 2 * uvCoordinateBytes;
+  for (i = 0; i < 8; i++) {
+    size += outCounts[3 + i] * recordBytes.apply(null, sections[i]);
+  }
+
+  var out = new Uint8Array(size);
+  var outView = new DataView(out.buffer);
+
+  out.set(bytes.subarray(0, 16));
+  out[8] = HEADER_BYTES;
+  out[9] = 4;
+  for (i = 0; i < 11; i++) {
+    outView.setUint32(16 + i * 4, outCounts[i], true);
+  }
+
+  var src = headerBytes, dst = HEADER_BYTES;
+
+  // Vertices, decoded as geodetic_position in convert_obj_three.py.
+  var positions = new Float32Array(nvertices * 3);
+  for (i = 0; i < nvertices; i++, src += 6, dst += 12) {
+    var lat = -Math.PI / 2 + Math.PI * view.getUint16(src, true) / 65535;
+    var lng = -Math.PI + 2 * Math.PI * view.getUint16(src + 2, true) / 65535;
+    var r = radius + lo + (hi - lo) * view.getUint16(src + 4, true) / 65535;
+
+    positions[i * 3] = cx + r * Math.cos(lat) * Math.cos(lng);
+    positions[i * 3 + 1] = cy + r * Math.sin(lat);
+    positions[i * 3 + 2] = cz + r * Math.cos(lat) * Math.sin(lng);
+
+    outView.setFloat32(dst, positions[i * 3], true);
+    outView.setFloat32(dst + 4, positions[i * 3 + 1], true);
+    outView.setFloat32(dst + 8, positions[i * 3 + 2], true);
+  }
+
+  if (!impliedNormals) {
+    // Normals, uvs and faces are the same in both layouts.
+    out.set(bytes.subarray(src), dst);
+  } else {
+    // Radial normals, one per vertex.
+    for (i = 0; i < nvertices; i++, dst += 3) {
+      var x = positions[i * 3] - cx,
+          y = positions[i * 3 + 1] - cy,
+          z = positions[i * 3 + 2] - cz;
+      var length = Math.sqrt(x * x + y * y + z * z) || 1;
+
+      outView.setInt8(dst, Math.floor(x / length * 127 + 0.5));
+      outView.setInt8(dst + 1, Math.floor(y / length * 127 + 0.5));
+      outView.setInt8(dst + 2, Math.floor(z / length * 127 + 0.5));
+    }
+
+    // Converter writes no normals with implied ones, uvs are the same.
+    src += nnormals * 3 * normalCoordinateBytes;
+    var uvBytes = nuvs * 2 * uvCoordinateBytes;
+    out.set(bytes.subarray(src, src + uvBytes), dst);
+    src += uvBytes;
+    dst += uvBytes;
+
+    // Faces, the normal indices are the vertex indices.
+    for (var s = 0; s < 8; s++) {
+      var n = sections[s][0], smooth = sections[s][1], uv = sections[s][2];
+      var inBytes = recordBytes(n, smooth, uv);
+
+      for (var f = 0; f < counts[3 + s]; f++, src += inBytes) {
+        var indices = n * vertexIndexBytes + materialIndexBytes;
+        out.set(bytes.subarray(src, src + indices), dst);
+        dst += indices;
+
+        if (!smooth) {
+          for (var v = 0; v < n; v++, dst += normalIndexBytes) {
+            var index = view.getUint32(src + v * vertexIndexBytes, true);
+            for (var b = 0; b < normalIndexBytes; b++) {
+              out[dst + b] = (index >>> (8 * b)) & 255;
+            }
+          }
+        }
+
+        var tail = inBytes - indices;
+        out.set(bytes.subarray(src + indices, src + inBytes), dst);
+        dst += tail;
+      }
+    }
+  }
+
+  var chunks = [];
+  for (i = 0; i < out.length; i += 8192) {
+    chunks.push(String.fromCharCode.apply(null, out.subarray(i, i + 8192)));
+  }
+  return chunks.join('');
+};
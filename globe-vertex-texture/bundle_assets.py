@@ -0,0 +1,366 @@
+"""Pack models and textures into a single asset bundle
+
+globe.js fetches the point model, gridLand<N>.js and three textures one
+request at a time, and every change of gridDensity is another cold
+fetch. This tool packs converted models (ASCII .js or binary .js + .bin),
+textures and other files into one binary container with an index of
+names, offsets, lengths and hashes, so a client can get the whole set
+in one request or any single entry with an HTTP range request.
+
+-------------------------
+How to use this tool
+-------------------------
+
+python bundle_assets.py -o assets.bundle [-b basedir] [-a align] [file|directory ...]
+python bundle_assets.py -l assets.bundle
+python bundle_assets.py -x assets.bundle -e models/hex.js [-o hex.js]
+
+Notes:
+    - flags
+        -o outfile                  bundle to write (with -x: file to extract to)
+        -b basedir                  entry names are paths relative to basedir
+        -a align                    entry alignment in bytes (power of two)
+        -l bundle                   list entries and check their hashes
+        -x bundle                   extract entry named with -e (to stdout without -o)
+        -e name                     entry name
+
+    - by default:
+        basedir is the directory of this script (names are the URLs globe.js uses)
+        entries are aligned to 64 bytes
+        without files, the assets globe.js loads are packed:
+            models/gridLand*.js, models/gridWater*.js, point models
+            (and .bin files of binary models), world.jpg, worldMask.jpg,
+            worldDataSample.jpg
+
+    - directories are packed recursively
+
+-------------
+Format
+-------------
+
+All numbers are little-endian:
+
+    signature           8s      "DATBNDL1"
+    version             I       1
+    align               I
+    index offset        Q
+    index length        Q
+    index                       UTF-8 JSON
+    entries                     every one starts at a multiple of align, zero padded
+
+index:
+
+    {
+    "entries" : [
+        { "name": "models/hex.js", "type": "model", "offset": 4096, "length": 2418,
+          "sha1": "0e5f..." },
+        ...
+        ]
+    }
+
+"type" is model (.js), binary (.bin), texture (.jpg .png .dds .ktx),
+json or data. Index follows the 32 byte header, so a client reads
+bytes 0 - 31, then the index, then any entry by its offset and length
+(Range: bytes=offset-(offset + length - 1)).
+
+Bundle class reads a bundle through mmap, entries are buffers into the
+mapping and arrays are NumPy views of it, nothing is copied.
+
+"""
+
+import getopt
+import glob
+import hashlib
+import json
+import mmap
+import os
+import os.path
+import struct
+import sys
+
+# #####################################################
+# Configuration
+# #####################################################
+BASEDIR = os.path.dirname(os.path.abspath(__file__))
+ALIGN = 64
+
+DEFAULT_ASSETS = ["models/gridLand*.js", "models/gridWater*.js", "models/hex.js", "models/cube.js", "models/sphere.js",
+                  "world.jpg", "worldMask.jpg", "worldDataSample.jpg"]
+
+SIGNATURE = "DATBNDL1"
+VERSION = 1
+HEADER = '<8sIIQQ'
+
+TYPES = {
+".js"   : "model",
+".bin"  : "binary",
+".jpg"  : "texture",
+".png"  : "texture",
+".dds"  : "texture",
+".ktx"  : "texture",
+".json" : "json"
+}
+
+# #####################################################
+# Packing
+# #####################################################
+def align(offset, alignment):
+    return (offset + alignment - 1) // alignment * alignment
+
+def binary_companion(fname):
+    """.bin file of a binary converted model, None for ASCII models.
+    """
+
+    root, ext = os.path.splitext(fname)
+    if ext.lower() == ".js" and os.path.exists(root + ".bin"):
+        return root + ".bin"
+    return None
+
+def collect(paths):
+    """Files to pack, directories are walked, binary models bring their .bin.
+    """
+
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, names in os.walk(path):
+                dirs.sort()
+                files.extend(os.path.join(root, name) for name in sorted(names))
+        else:
+            files.append(path)
+
+            companion = binary_companion(path)
+            if companion:
+                files.append(companion)
+
+    seen = set()
+    result = []
+    for f in files:
+        key = os.path.abspath(f)
+        if key not in seen:
+            seen.add(key)
+            result.append(f)
+    return result
+
+def default_assets():
+    files = []
+    for pattern in DEFAULT_ASSETS:
+        files.extend(sorted(glob.glob(os.path.join(BASEDIR, pattern))))
+    return files
+
+def entry_name(fname):
+    name = os.path.relpath(os.path.abspath(fname), BASEDIR).replace(os.sep, "/")
+    if name.startswith("../"):
+        raise ValueError("[%s] is outside of basedir [%s]" % (fname, BASEDIR))
+    return name
+
+def layout(entries):
+    """Index JSON with entry offsets, offsets depend on the index length so iterate until stable.
+    """
+
+    start = 0
+    while True:
+        offset = start
+        for entry in entries:
+            entry["offset"] = offset
+            offset = align(offset + entry["length"], ALIGN)
+
+        index = json.dumps({ "entries": entries }, sort_keys=True, separators=(",", ":"))
+        first = align(struct.calcsize(HEADER) + len(index), ALIGN)
+        if first == start:
+            return index, offset
+        start = first
+
+def pack_bundle(files, outfile):
+    if ALIGN < 1 or ALIGN & (ALIGN - 1):
+        raise ValueError("alignment has to be a power of two, not %d" % ALIGN)
+
+    entries = []
+    for fname in files:
+        data = open(fname, "rb").read()
+        entries.append({ "name"   : entry_name(fname),
+                         "type"   : TYPES.get(os.path.splitext(fname)[1].lower(), "data"),
+                         "length" : len(data),
+                         "sha1"   : hashlib.sha1(data).hexdigest() })
+
+    names = [e["name"] for e in entries]
+    if len(set(names)) != len(names):
+        raise ValueError("duplicate entry names")
+
+    index, size = layout(entries)
+
+    out = open(outfile, "wb")
+    out.write(struct.pack(HEADER, SIGNATURE, VERSION, ALIGN, struct.calcsize(HEADER), len(index)))
+    out.write(index)
+
+    for fname, entry in zip(files, entries):
+        out.write("\0" * (entry["offset"] - out.tell()))
+        out.write(open(fname, "rb").read())
+
+    out.write("\0" * (size - out.tell()))
+    out.close()
+
+    return entries, size
+
+# #####################################################
+# Reading
+# #####################################################
+class Bundle:
+    """Memory mapped bundle.
+
+    entry(name) is a read-only buffer into the mapping, array(name, dtype)
+    a NumPy array over the same memory.
+    """
+
+    def __init__(self, fname):
+        self.file = open(fname, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        size = struct.calcsize(HEADER)
+        if len(self.map) < size:
+            raise ValueError("[%s] is too short for a bundle" % fname)
+
+        signature, version, self.align, offset, length = struct.unpack_from(HEADER, self.map, 0)
+        if signature != SIGNATURE:
+            raise ValueError("[%s] is not a bundle" % fname)
+        if version != VERSION:
+            raise ValueError("[%s] is bundle version %d, only %d is supported" % (fname, version, VERSION))
+
+        self.entries = json.loads(self.map[offset:offset + length])["entries"]
+        self.names = dict((e["name"], e) for e in self.entries)
+
+        for e in self.entries:
+            if e["offset"] + e["length"] > len(self.map):
+                raise ValueError("entry [%s] is past the end of [%s]" % (e["name"], fname))
+
+    def info(self, name):
+        if name not in self.names:
+            raise ValueError("no entry [%s]" % name)
+        return self.names[name]
+
+    def entry(self, name):
+        e = self.info(name)
+        return buffer(self.map, e["offset"], e["length"])
+
+    def array(self, name, dtype, offset=0, count=-1):
+        import numpy
+
+        e = self.info(name)
+        dtype = numpy.dtype(dtype)
+        if count < 0:
+            count = (e["length"] - offset) // dtype.itemsize
+
+        return numpy.frombuffer(self.map, dtype=dtype, count=count, offset=e["offset"] + offset)
+
+    def verify(self, name):
+        return hashlib.sha1(self.entry(name)).hexdigest() == self.info(name)["sha1"]
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+# #####################################################
+# API
+# #####################################################
+def bundle_assets(paths, outfile):
+    files = collect(paths or default_assets())
+    if not files:
+        raise ValueError("nothing to pack")
+
+    entries, size = pack_bundle(files, outfile)
+
+    print "%d entries, %d bytes (%d bytes of files)" % (len(entries), size, sum(e["length"] for e in entries))
+
+def list_bundle(fname):
+    bundle = Bundle(fname)
+
+    for e in bundle.entries:
+        print "%10d %10d  %-8s %s  %s" % (e["offset"], e["length"], e["type"], "ok" if bundle.verify(e["name"]) else "BAD", e["name"])
+
+    bundle.close()
+
+def extract_entry(fname, name, outfile):
+    bundle = Bundle(fname)
+
+    if not bundle.verify(name):
+        raise ValueError("entry [%s] does not match its hash" % name)
+
+    out = open(outfile, "wb") if outfile else sys.stdout
+    out.write(bundle.entry(name))
+    if outfile:
+        out.close()
+
+    bundle.close()
+
+# #####################################################
+# Helpers
+# #####################################################
+def usage():
+    print "Usage: %s -o outfile [-b basedir] [-a align] [file|directory ...]" % os.path.basename(sys.argv[0])
+    print "       %s -l bundle" % os.path.basename(sys.argv[0])
+    print "       %s -x bundle -e name [-o outfile]" % os.path.basename(sys.argv[0])
+
+# #####################################################
+# Main
+# #####################################################
+if __name__ == "__main__":
+
+    # get parameters from the command line
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "ho:b:a:l:x:e:", ["help", "output=", "basedir=", "align=", "list=", "extract=", "entry="])
+
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    outfile = listfile = extractfile = name = ""
+
+    try:
+        for o, a in opts:
+            if o in ("-h", "--help"):
+                usage()
+                sys.exit()
+
+            elif o in ("-o", "--output"):
+                outfile = a
+
+            elif o in ("-b", "--basedir"):
+                BASEDIR = os.path.abspath(a)
+
+            elif o in ("-a", "--align"):
+                ALIGN = int(a)
+
+            elif o in ("-l", "--list"):
+                listfile = a
+
+            elif o in ("-x", "--extract"):
+                extractfile = a
+
+            elif o in ("-e", "--entry"):
+                name = a
+
+    except ValueError:
+        usage()
+        sys.exit(2)
+
+    try:
+        if listfile:
+            list_bundle(listfile)
+
+        elif extractfile:
+            if name == "":
+                usage()
+                sys.exit(2)
+            extract_entry(extractfile, name, outfile)
+
+        elif outfile:
+            print "Bundling into [%s] ..." % outfile
+            bundle_assets(args, outfile)
+
+        else:
+            usage()
+            sys.exit(2)
+
+    except ValueError, e:
+        print "ERROR: %s" % e
+        sys.exit(1)
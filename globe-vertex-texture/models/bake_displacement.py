@@ -0,0 +1,297 @@
+"""Bake data shader displacement into geometry on the CPU
+
+For clients without vertex texture fetch (or where it is slow), this
+does offline what createPoints (globe.js) and the data shader
+(shaders.js) do on the GPU: every grid vertex gets a point model
+(hex.obj by default) scaled by pointScale and turned with lookAt
+towards the globe center, and every vertex of it is moved by
+
+    position - normal + length(normal) * normalize(position) * data.r * extrudeMax
+
+with data.r sampled bilinearly from the data texture at the grid
+vertex uv. The result renders with the plain earth shader.
+
+-------------------------
+How to use this baker
+-------------------------
+
+python bake_displacement.py -i gridLand6.obj -d ../worldDataSample.jpg -o gridLand6_baked.bin [-p hex.obj] [-s pointScale] [-x extrudeMax[,extrudeMax...]] [-e extrudeMin]
+
+Notes:
+    - flags
+        -i grid.obj                 grid mesh (gridLand / gridWater OBJ)
+        -d texture                  data texture (worldDataSample.jpg or rasterize_data.py output)
+        -o outfile                  output geometry
+        -p model.obj                point model
+        -s pointScale               point model scale across the bar
+        -x extrudeMax               extrusion, more comma separated values become morph targets
+        -e extrudeMin               points the fragment shader would discard (data.r < extrudeMin) are left out
+
+    - by default (as in globe.js):
+        point model is hex.obj
+        pointScale is 1.1
+        extrudeMax is 100
+        extrudeMin is 0.01
+
+    - needs NumPy and PIL (Python Imaging Library)
+
+-------------
+Binary format
+-------------
+
+All data is little-endian, every section starts at 4 byte boundary:
+
+    signature           8s      "DATDISP1"
+    npoints             I       grid vertices kept
+    nvertices           I
+    nindices            I       triangles * 3
+    nmorph              I
+    positions offset    I       nvertices * 3 float32, displaced with the first extrudeMax
+    normals offset      I       nvertices * 3 float32, unit vector away from globe center
+    uvs offset          I       nvertices * 2 float32, grid vertex uv (as createPoints sets it)
+    indices offset      I       nindices uint32
+    morph offset        I       nmorph * nvertices * 3 float32
+    extrude offset      I       nmorph float32, extrudeMax of each morph target
+
+With one extrudeMax there are no morph targets. With more, positions use
+the first value and there is one morph target per value, so morph
+influence 1 on target k shows extrudeMax k.
+
+Point model normals carry the extrusion weight (their length is 0 on
+the base of the bar and 1 on its top), createPoints replaces their
+direction with the grid vertex direction but keeps the length, so
+vertices are baked per (vertex, normal) pair of the model faces.
+
+"""
+
+import getopt
+import os.path
+import struct
+import sys
+
+import numpy
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "globe"))
+
+import bake_bars
+import convert_obj_three
+import prune_grid
+
+# #####################################################
+# Configuration
+# #####################################################
+POINT_MODEL = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hex.obj")
+POINT_SCALE = 1.1
+EXTRUDE_MAX = [100.0]
+EXTRUDE_MIN = 0.01
+
+RADIUS = 200.0
+
+SIGNATURE = "DATDISP1"
+HEADER = '<8sIIIIIIIIII'
+
+# #####################################################
+# Point model
+# #####################################################
+def point_model(fname):
+    """Corners (unique vertex / normal pairs) of point model, normal lengths and triangles.
+    """
+
+    faces, vertices, uvs, normals, materials, mtllib = convert_obj_three.load_obj(fname)
+
+    corners = {}
+    positions = []
+    lengths = []
+    triangles = []
+
+    for f in faces:
+        indices = []
+        for i, v in enumerate(f['vertex']):
+            n = f['normal'][i] if len(f['normal']) > i else 0
+            key = (v, n)
+            if key not in corners:
+                corners[key] = len(positions)
+                positions.append(vertices[v - 1])
+                lengths.append(numpy.sqrt(sum(c * c for c in normals[n - 1])) if n else 1.0)
+            indices.append(corners[key])
+
+        # fan, as three.js splits quads
+        for i in xrange(1, len(indices) - 1):
+            triangles.append((indices[0], indices[i], indices[i + 1]))
+
+    return numpy.array(positions), numpy.array(lengths), numpy.array(triangles, dtype=numpy.uint32)
+
+# #####################################################
+# Sampling
+# #####################################################
+def sample_bilinear(texture, u, v):
+    """Bilinear texture lookup with clamp to edge, as the vertex shader does.
+    """
+
+    height, width = texture.shape
+
+    x = u * width - 0.5
+    y = v * height - 0.5
+
+    x0 = numpy.floor(x).astype(numpy.int64)
+    y0 = numpy.floor(y).astype(numpy.int64)
+    fx = x - x0
+    fy = y - y0
+
+    x1 = numpy.clip(x0 + 1, 0, width - 1)
+    y1 = numpy.clip(y0 + 1, 0, height - 1)
+    x0 = numpy.clip(x0, 0, width - 1)
+    y0 = numpy.clip(y0, 0, height - 1)
+
+    return ((texture[y0, x0] * (1 - fx) + texture[y0, x1] * fx) * (1 - fy) +
+            (texture[y1, x0] * (1 - fx) + texture[y1, x1] * fx) * fy)
+
+# #####################################################
+# Baking
+# #####################################################
+def place_points(grid, model, scale):
+    """Point model vertices in world space for every grid vertex, (npoints, ncorners, 3).
+    """
+
+    x, y, z = bake_bars.look_at_axes(grid)
+
+    mx = model[:, 0][None, :, None] * scale
+    my = model[:, 1][None, :, None] * scale
+    mz = model[:, 2][None, :, None]
+
+    return grid[:, None, :] + x[:, None, :] * mx + y[:, None, :] * my + z[:, None, :] * mz
+
+def displace(positions, normals, data, extrude):
+    """position - normal + length(normal) * normalize(position) * data * extrude
+    """
+
+    length = numpy.sqrt((normals * normals).sum(axis=2))[:, :, None]
+    direction = positions / numpy.sqrt((positions * positions).sum(axis=2))[:, :, None]
+
+    return positions - normals + length * direction * (data[:, None, None] * extrude)
+
+def bake(grid, texture, model, lengths):
+    """Displaced positions for every extrudeMax, radial normals and uvs, all per vertex.
+    """
+
+    u, v = prune_grid.grid_uv(grid)
+    data = sample_bilinear(texture, u, v)
+
+    keep = data >= EXTRUDE_MIN
+    grid, u, v, data = grid[keep], u[keep], v[keep], data[keep]
+
+    positions = place_points(grid, model, POINT_SCALE)
+
+    # createPoints: vertexNormals = (x / 200, y / 200, z / 200) * length
+    radial = grid / RADIUS
+    normals = radial[:, None, :] * lengths[None, :, None]
+
+    displaced = [displace(positions, normals, data, extrude).reshape(-1, 3) for extrude in EXTRUDE_MAX]
+
+    unit = radial / numpy.sqrt((radial * radial).sum(axis=1))[:, None]
+    ncorners = len(model)
+
+    return (len(grid), displaced,
+            numpy.repeat(unit, ncorners, axis=0),
+            numpy.repeat(numpy.column_stack((u, v)), ncorners, axis=0))
+
+# #####################################################
+# Output
+# #####################################################
+def pack(npoints, displaced, normals, uvs, index):
+    morphs = displaced if len(displaced) > 1 else []
+    extrudes = numpy.array(EXTRUDE_MAX if morphs else [])
+
+    sections = [bake_bars.bytes_le(displaced[0], 'f4'),
+                bake_bars.bytes_le(normals, 'f4'),
+                bake_bars.bytes_le(uvs, 'f4'),
+                bake_bars.bytes_le(index, 'u4'),
+                "".join(bake_bars.bytes_le(m, 'f4') for m in morphs),
+                bake_bars.bytes_le(extrudes, 'f4')]
+
+    offset = struct.calcsize(HEADER)
+    offsets = []
+    for data in sections:
+        offsets.append(offset)
+        offset += len(data)
+
+    header = struct.pack(HEADER, SIGNATURE, npoints, len(displaced[0]), len(index), len(morphs), *offsets)
+    return header + "".join(sections)
+
+# #####################################################
+# API
+# #####################################################
+def bake_grid(infile, texturefile, outfile):
+    grid = numpy.array(convert_obj_three.load_obj(infile)[1], dtype=numpy.float64)
+    model, lengths, triangles = point_model(POINT_MODEL)
+
+    npoints, displaced, normals, uvs = bake(grid, prune_grid.load_texture(texturefile), model, lengths)
+    index = bake_bars.indices(npoints, triangles, len(model))
+
+    data = pack(npoints, displaced, normals, uvs, index)
+
+    out = open(outfile, "wb")
+    out.write(data)
+    out.close()
+
+    print "%d of %d points, %d vertices, %d triangles, %d morph targets, %d bytes" % (npoints, len(grid), len(displaced[0]), len(index) / 3, len(displaced) if len(displaced) > 1 else 0, len(data))
+
+# #####################################################
+# Helpers
+# #####################################################
+def usage():
+    print "Usage: %s -i grid.obj -d texture -o outfile [-p model.obj] [-s pointScale] [-x extrudeMax[,extrudeMax...]] [-e extrudeMin]" % os.path.basename(sys.argv[0])
+
+# #####################################################
+# Main
+# #####################################################
+if __name__ == "__main__":
+
+    # get parameters from the command line
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hi:d:o:p:s:x:e:", ["help", "input=", "data=", "output=", "model=", "scale=", "extrudemax=", "extrudemin="])
+
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    infile = texturefile = outfile = ""
+
+    try:
+        for o, a in opts:
+            if o in ("-h", "--help"):
+                usage()
+                sys.exit()
+
+            elif o in ("-i", "--input"):
+                infile = a
+
+            elif o in ("-d", "--data"):
+                texturefile = a
+
+            elif o in ("-o", "--output"):
+                outfile = a
+
+            elif o in ("-p", "--model"):
+                POINT_MODEL = a
+
+            elif o in ("-s", "--scale"):
+                POINT_SCALE = float(a)
+
+            elif o in ("-x", "--extrudemax"):
+                EXTRUDE_MAX = [float(x) for x in a.split(",")]
+
+            elif o in ("-e", "--extrudemin"):
+                EXTRUDE_MIN = float(a)
+
+    except ValueError:
+        usage()
+        sys.exit(2)
+
+    if infile == "" or texturefile == "" or outfile == "":
+        usage()
+        sys.exit(2)
+
+    print "Baking [%s] with [%s] into [%s] ..." % (infile, texturefile, outfile)
+
+    bake_grid(infile, texturefile, outfile)
@@ -7,13 +7,24 @@ script= 'python convert_obj_three.py -i '+srcDir+'OBJ -o '+destDir+'JS'
 
 models_dict = []
 
-dirList=os.listdir(srcDir)
-for file in dirList:
-  if file.find(".obj") != -1:
-    models_dict.append({"file":file})
+# plain or compressed OBJ files, in order of preference: one source per
+# model name, "x.obj" wins over "x.obj.gz" (both would write x.js)
+extensions = [".obj", ".obj.gz", ".obj.bz2", ".obj.xz"]
+
+dirList=sorted(os.listdir(srcDir))
+names = {}
+for ext in extensions:
+  for file in dirList:
+    if file.endswith(ext):
+      name = file[:-len(ext)]
+      if name in names:
+        print "Skipping [%s], converting [%s] into [%s.js]" % (file, names[name], name)
+        continue
+      names[name] = file
+      models_dict.append({"file":file, "name":name})
 
 ###Compress
 for i in range(0,len(models_dict)):
   sh_script = script.replace("OBJ", models_dict[i]["file"])
-  sh_script = sh_script.replace("JS", models_dict[i]["file"].replace(".obj", ".js"))
+  sh_script = sh_script.replace("JS", models_dict[i]["name"]+".js")
   os.system(sh_script)
@@ -4,7 +4,7 @@
 How to use this converter
 -------------------------
 
-python convert_obj_three.py -i infile.obj -o outfile.js [-m "morphfiles*.obj"] [-c "morphcolors*.obj"] [-a center|centerxz|top|bottom|none] [-s smooth|flat] [-t ascii|binary] [-d invert|normal] [-b] [-e]
+python convert_obj_three.py -i infile.obj -o outfile.js [-m "morphfiles*.obj"] [-c "morphcolors*.obj"] [-a center|centerxz|top|bottom|none] [-s smooth|flat] [-t ascii|binary|compressed] [-d invert|normal] [-b] [-e] [-l group|object|none] [-r] [-p atlas.png] [-g] [-q 16] [-j 4]
 
 Notes: 
     - flags
@@ -14,11 +14,18 @@ Notes:
         -c "morphcolors*.obj"	morph colors OBJ files (can use wildcards, enclosed in quotes multiple patterns separate by space)
         -a center|centerxz|top|bottom|none model alignment
         -s smooth|flat			smooth = export vertex normals, flat = no normals (face normals computed in loader)
-        -t ascii|binary			export ascii or binary format (ascii has more features, binary just supports vertices, faces, normals, uvs and materials)
+        -t ascii|binary|compressed	export ascii, binary or compressed format (ascii has more features, binary just supports vertices, faces, normals, uvs and materials,
+                                compressed is binary with edgebreaker-style connectivity coding and predicted quantized positions / uvs)
         -d invert|normal		invert transparency
         -b						bake material colors into face colors
         -e						export edges
         -x 10.0                 scale and truncate
+        -l group|object|none    split faces into parts by OBJ groups / objects, with bounding volumes
+        -r                      batch faces by material (one contiguous face range per material)
+        -p atlas.png            pack diffuse textures of compatible materials into atlas (needs PIL)
+        -g                      binary: store near-spherical meshes as quantized lat/lng/radial offset
+        -q 16                   compressed: quantization bits for positions and uvs
+        -j 4                    parse big OBJ files with 4 worker processes
 
     - by default:
         use smooth shading (if there were vertex normals in the original model)
@@ -26,10 +33,24 @@ Notes:
         original model is assumed to use non-inverted transparency / dissolve (0.0 fully transparent, 1.0 fully opaque)
         no face colors baking
         no edges export
+        no splitting into parts
+        faces stay in the original order, no texture atlas
+        atlas textures get a 4 pixel gutter of repeated edge pixels (no mipmap bleeding)
+        binary vertices are stored as floats
+        OBJ files are parsed in a single process
+
+    - OBJ / MTL / morph files can be gzip, bz2 or xz compressed (.gz, .bz2, .xz),
+      they are decompressed on the fly (xz needs lzma / backports.lzma in Python 2)
+
+    - NumPy is used for bounds and alignment of big meshes when it is installed
  
     - binary conversion will create two files: 
         outfile.js  (materials)
         outfile.bin (binary buffers)
+
+    - compressed conversion will create two files:
+        outfile.js  (materials)
+        outfile.ebc (compressed buffers)
     
 --------------------------------------------------
 How to use generated JS file in your HTML document
@@ -60,6 +81,33 @@ How to use generated JS file in your HTML document
         
         ...
     </script>
+
+    geodetic binary models (-g) need GeodeticBinaryLoader.js (next to globe.js
+    in globe-vertex-texture) after ThreeExtras.js, THREE.GeodeticBinaryLoader
+    decodes them into the float layout and loads them like THREE.BinaryLoader:
+
+        var geoLoader = new THREE.GeodeticBinaryLoader();
+        geoLoader.load( { model: "Model_geo.js", callback: function( geometry ) { createScene( geometry) } } );
+
+---------------------------
+Geodetic binary format (-g)
+---------------------------
+
+    - only for meshes within GEODETIC_TOLERANCE of a sphere (around the
+      origin or the bounding box center), others keep float vertices
+
+    - header is 24 bytes longer (header_bytes 84): sphere center x, y, z,
+      radius, min and max radial offset (6 floats) follow the counts
+
+    - vertex_coordinate_bytes is 2, vertices are unsigned short latitude
+      [-pi/2, pi/2], longitude [-pi, pi] and radial offset [min, max]
+
+    - implied normals: when every smooth normal points away from the sphere
+      center (NORMAL_TOLERANCE), no normals are written (nnormals 0) and
+      "impliedNormals" is true in the JS file; smooth faces then lose their
+      normal indices and are stored in the flat sections (triangles_flat,
+      triangles_flat_uv, quads_flat, quads_flat_uv), loaders have to use
+      radial normals for all faces (GeodeticBinaryLoader puts them back)
     
 -------------------------------------
 Parsers based on formats descriptions
@@ -127,7 +175,6 @@ AlteredQualia http://alteredqualia.com
 
 """
 
-import fileinput
 import operator
 import random
 import os.path
@@ -136,13 +183,21 @@ import sys
 import struct
 import math
 import glob
+import array
+import json
+import zlib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # #####################################################
 # Configuration
 # #####################################################
 ALIGN = "none"        	# center centerxz bottom top none
 SHADING = "smooth"      # smooth flat 
-TYPE = "ascii"          # ascii binary
+TYPE = "ascii"          # ascii binary compressed
 TRANSPARENCY = "normal" # normal invert
 
 TRUNCATE = False
@@ -151,6 +206,20 @@ SCALE = 1.0
 BAKE_COLORS = False
 EXPORT_EDGES = False
 
+SPLIT = "none"                  # group object none
+BATCH_MATERIALS = False          # group faces contiguously by material
+ATLAS = ""                      # pack compatible diffuse textures into this image
+ATLAS_PADDING = 4               # pixels of repeated edge around every atlas texture
+
+GEODETIC = False                # store near-spherical meshes as lat/lng/radial offset
+GEODETIC_TOLERANCE = 0.05       # max radial deviation relative to radius
+NORMAL_TOLERANCE = 0.999        # min cosine between normal and radial direction
+
+QUANTIZATION_BITS = 16          # position / uv precision of compressed format
+
+JOBS = 1                        # number of parser processes
+PARALLEL_MIN_BYTES = 1 << 20    # smaller files are always parsed serially
+
 # default colors for debugging (each material gets one distinct color): 
 # white, red, green, blue, yellow, cyan, magenta
 COLORS = [0xeeeeee, 0xee0000, 0x00ee00, 0x0000ee, 0xeeee00, 0x00eeee, 0xee00ee]
@@ -194,7 +263,7 @@ var model = {
 
     "faces": [%(faces)s],
 
-    "edges" : [%(edges)s]
+    "edges" : [%(edges)s]%(ranges)s%(parts)s
 
 };
 
@@ -218,6 +287,32 @@ var model = {
 
     "materials": [%(materials)s],
 
+    "buffers": "%(buffers)s"%(geodetic)s%(ranges)s%(parts)s
+
+};
+    
+postMessage( model );
+close();
+"""
+
+TEMPLATE_FILE_COMPRESSED = u"""\
+// Converted from: %(fname)s
+//  vertices: %(nvertex)d
+//  triangles: %(nface)d
+//  materials: %(nmaterial)d
+//
+//  Generated with OBJ -> Three.js converter
+//  http://github.com/alteredq/three.js/blob/master/utils/exporters/convert_obj_three.py
+
+
+var model = {
+
+    "version" : 1,
+
+    "encoding" : "edgebreaker",
+
+    "materials": [%(materials)s],
+
     "buffers": "%(buffers)s"
 
 };
@@ -262,12 +357,148 @@ def get_name(fname):
     """Create model name based of filename ("path/fname.js" -> "fname").
     """
 
-    return os.path.splitext(os.path.basename(fname))[0]
+    name = os.path.splitext(os.path.basename(fname))[0]
+    if is_compressed(fname):
+        name = os.path.splitext(name)[0]
+    return name
+
+# #####################################################
+# Compressed input
+# #####################################################
+COMPRESSED_EXTENSIONS = (".gz", ".bz2", ".xz")
+
+READ_CHUNK = 1 << 20
+
+def is_compressed(fname):
+    return os.path.splitext(fname)[1].lower() in COMPRESSED_EXTENSIONS
+
+def find_input(fname):
+    """Find input file, falling back to its compressed version
+    ("model.mtl" -> "model.mtl.gz").
+    """
+
+    if file_exists(fname):
+        return fname
+
+    for ext in COMPRESSED_EXTENSIONS:
+        if file_exists(fname + ext):
+            return fname + ext
+
+    return fname
+
+def decompressor(fname):
+    """Create streaming decompressor for compressed file (by extension).
+    """
+
+    ext = os.path.splitext(fname)[1].lower()
+
+    if ext == ".gz":
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    if ext == ".bz2":
+        import bz2
+        return bz2.BZ2Decompressor()
+
+    if ext == ".xz":
+        try:
+            import lzma
+        except ImportError:
+            try:
+                from backports import lzma
+            except ImportError:
+                raise ImportError("reading [%s] needs lzma module (backports.lzma for Python 2)" % fname)
+        return lzma.LZMADecompressor()
+
+def glob_inputs(pattern):
+    """Sorted files matching pattern, including compressed versions
+    ("morph*.obj" matches also "morph1.obj.gz").
+    """
+
+    matches = set(glob.glob(pattern))
+    for ext in COMPRESSED_EXTENSIONS:
+        matches.update(glob.glob(pattern + ext))
+    return sorted(matches)
+
+def input_lines(fname):
+    """Iterate over lines of input file, decompressing gzip / bz2 / xz
+    files on the fly (without temporary files).
+
+    Compressed data is read and decompressed in big chunks and split
+    into lines here, which is much faster than line by line reading
+    through gzip / bz2 file objects. Concatenated streams are supported.
+    """
+
+    if not is_compressed(fname):
+        f = open(fname, "r")
+        try:
+            for line in f:
+                yield line
+        finally:
+            f.close()
+        return
+
+    f = open(fname, "rb")
+    try:
+        d = decompressor(fname)
+        pending = ""
+
+        while True:
+            chunk = f.read(READ_CHUNK)
+            if not chunk:
+                break
+
+            while chunk:
+                # next concatenated stream, also when the previous one
+                # ended exactly at the end of a read
+                if getattr(d, "eof", False):
+                    d = decompressor(fname)
+
+                try:
+                    data = d.decompress(chunk)
+                except EOFError:
+                    # no eof attribute (Python 2 bz2), stream had ended
+                    d = decompressor(fname)
+                    data = d.decompress(chunk)
+                chunk = ""
+
+                if getattr(d, "unused_data", ""):
+                    chunk = d.unused_data
+                    d = decompressor(fname)
+
+                if data:
+                    lines = (pending + data).split("\n")
+                    pending = lines.pop()
+                    for line in lines:
+                        yield line
+
+        if pending:
+            yield pending
+    finally:
+        f.close()
+
+class Vertices(list):
+    """Vertex list of the OBJ parsers, bb is its bounding box, gathered
+    while parsing and kept up to date by align.
+    """
+
+    def __init__(self, items=(), bb=None):
+        list.__init__(self, items)
+        self.bb = bb
 
 def bbox(vertices):
     """Compute bounding box of vertex array.
     """
-    
+
+    bb = getattr(vertices, 'bb', None)
+    if bb is not None:
+        return { 'x':list(bb['x']), 'y':list(bb['y']), 'z':list(bb['z']) }
+
+    if len(vertices)>0 and numpy is not None:
+        points = numpy.asarray(vertices, dtype=numpy.float64).reshape(-1, 3)
+        lo = points.min(axis=0).tolist()
+        hi = points.max(axis=0).tolist()
+        return { 'x':[lo[0],hi[0]], 'y':[lo[1],hi[1]], 'z':[lo[2],hi[2]] }
+
     if len(vertices)>0:
         minx = maxx = vertices[0][0]
         miny = maxy = vertices[0][1]
@@ -295,61 +526,90 @@ def bbox(vertices):
         return { 'x':[0,0], 'y':[0,0], 'z':[0,0] }
 
 def translate(vertices, t):
-    """Translate array of vertices by vector t.
+    """Translate array of vertices by vector t (in one NumPy operation when available).
     """
-    
+
+    if numpy is not None and len(vertices):
+        vertices[:] = (numpy.asarray(vertices, dtype=numpy.float64).reshape(-1, 3) + t).tolist()
+        return
+
     for i in xrange(len(vertices)):
         vertices[i][0] += t[0]
         vertices[i][1] += t[1]
         vertices[i][2] += t[2]
         
-def center(vertices):
-    """Center model (middle of bounding box).
+def alignment(bb, align):
+    """Compute translation aligning bounding box according to align mode.
     """
-    
-    bb = bbox(vertices)
-    
+
+    if align == "none":
+        return [0, 0, 0]
+
     cx = bb['x'][0] + (bb['x'][1] - bb['x'][0])/2.0
-    cy = bb['y'][0] + (bb['y'][1] - bb['y'][0])/2.0
     cz = bb['z'][0] + (bb['z'][1] - bb['z'][0])/2.0
+
+    if align == "center":
+        cy = bb['y'][0] + (bb['y'][1] - bb['y'][0])/2.0
+    elif align == "top":
+        cy = bb['y'][1]
+    elif align == "bottom":
+        cy = bb['y'][0]
+    else:
+        cy = 0
+
+    return [-cx, -cy, -cz]
+
+def align(vertices, align=None):
+    """Align model according to align mode (ALIGN by default).
+
+    Returns bounding box of aligned vertices (None if not aligned),
+    it is just the original one shifted. Vertices from the parsers
+    carry their bounds, so they are not scanned for them at all.
+    """
+
+    if align is None:
+        align = ALIGN
+
+    if align == "none":
+        return None
+
+    bb = bbox(vertices)
+
+    if vertices:
+        t = alignment(bb, align)
+        translate(vertices, t)
+        bb = { 'x':[bb['x'][0] + t[0], bb['x'][1] + t[0]],
+               'y':[bb['y'][0] + t[1], bb['y'][1] + t[1]],
+               'z':[bb['z'][0] + t[2], bb['z'][1] + t[2]] }
+
+        if isinstance(vertices, Vertices):
+            vertices.bb = bb
+
+    return bb
+
+def center(vertices):
+    """Center model (middle of bounding box).
+    """
     
-    translate(vertices, [-cx,-cy,-cz])
+    align(vertices, "center")
 
 def top(vertices):
     """Align top of the model with the floor (Y-axis) and center it around X and Z.
     """
     
-    bb = bbox(vertices)
-    
-    cx = bb['x'][0] + (bb['x'][1] - bb['x'][0])/2.0
-    cy = bb['y'][1]
-    cz = bb['z'][0] + (bb['z'][1] - bb['z'][0])/2.0
-    
-    translate(vertices, [-cx,-cy,-cz])
+    align(vertices, "top")
     
 def bottom(vertices):
     """Align bottom of the model with the floor (Y-axis) and center it around X and Z.
     """
     
-    bb = bbox(vertices)
-    
-    cx = bb['x'][0] + (bb['x'][1] - bb['x'][0])/2.0
-    cy = bb['y'][0] 
-    cz = bb['z'][0] + (bb['z'][1] - bb['z'][0])/2.0
-    
-    translate(vertices, [-cx,-cy,-cz])
+    align(vertices, "bottom")
 
 def centerxz(vertices):
     """Center model around X and Z.
     """
     
-    bb = bbox(vertices)
-    
-    cx = bb['x'][0] + (bb['x'][1] - bb['x'][0])/2.0
-    cy = 0 
-    cz = bb['z'][0] + (bb['z'][1] - bb['z'][0])/2.0
-    
-    translate(vertices, [-cx,-cy,-cz])
+    align(vertices, "centerxz")
 
 def normalize(v):
     """Normalize 3d vector"""
@@ -376,7 +636,7 @@ def parse_mtl(fname):
     
     materials = {}
     
-    for line in fileinput.input(fname):
+    for line in input_lines(fname):
         chunks = line.split()
         if len(chunks) > 0:
             
@@ -497,7 +757,7 @@ def parse_obj(fname):
     """Parse OBJ file.
     """
     
-    vertices = []
+    vertices = Vertices()
     normals = []
     uvs = []
     
@@ -506,6 +766,11 @@ def parse_obj(fname):
     materials = {}
     mcounter = 0
     mcurrent = 0
+
+    # bounds, gathered here so nothing has to scan vertices for them
+    inf = float("inf")
+    minx = miny = minz = inf
+    maxx = maxy = maxz = -inf
     
     mtllib = ""
     
@@ -514,7 +779,7 @@ def parse_obj(fname):
     object = 0
     smooth = 0
     
-    for line in fileinput.input(fname):
+    for line in input_lines(fname):
         chunks = line.split()
         if len(chunks) > 0:
             
@@ -526,6 +791,13 @@ def parse_obj(fname):
                 z = float(chunks[3])
                 vertices.append([x,y,z])
 
+                if x < minx: minx = x
+                if x > maxx: maxx = x
+                if y < miny: miny = y
+                if y > maxy: maxy = y
+                if z < minz: minz = z
+                if z > maxz: maxz = z
+
             # Normals in (x,y,z) form; normals might not be unit
             # vn 0.707 0.000 0.707
             if chunks[0] == "vn" and len(chunks) == 4:
@@ -596,8 +868,258 @@ def parse_obj(fname):
             if chunks[0] == "s" and len(chunks) == 2:
                 smooth = chunks[1]
 
+    if vertices:
+        vertices.bb = { 'x':[minx,maxx], 'y':[miny,maxy], 'z':[minz,maxz] }
+
     return faces, vertices, uvs, normals, materials, mtllib
-    
+
+# #####################################################
+# OBJ parser - parallel
+# #####################################################
+def split_byte_ranges(fname, nchunks):
+    """Split file into byte ranges ending on line boundaries.
+    """
+
+    size = os.path.getsize(fname)
+    step = max(size / nchunks, 1)
+
+    boundaries = [0]
+
+    f = open(fname, "rb")
+    for i in xrange(1, nchunks):
+        offset = max(i * step, boundaries[-1])
+        if offset >= size:
+            break
+        f.seek(offset)
+        f.readline()
+        position = f.tell()
+        if position > boundaries[-1] and position < size:
+            boundaries.append(position)
+    f.close()
+
+    boundaries.append(size)
+
+    return zip(boundaries[:-1], boundaries[1:])
+
+def parse_obj_chunk(job):
+    """Parse byte range of OBJ file.
+
+    To keep transfer between processes cheap, coordinates and face
+    indices are returned as flat arrays:
+
+        vertices, normals, uvs      x,y,z / x,y,z / u,v,w per element
+        indices                     nv,nuv,nn followed by indices per face
+        fstates                     index into states per face
+        bounds                      min x,y,z and max x,y,z of the vertices
+
+    State set by statements from previous chunks (usemtl, g, o, s)
+    is not known here, it is None in states until first change
+    in the chunk and gets fixed in merge.
+    """
+
+    fname, start, end = job
+
+    f = open(fname, "rb")
+    f.seek(start)
+    data = f.read(end - start)
+    f.close()
+
+    vertices = array.array('d')
+    normals = array.array('d')
+    uvs = array.array('d')
+
+    indices = array.array('i')
+    fstates = array.array('i')
+
+    # (material name, group, object, smooth)
+    states = []
+    current = [None, None, None, None]
+    changed = True
+
+    # material names in the order of usemtl statements (first occurrence)
+    mnames = []
+    mseen = set()
+
+    mtllib = None
+
+    for line in data.split("\n"):
+        chunks = line.split()
+        if len(chunks) > 0:
+
+            if chunks[0] == "v" and len(chunks) == 4:
+                vertices.extend((float(chunks[1]), float(chunks[2]), float(chunks[3])))
+
+            if chunks[0] == "vn" and len(chunks) == 4:
+                normals.extend((float(chunks[1]), float(chunks[2]), float(chunks[3])))
+
+            if chunks[0] == "vt" and len(chunks) >= 3:
+                w = 0
+                if len(chunks)>3:
+                    w = float(chunks[3])
+                uvs.extend((float(chunks[1]), float(chunks[2]), w))
+
+            if chunks[0] == "f" and len(chunks) >= 4:
+                vertex_index = []
+                uv_index = []
+                normal_index = []
+
+                for v in chunks[1:]:
+                    vertex = parse_vertex(v)
+                    if vertex['v']:
+                        vertex_index.append(vertex['v'])
+                    if vertex['t']:
+                        uv_index.append(vertex['t'])
+                    if vertex['n']:
+                        normal_index.append(vertex['n'])
+
+                indices.extend((len(vertex_index), len(uv_index), len(normal_index)))
+                indices.extend(vertex_index)
+                indices.extend(uv_index)
+                indices.extend(normal_index)
+
+                if changed:
+                    states.append(tuple(current))
+                    changed = False
+                fstates.append(len(states) - 1)
+
+            if chunks[0] == "g" and len(chunks) == 2:
+                current[1] = chunks[1]
+                changed = True
+
+            if chunks[0] == "o" and len(chunks) == 2:
+                current[2] = chunks[1]
+                changed = True
+
+            if chunks[0] == "mtllib" and len(chunks) == 2:
+                mtllib = chunks[1]
+
+            if chunks[0] == "usemtl" and len(chunks) == 2:
+                current[0] = chunks[1]
+                changed = True
+                if not chunks[1] in mseen:
+                    mseen.add(chunks[1])
+                    mnames.append(chunks[1])
+
+            if chunks[0] == "s" and len(chunks) == 2:
+                current[3] = chunks[1]
+                changed = True
+
+    bounds = None
+    if vertices:
+        bounds = [min(vertices[i::3]) for i in xrange(3)] + [max(vertices[i::3]) for i in xrange(3)]
+
+    return vertices, normals, uvs, indices, fstates, states, tuple(current), mnames, mtllib, bounds
+
+def merge_obj_chunks(results):
+    """Merge parsed chunks into the same structures parse_obj returns.
+    """
+
+    vertices = Vertices()
+    normals = []
+    uvs = []
+
+    faces = []
+
+    materials = {}
+    mcounter = 0
+
+    mtllib = ""
+
+    lo = hi = None
+
+    # face state carried over chunk boundaries
+    # (material is kept as name, None means no usemtl seen yet)
+    carried = (None, 0, 0, 0)
+
+    for cvertices, cnormals, cuvs, indices, fstates, states, last, mnames, cmtllib, cbounds in results:
+
+        if cbounds is not None:
+            if lo is None:
+                lo, hi = cbounds[:3], cbounds[3:]
+            else:
+                lo = map(min, lo, cbounds[:3])
+                hi = map(max, hi, cbounds[3:])
+
+        for flat, out in ((cvertices, vertices), (cnormals, normals), (cuvs, uvs)):
+            it = iter(flat)
+            out.extend([x, y, z] for x, y, z in zip(it, it, it))
+
+        for name in mnames:
+            if not name in materials:
+                materials[name] = mcounter
+                mcounter += 1
+
+        resolved = []
+        for state in states:
+            state = [c if s is None else s for s, c in zip(state, carried)]
+            if state[0] is None:
+                state[0] = 0
+            else:
+                state[0] = materials[state[0]]
+            resolved.append(state)
+
+        i = 0
+        for k in fstates:
+            nv = indices[i]
+            nt = indices[i+1]
+            nn = indices[i+2]
+            i += 3
+
+            material, group, object, smooth = resolved[k]
+
+            faces.append({
+                'vertex':indices[i:i+nv].tolist(),
+                'uv':indices[i+nv:i+nv+nt].tolist(),
+                'normal':indices[i+nv+nt:i+nv+nt+nn].tolist(),
+
+                'material':material,
+                'group':group,
+                'object':object,
+                'smooth':smooth,
+                })
+
+            i += nv + nt + nn
+
+        carried = tuple(c if s is None else s for s, c in zip(last, carried))
+
+        if cmtllib is not None:
+            mtllib = cmtllib
+
+    if lo is not None:
+        vertices.bb = { 'x':[lo[0],hi[0]], 'y':[lo[1],hi[1]], 'z':[lo[2],hi[2]] }
+
+    return faces, vertices, uvs, normals, materials, mtllib
+
+def parse_obj_parallel(fname, jobs):
+    """Parse OBJ file in parallel, splitting it into byte ranges
+    parsed by a pool of worker processes.
+
+    Result is the same as from serial parse_obj.
+    """
+
+    import multiprocessing
+
+    ranges = split_byte_ranges(fname, jobs)
+
+    pool = multiprocessing.Pool(min(jobs, len(ranges)))
+    try:
+        results = pool.map(parse_obj_chunk, [(fname, start, end) for start, end in ranges])
+    finally:
+        pool.close()
+        pool.join()
+
+    return merge_obj_chunks(results)
+
+def load_obj(fname):
+    """Parse OBJ file, in parallel if requested and file is big enough
+    (compressed files can't be split into byte ranges, they are parsed serially).
+    """
+
+    if JOBS > 1 and not is_compressed(fname) and os.path.getsize(fname) >= PARALLEL_MIN_BYTES:
+        return parse_obj_parallel(fname, JOBS)
+
+    return parse_obj(fname)
+
 # #####################################################
 # Generator - faces
 # #####################################################
@@ -757,8 +1279,7 @@ def generate_morph_targets(morphfiles, n_vertices, infile):
 
     for mfilepattern in morphfiles.split():
 
-        matches = glob.glob(mfilepattern)
-        matches.sort()
+        matches = glob_inputs(mfilepattern)
 
         for path in matches:
 
@@ -768,7 +1289,7 @@ def generate_morph_targets(morphfiles, n_vertices, infile):
 
                 name = os.path.basename(normpath)
                 
-                morphFaces, morphVertices, morphUvs, morphNormals, morphMaterials, morphMtllib = parse_obj(normpath)
+                morphFaces, morphVertices, morphUvs, morphNormals, morphMaterials, morphMtllib = load_obj(normpath)
                 
                 n_morph_vertices = len(morphVertices)
 
@@ -778,14 +1299,7 @@ def generate_morph_targets(morphfiles, n_vertices, infile):
 
                 else:
                     
-                    if ALIGN == "center":
-                        center(morphVertices)
-                    elif ALIGN == "centerxz":
-                        centerxz(morphVertices)
-                    elif ALIGN == "bottom":
-                        bottom(morphVertices)
-                    elif ALIGN == "top":
-                        top(morphVertices)
+                    align(morphVertices)
                         
                     morphVertexData.append((get_name(name), morphVertices))
                     print "adding [%s] with %d vertices" % (name, n_morph_vertices)
@@ -796,20 +1310,19 @@ def generate_morph_targets(morphfiles, n_vertices, infile):
 
     return morphTargets
     
-def generate_morph_colors(colorfiles, n_vertices, n_faces):
+def generate_morph_colors(colorfiles, n_vertices, n_faces, order=None):
     morphColorData = []
     colorFaces = []
     materialColors = []
     
     for mfilepattern in colorfiles.split():
 
-        matches = glob.glob(mfilepattern)
-        matches.sort()
+        matches = glob_inputs(mfilepattern)
         for path in matches:
             normpath = os.path.normpath(path)
             name = os.path.basename(normpath)
 
-            morphFaces, morphVertices, morphUvs, morphNormals, morphMaterials, morphMtllib = parse_obj(normpath)
+            morphFaces, morphVertices, morphUvs, morphNormals, morphMaterials, morphMtllib = load_obj(normpath)
 
             n_morph_vertices = len(morphVertices)
             n_morph_faces = len(morphFaces)
@@ -824,6 +1337,9 @@ def generate_morph_colors(colorfiles, n_vertices, n_faces):
 
             else:
 
+                if order:
+                    morphFaces = [morphFaces[i] for i in order]
+
                 morphMaterialColors = extract_material_colors(morphMaterials, morphMtllib, normpath)  
                 morphFaceColors = extract_face_colors(morphFaces, morphMaterialColors)
                 morphColorData.append((get_name(name), morphFaceColors))
@@ -979,14 +1495,22 @@ def generate_mtl(materials):
         }
     return mtl
     
-def generate_materials_string(materials, mtlfilename, basename):
+def generate_materials_string(materials, mtlfilename, basename, textures=None):
     """Generate final materials string.
+
+    Optional textures dict overrides diffuse maps (material name -> texture).
     """
 
     if not materials:
         materials = { 'default': 0 }
 
     mtl = create_materials(materials, mtlfilename, basename)
+
+    if textures:
+        for m in textures:
+            if m in mtl:
+                mtl[m]['mapDiffuse'] = textures[m]
+
     return generate_materials(mtl, materials)
     
 def create_materials(materials, mtlfilename, basename):
@@ -1007,7 +1531,7 @@ def create_materials(materials, mtlfilename, basename):
         # create full pathname for MTL (included from OBJ)
 
         path = os.path.dirname(basename)
-        fname = os.path.join(path, mtlfilename)
+        fname = find_input(os.path.join(path, mtlfilename))
         
         if file_exists(fname):
 
@@ -1083,37 +1607,500 @@ def sort_faces(faces):
 
     return data
 
+# #####################################################
+# Material batching
+# #####################################################
+def reorder_faces(faces):
+    """Stable sort faces by part (if splitting) and material (if batching),
+    so that each part / material is one contiguous run of faces.
+
+    Returns permutation of the original face order.
+    """
+
+    parts = {}
+    keys = []
+    for f in faces:
+        part = 0
+        if SPLIT != "none":
+            part = parts.setdefault(f[SPLIT], len(parts))
+        material = 0
+        if BATCH_MATERIALS:
+            material = f['material']
+        keys.append((part, material))
+
+    order = sorted(xrange(len(faces)), key=keys.__getitem__)
+    faces[:] = [faces[i] for i in order]
+    return order
+
+def material_ranges(faces):
+    """Compute runs of faces with the same material as [material, start, count].
+    """
+
+    ranges = []
+    for i, f in enumerate(faces):
+        if ranges and ranges[-1][0] == f['material'] and ranges[-1][1] + ranges[-1][2] == i:
+            ranges[-1][2] += 1
+        else:
+            ranges.append([f['material'], i, 1])
+    return ranges
+
+def generate_ranges(ranges):
+    return ",".join("[%d,%d,%d]" % (m, start, count) for m, start, count in ranges)
+
+def generate_ranges_ascii(faces):
+    return ',\n\n    "materialRanges" : [%s]' % generate_ranges(material_ranges(faces))
+
+def generate_ranges_binary(sfaces):
+    """Material ranges for each face section of the binary file.
+    """
+
+    chunks = []
+    for name in sorted(sfaces):
+        if sfaces[name]:
+            chunks.append('\t"%s" : [%s]' % (name, generate_ranges(material_ranges(sfaces[name]))))
+    return ',\n\n    "materialRanges" : {\n%s\n    }' % ",\n".join(chunks)
+
+def material_signature(m):
+    """Properties which must match for materials to share one atlas texture.
+    """
+
+    return tuple(sorted((k, str(v)) for k, v in m.items() if not k.startswith("Dbg") and k != "mapDiffuse"))
+
+def pack_rectangles(sizes):
+    """Shelf pack rectangles (largest first) into power of two sized area.
+
+    Returns list of (x, y) positions and atlas (width, height).
+    """
+
+    order = sorted(xrange(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0]))
+
+    width = 1
+    while width * width < sum(w * h for w, h in sizes) or width < max(w for w, h in sizes):
+        width *= 2
+
+    while True:
+        positions = [None] * len(sizes)
+        x = y = shelf = 0
+        for i in order:
+            w, h = sizes[i]
+            if x + w > width:
+                x = 0
+                y += shelf
+                shelf = 0
+            positions[i] = (x, y)
+            x += w
+            shelf = max(shelf, h)
+
+        height = 1
+        while height < y + shelf:
+            height *= 2
+
+        if height <= width:
+            return positions, (width, height)
+
+        width *= 2
+
+def pad_image(image, padding):
+    """Image with its edge pixels repeated padding times around it.
+    """
+
+    if not padding:
+        return image
+
+    from PIL import Image
+
+    w, h = image.size
+    p = padding
+
+    padded = Image.new(image.mode, (w + 2 * p, h + 2 * p))
+    padded.paste(image, (p, p))
+    padded.paste(image.crop((0, 0, w, 1)).resize((w, p), Image.NEAREST), (p, 0))
+    padded.paste(image.crop((0, h - 1, w, h)).resize((w, p), Image.NEAREST), (p, p + h))
+
+    # columns of the padded image, so corners get the corner pixels
+    padded.paste(padded.crop((p, 0, p + 1, h + 2 * p)).resize((p, h + 2 * p), Image.NEAREST), (0, 0))
+    padded.paste(padded.crop((p + w - 1, 0, p + w, h + 2 * p)).resize((p, h + 2 * p), Image.NEAREST), (p + w, 0))
+
+    return padded
+
+def pack_atlas(faces, uvs, materials, mtllib, basename, atlasfile, outfile):
+    """Pack diffuse textures of compatible materials into one atlas image.
+
+    Materials are compatible if they differ only in diffuse texture and
+    faces using them have uvs within [0,1] (no texture repeat). Faces of
+    packed materials get the first material of the group, their uvs are
+    duplicated per material and remapped into the atlas.
+
+    Every texture gets a gutter of ATLAS_PADDING repeated edge pixels,
+    so mipmaps don't bleed into neighbours. Atlas is saved to atlasfile,
+    materials refer to it relative to outfile.
+
+    Requires PIL. Returns new uvs, new materials and texture overrides
+    for generate_materials_string.
+    """
+
+    try:
+        from PIL import Image
+    except ImportError:
+        print "WARNING: PIL is needed for texture atlas, skipping [%s]" % atlasfile
+        return uvs, materials, {}
+
+    mtl = create_materials(materials, mtllib, basename)
+    path = os.path.dirname(basename)
+
+    # candidates: materials with existing diffuse texture and uvs in [0,1]
+
+    inside = {}
+    for f in faces:
+        m = f['material']
+        if inside.get(m, True):
+            inside[m] = len(f['uv']) == len(f['vertex']) and \
+                        all(0.0 <= uvs[i-1][0] <= 1.0 and 0.0 <= uvs[i-1][1] <= 1.0 for i in f['uv'])
+
+    groups = {}
+    for name, index in materials.items():
+        texture = mtl.get(name, {}).get("mapDiffuse")
+        if texture and inside.get(index) and file_exists(os.path.join(path, texture)):
+            groups.setdefault(material_signature(mtl[name]), []).append(name)
+
+    groups = [sorted(g, key=lambda n: materials[n]) for g in groups.values() if len(g) > 1]
+
+    if not groups:
+        print "WARNING: no compatible textured materials for atlas [%s]" % atlasfile
+        return uvs, materials, {}
+
+    # the biggest group gets the atlas
+
+    group = max(groups, key=len)
+
+    images = {}
+    for name in group:
+        texture = mtl[name]["mapDiffuse"]
+        if texture not in images:
+            images[texture] = Image.open(os.path.join(path, texture)).convert("RGBA")
+
+    textures = sorted(images)
+    padded = [pad_image(images[t], ATLAS_PADDING) for t in textures]
+    positions, size = pack_rectangles([image.size for image in padded])
+
+    atlas = Image.new("RGBA", size)
+    for image, position in zip(padded, positions):
+        atlas.paste(image, position)
+    atlas.save(atlasfile)
+
+    # remap uvs (v is flipped, image rows go from the top)
+
+    W, H = float(size[0]), float(size[1])
+    rects = {}
+    for t, (x, y) in zip(textures, positions):
+        w, h = images[t].size
+        rects[t] = (x + ATLAS_PADDING, y + ATLAS_PADDING, w, h)
+
+    leader = group[0]
+    packed = dict((materials[name], rects[mtl[name]["mapDiffuse"]]) for name in group)
+
+    new_uvs = list(uvs)
+    remapped = {}
+    for f in faces:
+        m = f['material']
+        if m in packed:
+            x, y, w, h = packed[m]
+            for j, i in enumerate(f['uv']):
+                key = (i, m)
+                if key not in remapped:
+                    u, v = uvs[i-1][0], uvs[i-1][1]
+                    new_uvs.append([(x + u * w) / W, 1.0 - (y + (1.0 - v) * h) / H, uvs[i-1][2]])
+                    remapped[key] = len(new_uvs)
+                f['uv'][j] = remapped[key]
+            f['material'] = materials[leader]
+
+    # drop merged materials and renumber the rest in original order
+
+    kept = sorted((index, name) for name, index in materials.items() if name == leader or name not in group)
+    reindex = dict((materials[name], i) for i, (index, name) in enumerate(kept))
+    for f in faces:
+        f['material'] = reindex[f['material']]
+
+    new_materials = dict((name, i) for i, (index, name) in enumerate(kept))
+
+    print "packed %d textures into [%s] %dx%d" % (len(textures), atlasfile, size[0], size[1])
+
+    texture = os.path.relpath(os.path.abspath(atlasfile), os.path.dirname(os.path.abspath(outfile)))
+
+    return new_uvs, new_materials, { leader: texture.replace(os.sep, "/") }
+
+def optimize_materials(faces, uvs, materials, mtllib, basename, outfile):
+    """Optional atlas packing, material batching and splitting into parts.
+    """
+
+    textures = {}
+    order = None
+
+    if ATLAS:
+        uvs, materials, textures = pack_atlas(faces, uvs, materials, mtllib, basename, ATLAS, outfile)
+
+    if BATCH_MATERIALS or SPLIT != "none":
+        order = reorder_faces(faces)
+
+    return uvs, materials, textures, order
+
+# #####################################################
+# Geodetic encoding
+# #####################################################
+def fit_sphere(vertices, bb=None):
+    """Find sphere the vertices lie on (or near).
+
+    Both origin and bounding box center are tried as sphere center
+    (meshes can cover just part of the globe). Returns dict with
+    center, radius and range of radial offsets, or None if the mesh
+    deviates from the sphere more than GEODETIC_TOLERANCE.
+    """
+
+    if not vertices:
+        return None
+
+    if bb is None:
+        bb = bbox(vertices)
+    candidates = [[0.0, 0.0, 0.0],
+                  [(bb['x'][0] + bb['x'][1])/2.0, (bb['y'][0] + bb['y'][1])/2.0, (bb['z'][0] + bb['z'][1])/2.0]]
+
+    best = None
+    for c in candidates:
+        cx, cy, cz = c
+        radii = [math.sqrt((x-cx)*(x-cx) + (y-cy)*(y-cy) + (z-cz)*(z-cz)) for x, y, z in vertices]
+        radius = sum(radii) / len(radii)
+        if not radius:
+            continue
+
+        rmin = min(radii)
+        rmax = max(radii)
+        deviation = max(radius - rmin, rmax - radius) / radius
+
+        if deviation <= GEODETIC_TOLERANCE and (best is None or deviation < best['deviation']):
+            best = { 'center':c, 'radius':radius, 'offset':[rmin - radius, rmax - radius], 'deviation':deviation }
+
+    return best
+
+def normals_implied(faces, vertices, normals, sphere):
+    """Check if smooth normals are just radial directions of their vertices.
+    """
+
+    if SHADING != "smooth" or not normals:
+        return False
+
+    cx, cy, cz = sphere['center']
+
+    for f in faces:
+        for vi, ni in zip(f['vertex'], f['normal']):
+            x, y, z = vertices[vi-1]
+            d = [x - cx, y - cy, z - cz]
+            n = list(normals[ni-1])
+            normalize(d)
+            normalize(n)
+            if d[0]*n[0] + d[1]*n[1] + d[2]*n[2] < NORMAL_TOLERANCE:
+                return False
+
+    return True
+
+def quantize(value, lo, hi, bits):
+    top = (1 << bits) - 1
+    if hi <= lo:
+        return 0
+    return max(0, min(top, int(math.floor((value - lo) / (hi - lo) * top + 0.5))))
+
+def dequantize(q, lo, hi, bits):
+    return lo + (hi - lo) * q / float((1 << bits) - 1)
+
+def geodetic_vertex(v, sphere):
+    """Encode vertex as quantized (latitude, longitude, radial offset).
+
+        x = cx + r * cos(lat) * cos(lng)
+        y = cy + r * sin(lat)
+        z = cz + r * cos(lat) * sin(lng)
+
+        r = radius + offset
+    """
+
+    x = v[0] - sphere['center'][0]
+    y = v[1] - sphere['center'][1]
+    z = v[2] - sphere['center'][2]
+
+    r = math.sqrt(x*x + y*y + z*z)
+    if r:
+        lat = math.asin(max(-1.0, min(1.0, y / r)))
+    else:
+        lat = 0.0
+    lng = math.atan2(z, x)
+
+    return (quantize(lat, -math.pi/2, math.pi/2, 16),
+            quantize(lng, -math.pi, math.pi, 16),
+            quantize(r - sphere['radius'], sphere['offset'][0], sphere['offset'][1], 16))
+
+def geodetic_position(q, sphere):
+    """Decode quantized (latitude, longitude, radial offset) into position.
+    """
+
+    lat = dequantize(q[0], -math.pi/2, math.pi/2, 16)
+    lng = dequantize(q[1], -math.pi, math.pi, 16)
+    r = sphere['radius'] + dequantize(q[2], sphere['offset'][0], sphere['offset'][1], 16)
+
+    return [sphere['center'][0] + r * math.cos(lat) * math.cos(lng),
+            sphere['center'][1] + r * math.sin(lat),
+            sphere['center'][2] + r * math.cos(lat) * math.sin(lng)]
+
+def generate_geodetic(sphere, implied):
+    return ',\n\n    "encoding" : "geodetic",\n\n    "sphere" : { "center": [%f,%f,%f], "radius": %f, "offset": [%f,%f], "impliedNormals": %s }' % (
+        sphere['center'][0], sphere['center'][1], sphere['center'][2],
+        sphere['radius'], sphere['offset'][0], sphere['offset'][1],
+        value2string(implied))
+
+# #####################################################
+# Parts
+# #####################################################
+def bounds(vertices, indices=None, bb=None):
+    """Compute bounding box and bounding sphere of vertices
+    (optionally only of those with given 0-based indices).
+
+    Sphere is centered in the middle of bounding box, which is
+    computed unless already known. Vertices can be a NumPy array.
+    """
+
+    if numpy is None:
+        return bounds_python(vertices, indices, bb)
+
+    points = numpy.asarray(vertices, dtype=numpy.float64).reshape(-1, 3)
+    if indices is not None:
+        points = points[numpy.asarray(indices, dtype=numpy.intp)]
+
+    if not len(points):
+        return bbox([]), [0.0, 0.0, 0.0, 0.0]
+
+    if bb is None:
+        lo = points.min(axis=0).tolist()
+        hi = points.max(axis=0).tolist()
+        bb = { 'x':[lo[0],hi[0]], 'y':[lo[1],hi[1]], 'z':[lo[2],hi[2]] }
+
+    c = numpy.array([(bb['x'][0] + bb['x'][1]) / 2.0,
+                     (bb['y'][0] + bb['y'][1]) / 2.0,
+                     (bb['z'][0] + bb['z'][1]) / 2.0])
+
+    r2 = float(((points - c) ** 2).sum(axis=1).max())
+
+    return bb, c.tolist() + [math.sqrt(r2)]
+
+def bounds_python(vertices, indices=None, bb=None):
+    """bounds without NumPy.
+    """
+
+    if indices is not None:
+        vertices = [vertices[i] for i in indices]
+
+    if not vertices:
+        return bbox(vertices), [0.0, 0.0, 0.0, 0.0]
+
+    if bb is None:
+        bb = bbox(vertices)
+
+    cx = (bb['x'][0] + bb['x'][1]) / 2.0
+    cy = (bb['y'][0] + bb['y'][1]) / 2.0
+    cz = (bb['z'][0] + bb['z'][1]) / 2.0
+
+    r2 = max((x-cx)*(x-cx) + (y-cy)*(y-cy) + (z-cz)*(z-cz) for x, y, z in vertices)
+
+    return bb, [cx, cy, cz, math.sqrt(r2)]
+
+def part_name(f):
+    name = f[SPLIT]
+    if not name:
+        return ""
+    return str(name)
+
+def part_ranges(faces):
+    """Compute runs of faces within the same part as [name, start, count].
+    """
+
+    ranges = []
+    for i, f in enumerate(faces):
+        name = part_name(f)
+        if ranges and ranges[-1][0] == name and ranges[-1][1] + ranges[-1][2] == i:
+            ranges[-1][2] += 1
+        else:
+            ranges.append([name, i, 1])
+    return ranges
+
+def generate_bounds(bb, sphere):
+    return '"boundingBox": [%f,%f,%f,%f,%f,%f], "boundingSphere": [%f,%f,%f,%f]' % (
+            bb['x'][0], bb['y'][0], bb['z'][0], bb['x'][1], bb['y'][1], bb['z'][1],
+            sphere[0], sphere[1], sphere[2], sphere[3])
+
+def generate_parts(sections, vertices, bb=None):
+    """Generate parts with their face ranges in each section of faces
+    and bounding volumes, plus whole model bounds.
+    """
+
+    names = []
+    ranges = {}
+    indices = {}
+
+    for section in sorted(sections):
+        for name, start, count in part_ranges(sections[section]):
+            if name not in ranges:
+                names.append(name)
+                ranges[name] = []
+                indices[name] = set()
+            ranges[name].append('"%s": [%d,%d]' % (section, start, count))
+            for f in sections[section][start:start+count]:
+                indices[name].update(i - 1 for i in f['vertex'])
+
+    # vertices are converted for NumPy once, not for every part
+    points = vertices
+    if numpy is not None:
+        points = numpy.asarray(vertices, dtype=numpy.float64).reshape(-1, 3)
+
+    chunks = []
+    for name in names:
+        bb, sphere = bounds(points, sorted(indices[name]))
+        chunks.append('\t{ "name": %s, "faces": { %s }, %s }' % (json.dumps(name), ", ".join(ranges[name]), generate_bounds(bb, sphere)))
+
+    bb, sphere = bounds(points, bb=bb)
+
+    return ',\n\n    "bounds" : { %s },\n\n    "parts" : [\n%s\n    ]' % (generate_bounds(bb, sphere), ",\n".join(chunks))
+
 # #####################################################
 # API - ASCII converter
 # #####################################################
-def convert_ascii(infile, morphfiles, colorfiles, outfile):
+def convert_ascii(infile, morphfiles, colorfiles, outfile, model=None):
     """Convert infile.obj to outfile.js
     
     Here is where everything happens. If you need to automate conversions,
     just import this file as Python module and call this method.
+
+    Geometry built in memory can be passed as model, a tuple
+    (faces, vertices, uvs, normals, materials, mtllib) like load_obj returns,
+    infile is then only used as source name.
     """
     
-    if not file_exists(infile):
-        print "Couldn't find [%s]" % infile
-        return
+    if model is None:
+        if not file_exists(infile):
+            print "Couldn't find [%s]" % infile
+            return
        
-    # parse OBJ / MTL files
+        # parse OBJ / MTL files
+
+        model = load_obj(infile)
 
-    faces, vertices, uvs, normals, materials, mtllib = parse_obj(infile)
+    faces, vertices, uvs, normals, materials, mtllib = model
 
     n_vertices = len(vertices)
     n_faces = len(faces)
 
     # align model
 
-    if ALIGN == "center":
-        center(vertices)
-    elif ALIGN == "centerxz":
-        centerxz(vertices)
-    elif ALIGN == "bottom":
-        bottom(vertices)
-    elif ALIGN == "top":
-        top(vertices)
+    bb = align(vertices)
+
+    # group faces by material, pack textures
+
+    uvs, materials, textures, order = optimize_materials(faces, uvs, materials, mtllib, infile, outfile)
     
     # generate normals string
 
@@ -1129,7 +2116,7 @@ def convert_ascii(infile, morphfiles, colorfiles, outfile):
     
     # extract morph colors
 
-    morphColors, colorFaces, materialColors = generate_morph_colors(colorfiles, n_vertices, n_faces)    
+    morphColors, colorFaces, materialColors = generate_morph_colors(colorfiles, n_vertices, n_faces, order)    
 
     # generate colors string
 
@@ -1167,7 +2154,7 @@ def convert_ascii(infile, morphfiles, colorfiles, outfile):
     "nmaterial" : len(materials),
     "nedge"     : nedge,
 
-    "materials" : generate_materials_string(materials, mtllib, infile),
+    "materials" : generate_materials_string(materials, mtllib, infile, textures),
 
     "normals"       : normals_string,
     "colors"        : colors_string,
@@ -1180,6 +2167,9 @@ def convert_ascii(infile, morphfiles, colorfiles, outfile):
     "faces"     : ",".join(generate_face(f, fc) for f, fc in zip(faces, colorFaces)),
         
     "edges"    : edges_string,
+
+    "ranges"   : generate_ranges_ascii(faces) if BATCH_MATERIALS else "",
+    "parts"    : generate_parts({ 'faces': faces }, vertices, bb) if SPLIT != "none" else "",
     
     "scale"    : SCALE
     }
@@ -1194,26 +2184,41 @@ def convert_ascii(infile, morphfiles, colorfiles, outfile):
 # #############################################################################
 # API - Binary converter
 # #############################################################################
-def convert_binary(infile, outfile):
+def convert_binary(infile, outfile, model=None):
     """Convert infile.obj to outfile.js + outfile.bin    
+
+    model is geometry built in memory, as in convert_ascii.
     """
     
-    if not file_exists(infile):
-        print "Couldn't find [%s]" % infile
-        return
+    if model is None:
+        if not file_exists(infile):
+            print "Couldn't find [%s]" % infile
+            return
+
+        model = load_obj(infile)
     
     binfile = get_name(outfile) + ".bin"
     
-    faces, vertices, uvs, normals, materials, mtllib = parse_obj(infile)
+    faces, vertices, uvs, normals, materials, mtllib = model
     
-    if ALIGN == "center":
-        center(vertices)
-    elif ALIGN == "centerxz":
-        centerxz(vertices)
-    elif ALIGN == "bottom":
-        bottom(vertices)
-    elif ALIGN == "top":
-        top(vertices)    
+    bb = align(vertices)
+
+    uvs, materials, textures, order = optimize_materials(faces, uvs, materials, mtllib, infile, outfile)
+
+    # near-spherical meshes can be stored as lat/lng/radial offset,
+    # faces don't need normal indices if normals point away from center
+
+    sphere = None
+    implied = False
+
+    if GEODETIC:
+        sphere = fit_sphere(vertices, bb)
+        if sphere:
+            implied = normals_implied(faces, vertices, normals, sphere)
+            if implied:
+                faces = [dict(f, normal=[]) for f in faces]
+        else:
+            print "WARNING: [%s] is not spherical, using float vertices" % infile
     
     sfaces = sort_faces(faces)
     
@@ -1224,8 +2229,11 @@ def convert_binary(infile, outfile):
     text = TEMPLATE_FILE_BIN % {
     "name"       : get_name(outfile),
     
-    "materials" : generate_materials_string(materials, mtllib, infile),
+    "materials" : generate_materials_string(materials, mtllib, infile, textures),
     "buffers"   : binfile,
+    "ranges"    : generate_ranges_binary(sfaces) if BATCH_MATERIALS else "",
+    "geodetic"  : generate_geodetic(sphere, implied) if sphere else "",
+    "parts"     : generate_parts(sfaces, vertices, bb) if SPLIT != "none" else "",
     
     "fname"     : infile,
     "nvertex"   : len(vertices),
@@ -1241,7 +2249,7 @@ def convert_binary(infile, outfile):
     # generate BIN file
     # ###################
     
-    if SHADING == "smooth":
+    if SHADING == "smooth" and not implied:
         nnormals = len(normals)
     else:
         nnormals = 0
@@ -1253,12 +2261,17 @@ def convert_binary(infile, outfile):
     header_bytes  = struct.calcsize('<8s')
     header_bytes += struct.calcsize('<BBBBBBBB')
     header_bytes += struct.calcsize('<IIIIIIIIIII')
+
+    if sphere:
+        header_bytes += struct.calcsize('<ffffff')
     
     # signature
     signature = struct.pack('<8s', 'Three.js')
     
     # metadata (all data is little-endian)
     vertex_coordinate_bytes = 4
+    if sphere:
+        vertex_coordinate_bytes = 2
     normal_coordinate_bytes = 1
     uv_coordinate_bytes = 4
     
@@ -1313,22 +2326,47 @@ def convert_binary(infile, outfile):
     buffer.append(signature)
     buffer.append(bdata)
     buffer.append(ndata)
+
+    # geodetic header (only for geodetic encoding)
+    # -------------------------------------------
+    # cx, cy, cz          float   4
+    # radius              float   4
+    # min, max offset     float   4
+    if sphere:
+        gdata = struct.pack('<ffffff', sphere['center'][0],
+                                       sphere['center'][1],
+                                       sphere['center'][2],
+                                       sphere['radius'],
+                                       sphere['offset'][0],
+                                       sphere['offset'][1])
+        buffer.append(gdata)
         
     # 1. vertices
     # ------------
     # x float   4
     # y float   4
     # z float   4
-    for v in vertices:
-        data = struct.pack('<fff', v[0], v[1], v[2]) 
-        buffer.append(data)
+    #
+    # or for geodetic encoding
+    #
+    # latitude      unsigned short  2   [-pi/2, pi/2]
+    # longitude     unsigned short  2   [-pi, pi]
+    # radial offset unsigned short  2   [min offset, max offset]
+    if sphere:
+        for v in vertices:
+            data = struct.pack('<HHH', *geodetic_vertex(v, sphere))
+            buffer.append(data)
+    else:
+        for v in vertices:
+            data = struct.pack('<fff', v[0], v[1], v[2]) 
+            buffer.append(data)
 
     # 2. normals
     # ---------------
     # x signed char 1
     # y signed char 1
     # z signed char 1
-    if SHADING == "smooth":
+    if nnormals:
         for n in normals:
             normalize(n)
             data = struct.pack('<bbb', math.floor(n[0]*127+0.5),
@@ -1503,11 +2541,501 @@ def convert_binary(infile, outfile):
     out.write("".join(buffer))
     out.close()
 
+# #############################################################################
+# API - Compressed converter
+# #############################################################################
+#
+# Connectivity is encoded by edgebreaker-style traversal of triangles.
+# Traversal keeps stack of gates (directed edges u->v of already decoded
+# triangles, with opposite vertex o). For each popped gate one op tells
+# what is on the other side:
+#
+#   E   nothing (border or already visited triangle)
+#   C   triangle with new vertex (next in vertex order)
+#   R   triangle with already known vertex (relative reference)
+#   +3  triangle has opposite orientation (C = 4, R = 5)
+#
+# Triangle added over gate (u,v) is (x,y,w) = (v,u,w) (or (u,v,w) when
+# flipped), it pushes gates (w,x,y) and (y,w,x). When stack is empty, new
+# component starts with triangle of three C / R ops.
+#
+# Vertices are renumbered in order of first use. Positions and uvs are
+# quantized, new vertices are predicted by parallelogram rule
+# (u + v - o) and only residuals are stored.
+#
+# Quads are split into two triangles, vertices not used by any face
+# are dropped. Vertices with different uvs or normals on different faces
+# (UV seams, hard edges) are split into one vertex per corner first.
+
+OP_E = 0
+OP_C = 1
+OP_R = 2
+OP_FLIP = 3
+
+def zigzag(v):
+    if v < 0:
+        return (-v << 1) - 1
+    return v << 1
+
+def unzigzag(v):
+    if v & 1:
+        return -((v + 1) >> 1)
+    return v >> 1
+
+def write_varints(values):
+    data = bytearray()
+    for v in values:
+        while v > 0x7f:
+            data.append((v & 0x7f) | 0x80)
+            v >>= 7
+        data.append(v)
+    return data
+
+def read_varints(data):
+    values = []
+    v = shift = 0
+    for b in bytearray(data):
+        v |= (b & 0x7f) << shift
+        if b & 0x80:
+            shift += 7
+        else:
+            values.append(v)
+            v = shift = 0
+    return values
+
+def quantize_attribute(values, n, bits):
+    """Quantize n-component values into integers over their bounding box.
+    """
+
+    top = (1 << bits) - 1
+    lo = [min(v[i] for v in values) for i in xrange(n)]
+    hi = [max(v[i] for v in values) for i in xrange(n)]
+
+    q = []
+    for v in values:
+        q.append([int(math.floor((v[i] - lo[i]) / (hi[i] - lo[i]) * top + 0.5)) if hi[i] > lo[i] else 0 for i in xrange(n)])
+    return q, lo, hi
+
+def dequantize_attribute(q, lo, hi, bits):
+    top = float((1 << bits) - 1)
+    return [[lo[i] + (hi[i] - lo[i]) * c[i] / top for i in xrange(len(c))] for c in q]
+
+def triangulate(faces):
+    """Split faces into triangles as (vertex indices, material), 0-based.
+    """
+
+    triangles = []
+    for f in faces:
+        vi = [i - 1 for i in f['vertex']]
+        triangles.append(((vi[0], vi[1], vi[2]), f['material']))
+        if len(vi) == 4:
+            triangles.append(((vi[0], vi[2], vi[3]), f['material']))
+    return triangles
+
+def encode_connectivity(triangles):
+    """Encode triangles by edgebreaker-style traversal.
+
+    Returns ops, vertex references, new vertex order (original indices)
+    and triangle order, plus for each new vertex its prediction triple
+    (u, v, o) in new vertex indices (None for component start vertices).
+    """
+
+    ntriangles = len(triangles)
+
+    edges = {}
+    for t, (tri, m) in enumerate(triangles):
+        for k in xrange(3):
+            a, b = tri[k], tri[(k+1) % 3]
+            edges.setdefault((min(a, b), max(a, b)), []).append(t)
+
+    visited = [False] * ntriangles
+    nvisited = 0
+
+    ops = []
+    refs = []
+    order = []
+    index = {}
+    predictions = []
+    torder = []
+
+    def vertex(old, prediction):
+        if old in index:
+            refs.append(len(order) - 1 - index[old])
+            return OP_R
+        index[old] = len(order)
+        order.append(old)
+        predictions.append(prediction)
+        return OP_C
+
+    for start in xrange(ntriangles):
+        if visited[start]:
+            continue
+
+        visited[start] = True
+        nvisited += 1
+        torder.append(start)
+
+        a, b, c = triangles[start][0]
+        for v in (a, b, c):
+            ops.append(vertex(v, None))
+
+        stack = [(a, b, c), (b, c, a), (c, a, b)]
+
+        while stack and nvisited < ntriangles:
+            u, v, o = stack.pop()
+
+            found = None
+            for t in edges[(min(u, v), max(u, v))]:
+                if not visited[t]:
+                    found = t
+                    break
+
+            if found is None:
+                ops.append(OP_E)
+                continue
+
+            visited[found] = True
+            nvisited += 1
+            torder.append(found)
+
+            tri = triangles[found][0]
+            for k in xrange(3):
+                p, q, r = tri[k], tri[(k+1) % 3], tri[(k+2) % 3]
+                if (p, q) == (v, u):
+                    flip = 0
+                    break
+                if (p, q) == (u, v):
+                    flip = OP_FLIP
+                    break
+
+            w = r
+            op = vertex(w, (index[u], index[v], index[o]))
+            ops.append(op + flip)
+
+            if flip:
+                x, y = u, v
+            else:
+                x, y = v, u
+
+            # triangle (x, y, w): gates y->w and w->x
+            stack.append((w, x, y))
+            stack.append((y, w, x))
+
+    return ops, refs, order, torder, predictions
+
+def decode_connectivity(ops, refs, ntriangles):
+    """Decode triangles (in new vertex indices) from ops and references.
+
+    Returns triangles and for each new vertex its prediction triple.
+    """
+
+    triangles = []
+    predictions = []
+    nvertices = [0]
+
+    ops = iter(ops)
+    refs = iter(refs)
+
+    def vertex(op, prediction):
+        if op == OP_C:
+            predictions.append(prediction)
+            nvertices[0] += 1
+            return nvertices[0] - 1
+        return nvertices[0] - 1 - next(refs)
+
+    stack = []
+
+    while len(triangles) < ntriangles:
+        if not stack:
+            a = vertex(next(ops), None)
+            b = vertex(next(ops), None)
+            c = vertex(next(ops), None)
+            triangles.append((a, b, c))
+
+            stack.extend(((a, b, c), (b, c, a), (c, a, b)))
+            continue
+
+        u, v, o = stack.pop()
+        op = next(ops)
+
+        if op == OP_E:
+            continue
+
+        flip = op >= OP_FLIP
+        if flip:
+            op -= OP_FLIP
+            x, y = u, v
+        else:
+            x, y = v, u
+
+        w = vertex(op, (u, v, o))
+        triangles.append((x, y, w))
+
+        stack.append((w, x, y))
+        stack.append((y, w, x))
+
+    return triangles, predictions
+
+def predict_residuals(q, predictions):
+    """Parallelogram prediction residuals of quantized attribute
+    (given in new vertex order).
+    """
+
+    residuals = []
+    for i, prediction in enumerate(predictions):
+        n = len(q[i])
+        if prediction is None:
+            if i:
+                p = q[i-1]
+            else:
+                p = [0] * n
+        else:
+            u, v, o = prediction
+            p = [q[u][k] + q[v][k] - q[o][k] for k in xrange(n)]
+        residuals.extend(zigzag(q[i][k] - p[k]) for k in xrange(n))
+    return residuals
+
+def apply_residuals(residuals, predictions, n):
+    q = []
+    residuals = iter(residuals)
+    for i, prediction in enumerate(predictions):
+        if prediction is None:
+            if i:
+                p = q[i-1]
+            else:
+                p = [0] * n
+        else:
+            u, v, o = prediction
+            p = [q[u][k] + q[v][k] - q[o][k] for k in xrange(n)]
+        q.append([p[k] + unzigzag(next(residuals)) for k in xrange(n)])
+    return q
+
+def per_vertex(faces, key):
+    """Check that faces index attribute by vertex indices (or not at all).
+    """
+
+    used = False
+    for f in faces:
+        if f[key]:
+            used = True
+            if f[key] != f['vertex']:
+                return None
+        elif used:
+            return None
+    return used
+
+def split_corners(faces, vertices, uvs, normals):
+    """Make uvs and normals indexed by vertex indices, every distinct
+    (vertex, uv, normal) corner becomes its own vertex (UV seams, hard
+    edges). Meshes that are indexed by vertex already are returned as they are.
+
+    Returns faces, vertices, uvs, normals (1-based indices, as load_obj).
+    """
+
+    split_normals = SHADING == "smooth"
+    if per_vertex(faces, 'uv') is not None and (not split_normals or per_vertex(faces, 'normal') is not None):
+        return faces, vertices, uvs, normals
+
+    corners = {}
+    new_faces = []
+    new_vertices = []
+    new_uvs = []
+    new_normals = []
+
+    for f in faces:
+        indices = []
+        for k, vi in enumerate(f['vertex']):
+            ti = f['uv'][k] if f['uv'] else None
+            ni = f['normal'][k] if f['normal'] and split_normals else None
+
+            key = (vi, ti, ni)
+            if key not in corners:
+                corners[key] = len(new_vertices) + 1
+                new_vertices.append(vertices[vi - 1])
+                new_uvs.append(uvs[ti - 1] if ti else [0.0, 0.0])
+                new_normals.append(normals[ni - 1] if ni else [0.0, 0.0, 0.0])
+            indices.append(corners[key])
+
+        face = dict(f)
+        face['vertex'] = indices
+        face['uv'] = indices if f['uv'] else []
+        face['normal'] = indices if f['normal'] and split_normals else []
+        new_faces.append(face)
+
+    return new_faces, new_vertices, new_uvs, new_normals
+
+def encode_compressed(faces, vertices, uvs, normals, bits):
+    """Encode mesh into compressed buffer.
+
+    Layout (little-endian):
+
+        signature               8s      "ThreeEBC"
+        flags                   B       1 = uvs, 2 = normals
+        bits                    B       quantization bits
+        nvertices, ntriangles   II
+        position range          ffffff  min xyz, max xyz
+        uv range                ffff    min uv, max uv
+
+    followed by zlib compressed sections, each prefixed by its length (I):
+
+        ops                     one byte per op
+        references              varints
+        position residuals      zigzag varints
+        uv residuals            zigzag varints
+        normals                 bbb per vertex
+        materials               unsigned short per triangle
+
+    Faces have to be indexed by vertex (see split_corners), returned vertex
+    order is into the vertices given.
+    """
+
+    triangles = triangulate(faces)
+    ops, refs, order, torder, predictions = encode_connectivity(triangles)
+
+    has_uvs = per_vertex(faces, 'uv')
+    has_normals = per_vertex(faces, 'normal') and SHADING == "smooth"
+
+    flags = 0
+    if has_uvs:
+        flags |= 1
+    if has_normals:
+        flags |= 2
+
+    positions, plo, phi = quantize_attribute([vertices[i] for i in order] or [[0, 0, 0]], 3, bits)
+    position_residuals = predict_residuals(positions, predictions)
+
+    uv_residuals = []
+    ulo = uhi = [0.0, 0.0]
+    if has_uvs:
+        q, ulo, uhi = quantize_attribute([[uvs[i][0], 1.0 - uvs[i][1]] for i in order], 2, bits)
+        uv_residuals = predict_residuals(q, predictions)
+
+    normal_data = array.array('b')
+    if has_normals:
+        for i in order:
+            n = list(normals[i])
+            normalize(n)
+            normal_data.extend(int(math.floor(c * 127 + 0.5)) for c in n)
+
+    materials = array.array('H', [triangles[t][1] for t in torder])
+
+    sections = [array.array('B', ops).tostring(),
+                str(write_varints(refs)),
+                str(write_varints(position_residuals)),
+                str(write_varints(uv_residuals)),
+                normal_data.tostring(),
+                materials.tostring()]
+
+    buffer = [struct.pack('<8sBBII', 'ThreeEBC', flags, bits, len(order), len(triangles)),
+              struct.pack('<ffffff', *(plo + phi)),
+              struct.pack('<ffff', *(ulo + uhi))]
+
+    for data in sections:
+        data = zlib.compress(data, 9)
+        buffer.append(struct.pack('<I', len(data)))
+        buffer.append(data)
+
+    return "".join(buffer), order, torder
+
+def decode_compressed(data):
+    """Reference decoder of compressed buffer.
+
+    Returns triangles, positions, uvs, normals (lists in decoded vertex
+    order, empty if not stored) and per-triangle materials.
+    """
+
+    signature, flags, bits, nvertices, ntriangles = struct.unpack_from('<8sBBII', data, 0)
+    if signature != 'ThreeEBC':
+        raise ValueError("not a compressed Three.js buffer")
+
+    offset = struct.calcsize('<8sBBII')
+    prange = struct.unpack_from('<ffffff', data, offset)
+    offset += struct.calcsize('<ffffff')
+    urange = struct.unpack_from('<ffff', data, offset)
+    offset += struct.calcsize('<ffff')
+
+    sections = []
+    for i in xrange(6):
+        length, = struct.unpack_from('<I', data, offset)
+        offset += 4
+        sections.append(zlib.decompress(data[offset:offset+length]))
+        offset += length
+
+    ops = array.array('B', sections[0])
+    refs = read_varints(sections[1])
+
+    triangles, predictions = decode_connectivity(ops, refs, ntriangles)
+
+    q = apply_residuals(read_varints(sections[2]), predictions, 3)
+    positions = dequantize_attribute(q, list(prange[:3]), list(prange[3:]), bits)
+
+    uvs = []
+    if flags & 1:
+        q = apply_residuals(read_varints(sections[3]), predictions, 2)
+        uvs = dequantize_attribute(q, list(urange[:2]), list(urange[2:]), bits)
+
+    normals = []
+    if flags & 2:
+        n = array.array('b', sections[4])
+        normals = [list(n[i:i+3]) for i in xrange(0, len(n), 3)]
+
+    materials = array.array('H', sections[5]).tolist()
+
+    return triangles, positions, uvs, normals, materials
+
+def convert_compressed(infile, outfile):
+    """Convert infile.obj to outfile.js + outfile.ebc
+    """
+
+    if not file_exists(infile):
+        print "Couldn't find [%s]" % infile
+        return
+
+    binfile = get_name(outfile) + ".ebc"
+
+    faces, vertices, uvs, normals, materials, mtllib = load_obj(infile)
+
+    align(vertices)
+
+    uvs, materials, textures, order = optimize_materials(faces, uvs, materials, mtllib, infile, outfile)
+
+    faces, vertices, uvs, normals = split_corners(faces, vertices, uvs, normals)
+
+    if per_vertex(faces, 'uv') is None:
+        print "WARNING: uvs are not on all faces, they are not exported"
+    if SHADING == "smooth" and per_vertex(faces, 'normal') is None:
+        print "WARNING: normals are not on all faces, they are not exported"
+
+    data, vorder, torder = encode_compressed(faces, vertices, uvs, normals, QUANTIZATION_BITS)
+
+    text = TEMPLATE_FILE_COMPRESSED % {
+    "materials" : generate_materials_string(materials, mtllib, infile, textures),
+    "buffers"   : binfile,
+
+    "fname"     : infile,
+    "nvertex"   : len(vorder),
+    "nface"     : len(torder),
+    "nmaterial" : len(materials)
+    }
+
+    out = open(outfile, "w")
+    out.write(text)
+    out.close()
+
+    path = os.path.dirname(outfile)
+    fname = os.path.join(path, binfile)
+
+    out = open(fname, "wb")
+    out.write(data)
+    out.close()
+
+    print "%d vertices, %d triangles, %d bytes" % (len(vorder), len(torder), len(data))
+
 # #############################################################################
 # Helpers
 # #############################################################################
 def usage():
-    print "Usage: %s -i filename.obj -o filename.js [-m morphfiles*.obj] [-c morphcolors*.obj] [-a center|top|bottom] [-s flat|smooth] [-t binary|ascii] [-d invert|normal]" % os.path.basename(sys.argv[0])
+    print "Usage: %s -i filename.obj -o filename.js [-m morphfiles*.obj] [-c morphcolors*.obj] [-a center|top|bottom] [-s flat|smooth] [-t binary|ascii|compressed] [-d invert|normal] [-l group|object] [-r] [-p atlas.png] [-g] [-q bits] [-j jobs]" % os.path.basename(sys.argv[0])
         
 # #####################################################
 # Main
@@ -1516,7 +3044,7 @@ if __name__ == "__main__":
     
     # get parameters from the command line
     try:
-        opts, args = getopt.getopt(sys.argv[1:], "hbei:m:c:b:o:a:s:t:d:x:", ["help", "bakecolors", "edges", "input=", "morphs=", "colors=", "output=", "align=", "shading=", "type=", "dissolve=", "truncatescale="])
+        opts, args = getopt.getopt(sys.argv[1:], "hbergi:m:c:b:o:a:s:t:d:x:j:p:l:q:", ["help", "bakecolors", "edges", "input=", "morphs=", "colors=", "output=", "align=", "shading=", "type=", "dissolve=", "truncatescale=", "jobs=", "batchmaterials", "atlas=", "geodetic", "split=", "quantize="])
     
     except getopt.GetoptError:
         usage()
@@ -1552,7 +3080,7 @@ if __name__ == "__main__":
                 SHADING = a
                 
         elif o in ("-t", "--type"):
-            if a in ("binary", "ascii"):
+            if a in ("binary", "ascii", "compressed"):
                 TYPE = a
 
         elif o in ("-d", "--dissolve"):
@@ -1569,6 +3097,25 @@ if __name__ == "__main__":
             TRUNCATE = True
             SCALE = float(a)
 
+        elif o in ("-l", "--split"):
+            if a in ("group", "object", "none"):
+                SPLIT = a
+
+        elif o in ("-r", "--batchmaterials"):
+            BATCH_MATERIALS = True
+
+        elif o in ("-p", "--atlas"):
+            ATLAS = a
+
+        elif o in ("-g", "--geodetic"):
+            GEODETIC = True
+
+        elif o in ("-q", "--quantize"):
+            QUANTIZATION_BITS = min(max(int(a), 1), 24)
+
+        elif o in ("-j", "--jobs"):
+            JOBS = max(int(a), 1)
+
     if infile == "" or outfile == "":
         usage()
         sys.exit(2)
@@ -1585,4 +3132,6 @@ if __name__ == "__main__":
         convert_ascii(infile, morphfiles, colorfiles, outfile)
     elif TYPE == "binary":
         convert_binary(infile, outfile)
+    elif TYPE == "compressed":
+        convert_compressed(infile, outfile)
     
@@ -0,0 +1,341 @@
+"""Generate land / water grid meshes from worldMask.jpg
+
+Builds gridLand<N>.js / gridWater<N>.js (what globe.js loads for
+gridDensity N) without going through models.hipnc and OBJ files:
+a geodesic sphere (subdivided icosahedron, radius 200, poles on y) is
+split into land and water triangles by sampling the mask at the grid
+vertices, and the meshes go straight to convert_obj_three.py writers in
+memory.
+
+-------------------------
+How to use this generator
+-------------------------
+
+python generate_grid.py -d density [-m worldMask.jpg] [-o outdir] [-t ascii|binary] [-c]
+
+Notes:
+    - flags
+        -d density                  grid density, one number or comma separated list (0,1,2)
+        -m mask                     equirectangular land mask, dark is land
+        -o outdir                   output directory, created when it doesn't exist
+        -t ascii|binary             converter output type
+        -c                          cells: instead of the grid, one quad per grid vertex
+                                    with normals and uvs the data shader expects
+
+    - by default:
+        mask is worldMask.jpg next to this script
+        output goes next to this script
+        type is ascii
+
+    - needs NumPy and PIL (Python Imaging Library)
+
+-------------
+Grid
+-------------
+
+Density N subdivides every icosahedron edge into f = 10 * (N + 1)
+segments, that is 20 * f^2 triangles and 10 * f^2 + 2 vertices on the
+whole sphere, as the exported gridLand / gridWater pairs (2000 triangles
+for density 0). The icosahedron is turned the same way too (upper ring at
+36 + 72k degrees of longitude), so vertices on its edges are close to
+the exported ones, inside the faces they are off by up to 0.7% of the
+radius (the exported grids come from a spherical subdivision).
+
+Vertex is land when the mask under it is darker than half gray, triangle
+is land when at least two of its vertices are, so vertices on the coast
+are in both meshes (as in the exported pairs). Counts are close to the
+exported ones, not the same:
+
+    density 0       land 412 vertices / 584 triangles, water 819 / 1416
+                    (exported 418 / 604 and 805 / 1396)
+    density 10      land 40124 vertices (exported 39984)
+
+Mask is sampled with the same uv createPoints uses:
+
+    u = (atan2(z, -x) + PI) / (2 PI)
+    v = acos(y / 200) / PI
+
+-------------
+Cells
+-------------
+
+With -c every grid vertex becomes a quad on the sphere, like createPoints
+builds from pointModel on load: normals are unit vectors away from the
+center (so position - normal + normal * data.r * extrudeMax lifts the
+cell along the radius) and all four corners get the uv of the grid
+vertex, so the whole cell samples textureData at one spot. The converter
+stores 1 - v of the OBJ and JSONLoader uses stored uvs as they are, so
+the model gets 1 - v and the stored uv is exactly the createPoints one.
+
+"""
+
+import getopt
+import os
+import os.path
+import sys
+
+import numpy
+
+from PIL import Image
+
+import convert_obj_three
+
+# #####################################################
+# Configuration
+# #####################################################
+RADIUS = 200.0
+MASK = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worldMask.jpg")
+OUTDIR = os.path.dirname(os.path.abspath(__file__))
+TYPE = "ascii"          # ascii binary
+CELLS = False
+
+CELL_FILL = 0.8         # cell quad size relative to grid spacing
+
+# #####################################################
+# Geodesic sphere
+# #####################################################
+def icosahedron():
+    """Vertices (poles on y) and faces of unit icosahedron.
+    """
+
+    lat = numpy.arctan(0.5)
+
+    vertices = [(0.0, 1.0, 0.0)]
+    for k in xrange(5):
+        lng = numpy.radians(72 * k + 36)
+        vertices.append((numpy.cos(lat) * numpy.cos(lng), numpy.sin(lat), numpy.cos(lat) * numpy.sin(lng)))
+    for k in xrange(5):
+        lng = numpy.radians(72 * k + 72)
+        vertices.append((numpy.cos(lat) * numpy.cos(lng), -numpy.sin(lat), numpy.cos(lat) * numpy.sin(lng)))
+    vertices.append((0.0, -1.0, 0.0))
+
+    faces = []
+    for k in xrange(5):
+        u0, u1 = 1 + k, 1 + (k + 1) % 5
+        l0, l1 = 6 + k, 6 + (k + 1) % 5
+        faces.extend(((0, u1, u0), (u0, u1, l0), (u1, l1, l0), (11, l0, l1)))
+
+    return numpy.array(vertices), numpy.array(faces)
+
+def geodesic_sphere(frequency):
+    """Unit sphere vertices and triangles, every icosahedron edge split into frequency segments.
+    """
+
+    base, base_faces = icosahedron()
+
+    # barycentric lattice of one face
+    i, j = numpy.meshgrid(numpy.arange(frequency + 1), numpy.arange(frequency + 1), indexing="ij")
+    keep = i + j <= frequency
+    i = i[keep]
+    j = j[keep]
+
+    lattice = -numpy.ones((frequency + 2, frequency + 2), dtype=numpy.int64)
+    lattice[i, j] = numpy.arange(len(i))
+
+    # up and down triangles of the lattice
+    a, b = numpy.nonzero(numpy.add.outer(numpy.arange(frequency), numpy.arange(frequency)) <= frequency - 1)
+    up = numpy.column_stack((lattice[a, b], lattice[a + 1, b], lattice[a, b + 1]))
+    a, b = numpy.nonzero(numpy.add.outer(numpy.arange(frequency), numpy.arange(frequency)) <= frequency - 2)
+    down = numpy.column_stack((lattice[a + 1, b], lattice[a + 1, b + 1], lattice[a, b + 1]))
+    local = numpy.vstack((up, down))
+
+    points = []
+    triangles = []
+    w = (frequency - i - j)[:, None] / float(frequency)
+    for n, (p, q, r) in enumerate(base_faces):
+        points.append(w * base[p] + (i[:, None] / float(frequency)) * base[q] + (j[:, None] / float(frequency)) * base[r])
+        triangles.append(local + n * len(i))
+
+    points = numpy.vstack(points)
+    points /= numpy.sqrt((points * points).sum(axis=1))[:, None]
+    triangles = numpy.vstack(triangles)
+
+    # faces share edge vertices, merge them
+    keys = numpy.round(points * 1e6).astype(numpy.int64)
+    unique, first, inverse = numpy.unique(keys.view([('', keys.dtype)] * 3).ravel(), return_index=True, return_inverse=True)
+    order = numpy.argsort(first)
+    remap = numpy.empty(len(order), dtype=numpy.int64)
+    remap[order] = numpy.arange(len(order))
+
+    vertices = points[first[order]]
+    triangles = remap[inverse][triangles]
+
+    # all triangles facing out
+    v0, v1, v2 = vertices[triangles[:, 0]], vertices[triangles[:, 1]], vertices[triangles[:, 2]]
+    inward = (numpy.cross(v1 - v0, v2 - v0) * (v0 + v1 + v2)).sum(axis=1) < 0
+    triangles[inward] = triangles[inward][:, ::-1]
+
+    return vertices, triangles
+
+# #####################################################
+# Mask
+# #####################################################
+def load_mask(fname):
+    """Mask as 0 - 1 floats, 1 is land.
+    """
+
+    image = Image.open(fname).convert("L")
+    return 1.0 - numpy.asarray(image, dtype=numpy.float64) / 255.0
+
+def uv(points):
+    """Texture coordinates of unit sphere points, as createPoints computes them.
+    """
+
+    u = (numpy.arctan2(points[:, 2], -points[:, 0]) + numpy.pi) / (2 * numpy.pi)
+    v = numpy.arccos(numpy.clip(points[:, 1], -1, 1)) / numpy.pi
+    return u, v
+
+def sample(mask, points):
+    height, width = mask.shape
+    u, v = uv(points)
+    col = numpy.clip((u * width).astype(numpy.int64), 0, width - 1)
+    row = numpy.clip((v * height).astype(numpy.int64), 0, height - 1)
+    return mask[row, col]
+
+def classify(mask, vertices, triangles):
+    """True for land triangles (at least two land vertices).
+    """
+
+    land = sample(mask, vertices) >= 0.5
+    return land[triangles].sum(axis=1) >= 2
+
+# #####################################################
+# Models
+# #####################################################
+def compact(vertices, triangles):
+    used, inverse = numpy.unique(triangles, return_inverse=True)
+    return vertices[used], inverse.reshape(triangles.shape)
+
+def grid_model(vertices, triangles):
+    """Grid as converter model (faces, vertices, uvs, normals, materials, mtllib).
+    """
+
+    vertices, triangles = compact(vertices, triangles)
+
+    faces = [{ 'vertex': [a + 1, b + 1, c + 1], 'uv': [], 'normal': [],
+               'material': 0, 'group': "", 'object': "", 'smooth': "" } for a, b, c in triangles.tolist()]
+
+    return faces, (vertices * RADIUS).tolist(), [], [], {}, ""
+
+def cells_model(vertices, triangles, frequency):
+    """Quad per grid vertex, with radial normals and the vertex uv
+    (v flipped for the converter, which flips it back).
+    """
+
+    points = compact(vertices, triangles)[0]
+
+    # tangent frame, east and north
+    east = numpy.cross(numpy.array([0.0, 1.0, 0.0]), points)
+    length = numpy.sqrt((east * east).sum(axis=1))
+    pole = length < 1e-9
+    east[pole] = (1.0, 0.0, 0.0)
+    length[pole] = 1.0
+    east /= length[:, None]
+    north = numpy.cross(points, east)
+
+    spacing = RADIUS * numpy.arctan(2.0) / frequency
+    half = spacing * CELL_FILL / 2
+
+    centers = points * RADIUS
+    corners = numpy.stack((centers - east * half - north * half,
+                           centers + east * half - north * half,
+                           centers + east * half + north * half,
+                           centers - east * half + north * half), axis=1).reshape(-1, 3)
+
+    u, v = uv(points)
+
+    faces = []
+    for n in xrange(len(points)):
+        base = 4 * n
+        faces.append({ 'vertex': [base + 1, base + 2, base + 3, base + 4],
+                       'uv': [n + 1] * 4, 'normal': [n + 1] * 4,
+                       'material': 0, 'group': "", 'object': "", 'smooth': "" })
+
+    return faces, corners.tolist(), numpy.column_stack((u, 1.0 - v)).tolist(), points.tolist(), {}, ""
+
+# #####################################################
+# API
+# #####################################################
+def generate_grid(density, mask, outdir):
+    """Write gridLand<density> and gridWater<density> models into outdir.
+    """
+
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    frequency = 10 * (density + 1)
+    vertices, triangles = geodesic_sphere(frequency)
+    land = classify(mask, vertices, triangles)
+
+    for name, selected in (("gridLand", land), ("gridWater", ~land)):
+        if CELLS:
+            model = cells_model(vertices, triangles[selected], frequency)
+        else:
+            model = grid_model(vertices, triangles[selected])
+
+        outfile = os.path.join(outdir, "%s%d.js" % (name, density))
+        source = "%s (%s density %d)" % (os.path.basename(MASK), name, density)
+
+        convert_obj_three.TYPE = TYPE
+        if TYPE == "binary":
+            convert_obj_three.convert_binary(source, outfile, model)
+        else:
+            convert_obj_three.convert_ascii(source, "", "", outfile, model)
+
+        print "[%s] %d vertices" % (outfile, len(model[1]))
+
+# #####################################################
+# Helpers
+# #####################################################
+def usage():
+    print "Usage: %s -d density[,density...] [-m worldMask.jpg] [-o outdir] [-t ascii|binary] [-c]" % os.path.basename(sys.argv[0])
+
+# #####################################################
+# Main
+# #####################################################
+if __name__ == "__main__":
+
+    # get parameters from the command line
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hcd:m:o:t:", ["help", "cells", "density=", "mask=", "output=", "type="])
+
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    densities = []
+
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            usage()
+            sys.exit()
+
+        elif o in ("-d", "--density"):
+            try:
+                densities = [max(0, int(d)) for d in a.split(",")]
+            except ValueError:
+                usage()
+                sys.exit(2)
+
+        elif o in ("-m", "--mask"):
+            MASK = a
+
+        elif o in ("-o", "--output"):
+            OUTDIR = a
+
+        elif o in ("-t", "--type"):
+            if a in ("ascii", "binary"):
+                TYPE = a
+
+        elif o in ("-c", "--cells"):
+            CELLS = True
+
+    if not densities:
+        usage()
+        sys.exit(2)
+
+    mask = load_mask(MASK)
+
+    for density in densities:
+        print "Generating density %d from [%s] ..." % (density, MASK)
+        generate_grid(density, mask, OUTDIR)
@@ -0,0 +1,356 @@
+"""Mesh statistics and rendering cost of OBJ and converted models
+
+Reports what a model costs before it ships: vertex reuse, sort_faces
+buckets, duplicate and unused vertices, index range, post-transform
+vertex cache efficiency (ACMR), draw calls and GPU memory the bundled
+three.js would need, and file sizes raw and deflated. Output is JSON,
+one record per model, so budgets can be tracked across the whole
+models directory.
+
+-------------------------
+How to use this analyzer
+-------------------------
+
+python mesh_stats.py [-o stats.json] [-c 16,32] [model|directory ...]
+
+Notes:
+    - flags
+        -o outfile.json             write JSON here instead of printing it
+        -c sizes                    vertex cache sizes for ACMR
+
+    - by default:
+        all models next to this script are analyzed
+        ACMR is computed for FIFO caches of 16 and 32 vertices
+
+    - reads OBJ (as convert_obj_three.py parses it) and converted models:
+      ASCII .js, binary .js + .bin (also geodetic) and compressed .js + .ebc
+
+    - needs NumPy
+
+-------------
+Metrics
+-------------
+
+    sections            faces in each sort_faces bucket (binary file sections),
+                        smooth means faces with vertex normals
+    duplicateVertices   vertices with exactly the same position as an earlier one
+    unusedVertices      vertices no face refers to
+    indexRange          smallest and largest vertex index used by faces
+    reuse               triangles per used vertex (about 2 for closed meshes)
+    acmr                vertex shader runs per triangle with a FIFO cache of that
+                        size, faces in draw order, quads split into (a, b, d), (b, c, d)
+    drawCalls           geometry groups: three.js starts a new one per material
+                        and whenever a group would pass 65535 face vertices
+    gpuBytes            unrolled: three.js buffers (float positions, normals, uvs
+                        per face vertex, uint16 face and line indices)
+                        indexed: shared float vertices with uint16 / uint32 indices
+
+"""
+
+import getopt
+import glob
+import json
+import os.path
+import sys
+import zlib
+
+import numpy
+
+import convert_obj_three
+import read_three
+
+# #####################################################
+# Configuration
+# #####################################################
+CACHE_SIZES = [16, 32]
+MODELS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+GROUP_VERTICES = 65535  # face vertices per three.js geometry group
+
+# #####################################################
+# Mesh
+# #####################################################
+def empty_sections():
+    return dict((name, 0) for name, n, smooth, uv in read_three.SECTIONS)
+
+def make_mesh(fmt, files, positions, faces, nnormals, nuvs, nmaterials, sections):
+    """Mesh record: faces is a list of (vertex index array (n, 3 | 4), material array) in draw order.
+    """
+
+    triangles = []
+    materials = []
+    nquads = 0
+    ntriangles = 0
+
+    for indices, material in faces:
+        if not len(indices):
+            continue
+
+        if indices.shape[1] == 4:
+            nquads += len(indices)
+            split = numpy.empty((len(indices), 2, 3), dtype=numpy.int64)
+            split[:, 0] = indices[:, [0, 1, 3]]
+            split[:, 1] = indices[:, [1, 2, 3]]
+            triangles.append(split.reshape(-1, 3))
+            materials.append(numpy.repeat(material, 2))
+        else:
+            ntriangles += len(indices)
+            triangles.append(indices.astype(numpy.int64))
+            materials.append(material)
+
+    return {
+    "format"    : fmt,
+    "files"     : files,
+    "positions" : numpy.asarray(positions, dtype=numpy.float64).reshape(-1, 3),
+    "triangles" : numpy.vstack(triangles) if triangles else numpy.zeros((0, 3), dtype=numpy.int64),
+    "materials" : numpy.concatenate(materials) if materials else numpy.zeros(0, dtype=numpy.int64),
+    "faces"     : [(len(indices), indices.shape[1] if len(indices) else 3, material) for indices, material in faces],
+    "nquads"    : nquads,
+    "ntris"     : ntriangles,
+    "nnormals"  : nnormals,
+    "nuvs"      : nuvs,
+    "nmaterials": nmaterials,
+    "sections"  : sections
+    }
+
+# #####################################################
+# Loaders
+# #####################################################
+def load_obj(fname):
+    faces, vertices, uvs, normals, materials, mtllib = convert_obj_three.load_obj(fname)
+
+    sections = empty_sections()
+    for name, bucket in convert_obj_three.sort_faces(faces).items():
+        sections[name] = len(bucket)
+
+    # runs of faces with the same size keep the file order
+    runs = []
+    for f in faces:
+        n = len(f['vertex'])
+        if n not in (3, 4):
+            continue
+        if not runs or runs[-1][0] != n:
+            runs.append((n, [], []))
+        runs[-1][1].append(f['vertex'])
+        runs[-1][2].append(f['material'])
+
+    faces = [(numpy.array(v, dtype=numpy.int64) - 1, numpy.array(m, dtype=numpy.int64)) for n, v, m in runs]
+
+    return make_mesh("obj", [fname], vertices, faces, len(normals), len(uvs), len(materials), sections)
+
+def load_converted(fname, model):
+    """ASCII or binary model through read_three.
+    """
+
+    converted = read_three.load(fname)
+    try:
+        sections = dict((name, len(records)) for name, records in converted.sections.items())
+        faces = [(vertices.astype(numpy.int64), materials.astype(numpy.int64)) for vertices, materials in converted.faces()]
+
+        files = [fname]
+        if converted.kind == "binary":
+            files.append(os.path.join(os.path.dirname(fname), model["buffers"]))
+
+        nuvs = len(converted.uvs)
+        if converted.kind == "ascii":
+            nuvs = sum(len(layer) for layer in model.get("uvs", [])) // 2
+
+        return make_mesh(converted.kind, files, converted.positions(), faces, len(converted.normals), nuvs,
+                         len(model.get("materials", [])), sections)
+    finally:
+        converted.close()
+
+def load_compressed(fname, model):
+    binfile = os.path.join(os.path.dirname(fname), model["buffers"])
+    triangles, positions, uvs, normals, materials = convert_obj_three.decode_compressed(open(binfile, "rb").read())
+
+    sections = empty_sections()
+    sections[read_three.section_name(3, bool(normals), bool(uvs))] = len(triangles)
+
+    faces = [(numpy.array(triangles, dtype=numpy.int64).reshape(-1, 3), numpy.array(materials, dtype=numpy.int64))]
+
+    return make_mesh("compressed", [fname, binfile], positions, faces, len(normals), len(uvs),
+                     len(model.get("materials", [])), sections)
+
+def load_mesh(fname):
+    if os.path.splitext(fname)[1].lower() != ".js":
+        return load_obj(fname)
+
+    model = read_three.read_js(fname)
+    if model.get("encoding") == "edgebreaker":
+        return load_compressed(fname, model)
+    return load_converted(fname, model)
+
+# #####################################################
+# Metrics
+# #####################################################
+def acmr(triangles, nvertices, size):
+    """Cache misses per triangle, FIFO post-transform cache.
+
+    A vertex is in the cache when it entered at most size misses ago.
+    """
+
+    if not len(triangles):
+        return 0.0
+
+    entered = numpy.full(nvertices, -size - 1, dtype=numpy.int64).tolist()
+    misses = 0
+    for v in triangles.ravel().tolist():
+        if misses - entered[v] > size:
+            entered[v] = misses
+            misses += 1
+
+    return misses / float(len(triangles))
+
+def draw_calls(mesh):
+    """Geometry groups as three.js builds them from faces in order.
+    """
+
+    counters = {}
+    groups = set()
+    for count, n, material in mesh["faces"]:
+        for m in numpy.asarray(material).tolist():
+            group, vertices = counters.get(m, (0, 0))
+            if vertices + n > GROUP_VERTICES:
+                group, vertices = group + 1, 0
+            counters[m] = (group, vertices + n)
+            groups.add((m, group))
+    return len(groups)
+
+def gpu_bytes(mesh, used):
+    face_vertices = 3 * mesh["ntris"] + 4 * mesh["nquads"]
+    per_vertex = 12 + (12 if mesh["nnormals"] else 0) + (8 if mesh["nuvs"] else 0)
+
+    unrolled = face_vertices * per_vertex + 2 * 3 * len(mesh["triangles"]) + 2 * 2 * (3 * mesh["ntris"] + 4 * mesh["nquads"])
+    indexed = used * per_vertex + len(mesh["triangles"]) * 3 * (2 if used <= 65536 else 4)
+
+    return { "unrolled": unrolled, "indexed": indexed }
+
+def file_bytes(files):
+    raw = 0
+    deflated = 0
+    for fname in files:
+        data = open(fname, "rb").read()
+        raw += len(data)
+        deflated += len(zlib.compress(data, 9))
+    return { "raw": raw, "deflated": deflated }
+
+def model_name(fname):
+    """Path relative to the models directory, as given for models elsewhere.
+    """
+
+    name = os.path.relpath(os.path.abspath(fname), MODELS_DIR)
+    if name.startswith(".."):
+        return fname
+    return name.replace(os.sep, "/")
+
+def mesh_stats(mesh):
+    positions = mesh["positions"]
+    triangles = mesh["triangles"]
+    nvertices = len(positions)
+
+    if len(triangles) and (triangles.min() < 0 or triangles.max() >= nvertices):
+        raise ValueError("face indices out of range 0 - %d" % (nvertices - 1))
+
+    used = numpy.zeros(nvertices, dtype=bool)
+    used[triangles.ravel()] = True
+    nused = int(used.sum())
+
+    duplicates = 0
+    if nvertices:
+        rows = numpy.ascontiguousarray(positions).view([("", positions.dtype)] * 3).ravel()
+        duplicates = nvertices - len(numpy.unique(rows))
+
+    result = {
+    "file"              : model_name(mesh["files"][0]),
+    "format"            : mesh["format"],
+    "bytes"             : file_bytes(mesh["files"]),
+    "vertices"          : nvertices,
+    "normals"           : mesh["nnormals"],
+    "uvs"               : mesh["nuvs"],
+    "materials"         : mesh["nmaterials"],
+    "faces"             : mesh["ntris"] + mesh["nquads"],
+    "triangles"         : len(triangles),
+    "sections"          : mesh["sections"],
+    "duplicateVertices" : duplicates,
+    "unusedVertices"    : nvertices - nused,
+    "indexRange"        : [int(triangles.min()), int(triangles.max())] if len(triangles) else None,
+    "reuse"             : round(len(triangles) / float(nused), 3) if nused else 0.0,
+    "acmr"              : dict((str(size), round(acmr(triangles, nvertices, size), 3)) for size in CACHE_SIZES),
+    "drawCalls"         : draw_calls(mesh),
+    "gpuBytes"          : gpu_bytes(mesh, nused),
+    "bounds"            : positions.min(axis=0).tolist() + positions.max(axis=0).tolist() if nvertices else None
+    }
+
+    return result
+
+# #####################################################
+# API
+# #####################################################
+def find_models(paths):
+    """Models in paths, directories are searched for .obj and .js files.
+    """
+
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for pattern in ("*.obj", "*.js"):
+                files.extend(sorted(glob.glob(os.path.join(path, pattern))))
+        else:
+            files.append(path)
+    return files
+
+def analyze(paths):
+    results = []
+    for fname in find_models(paths or [MODELS_DIR]):
+        try:
+            results.append(mesh_stats(load_mesh(fname)))
+        except (ValueError, KeyError, IOError), e:
+            print >> sys.stderr, "WARNING: skipping [%s]: %s" % (fname, e)
+    return results
+
+# #####################################################
+# Helpers
+# #####################################################
+def usage():
+    print "Usage: %s [-o outfile.json] [-c sizes] [model|directory ...]" % os.path.basename(sys.argv[0])
+
+# #####################################################
+# Main
+# #####################################################
+if __name__ == "__main__":
+
+    # get parameters from the command line
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "ho:c:", ["help", "output=", "cache="])
+
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    outfile = ""
+
+    try:
+        for o, a in opts:
+            if o in ("-h", "--help"):
+                usage()
+                sys.exit()
+
+            elif o in ("-o", "--output"):
+                outfile = a
+
+            elif o in ("-c", "--cache"):
+                CACHE_SIZES = [max(1, int(s)) for s in a.split(",")]
+
+    except ValueError:
+        usage()
+        sys.exit(2)
+
+    text = json.dumps(analyze(args), indent=4, sort_keys=True)
+
+    if outfile:
+        out = open(outfile, "w")
+        out.write(text)
+        out.close()
+    else:
+        print text
@@ -0,0 +1,239 @@
+"""Prune grid meshes down to the vertices a data texture can show
+
+createPoints (globe.js) puts one point model on every grid vertex and
+gives all of the point's vertices the grid vertex uv. The data shader
+then samples textureData there and its fragment shader discards the
+point when data.r < extrudeMin, so with sparse data most points of
+gridLand10 are transformed and rasterized only to be thrown away.
+
+This tool samples the data texture at every grid vertex offline and
+writes a grid with only the vertices that can pass the threshold, or
+the whole grid ordered by data value with vertex counts per threshold,
+so the client can draw just the leading part of the geometry.
+
+-------------------------
+How to use this tool
+-------------------------
+
+python prune_grid.py -i gridLand10.obj -d ../worldDataSample.jpg -o gridLand10_pruned.js [-e extrudeMin] [-t ascii|binary] [-r thresholds]
+
+Notes:
+    - flags
+        -i grid.obj                 grid mesh (gridLand / gridWater OBJ)
+        -d texture                  data texture (worldDataSample.jpg or rasterize_data.py output)
+        -o outfile.js               output grid
+        -e extrudeMin               threshold (pointExtrudeRange[0] in globe.js)
+        -t ascii|binary             converter output type
+        -r t1,t2,...                ranges: keep all vertices sorted by data value, largest first,
+                                    and write vertex counts for these thresholds to outfile.ranges.json
+
+    - by default:
+        extrudeMin is 0.01 (as in globe.js)
+        type is ascii
+        vertices below extrudeMin are dropped
+
+    - needs NumPy and PIL (Python Imaging Library)
+
+-------------
+Sampling
+-------------
+
+Texture is read from the red channel (data.r) with the uv createPoints
+computes, texel rows go from north (v = 0) to south as in
+rasterize_data.py. GPU filtering blends the 2x2 texels around the
+sample point, so a vertex is kept when the largest of those four
+texels reaches the threshold: pruning never drops a point the shader
+would have drawn.
+
+Faces are kept when all their vertices are kept, createPoints only
+uses the vertices.
+
+ranges.json:
+
+    { "vertices": 39984, "ranges": [ { "extrudeMin": 0.01, "vertices": 11147 }, ... ] }
+
+point models of the first "vertices" grid vertices are all that can
+be visible with that extrudeMin.
+
+"""
+
+import getopt
+import json
+import os.path
+import sys
+
+import numpy
+
+from PIL import Image
+
+import convert_obj_three
+
+# #####################################################
+# Configuration
+# #####################################################
+EXTRUDE_MIN = 0.01
+TYPE = "ascii"          # ascii binary
+THRESHOLDS = []
+
+# #####################################################
+# Sampling
+# #####################################################
+def load_texture(fname):
+    """Red channel as 0 - 1 floats.
+    """
+
+    image = Image.open(fname).convert("RGB")
+    return numpy.asarray(image, dtype=numpy.float64)[:, :, 0] / 255.0
+
+def grid_uv(vertices):
+    """uv of grid vertices, as createPoints computes them.
+    """
+
+    x = vertices[:, 0]
+    y = vertices[:, 1]
+    z = vertices[:, 2]
+
+    r = numpy.sqrt((vertices * vertices).sum(axis=1))
+    u = (numpy.arctan2(z, -x) + numpy.pi) / (2 * numpy.pi)
+    v = numpy.arccos(numpy.clip(y / r, -1, 1)) / numpy.pi
+
+    return u, v
+
+def sample_max(texture, u, v):
+    """Largest of the 2x2 texels bilinear filtering blends at (u, v).
+    """
+
+    height, width = texture.shape
+
+    x = u * width - 0.5
+    y = v * height - 0.5
+
+    x0 = numpy.clip(numpy.floor(x).astype(numpy.int64), 0, width - 1)
+    y0 = numpy.clip(numpy.floor(y).astype(numpy.int64), 0, height - 1)
+    x1 = numpy.clip(x0 + 1, 0, width - 1)
+    y1 = numpy.clip(y0 + 1, 0, height - 1)
+
+    return numpy.maximum(numpy.maximum(texture[y0, x0], texture[y0, x1]),
+                         numpy.maximum(texture[y1, x0], texture[y1, x1]))
+
+# #####################################################
+# Pruning
+# #####################################################
+def reindex(faces, order):
+    """Faces with vertices renumbered to their position in order,
+    faces using vertices not in order are dropped.
+    """
+
+    remap = {}
+    for i, old in enumerate(order):
+        remap[old + 1] = i + 1
+
+    result = []
+    for f in faces:
+        if all(v in remap for v in f['vertex']):
+            result.append(dict(f, vertex=[remap[v] for v in f['vertex']]))
+    return result
+
+def prune(model, values, threshold):
+    faces, vertices, uvs, normals, materials, mtllib = model
+
+    order = numpy.nonzero(values >= threshold)[0].tolist()
+    return reindex(faces, order), [vertices[i] for i in order], uvs, normals, materials, mtllib
+
+def sort_by_value(model, values, thresholds):
+    faces, vertices, uvs, normals, materials, mtllib = model
+
+    order = numpy.argsort(-values, kind="mergesort")
+    ranges = [{ "extrudeMin": t, "vertices": int((values >= t).sum()) } for t in thresholds]
+
+    order = order.tolist()
+    return (reindex(faces, order), [vertices[i] for i in order], uvs, normals, materials, mtllib), ranges
+
+# #####################################################
+# API
+# #####################################################
+def prune_grid(infile, texturefile, outfile):
+    model = convert_obj_three.load_obj(infile)
+    vertices = numpy.array(model[1], dtype=numpy.float64)
+
+    u, v = grid_uv(vertices)
+    values = sample_max(load_texture(texturefile), u, v)
+
+    if THRESHOLDS:
+        model, ranges = sort_by_value(model, values, THRESHOLDS)
+
+        root, ext = os.path.splitext(outfile)
+        out = open(root + ".ranges.json", "w")
+        json.dump({ "vertices": len(vertices), "ranges": ranges }, out, indent=4)
+        out.close()
+
+        for r in ranges:
+            print "extrudeMin %.3f: %d of %d vertices" % (r["extrudeMin"], r["vertices"], len(vertices))
+    else:
+        nfaces = len(model[0])
+        model = prune(model, values, EXTRUDE_MIN)
+        print "extrudeMin %.3f: %d of %d vertices, %d of %d faces" % (EXTRUDE_MIN, len(model[1]), len(vertices), len(model[0]), nfaces)
+
+    convert_obj_three.TYPE = TYPE
+    if TYPE == "binary":
+        convert_obj_three.convert_binary(infile, outfile, model)
+    else:
+        convert_obj_three.convert_ascii(infile, "", "", outfile, model)
+
+# #####################################################
+# Helpers
+# #####################################################
+def usage():
+    print "Usage: %s -i grid.obj -d texture -o outfile.js [-e extrudeMin] [-t ascii|binary] [-r t1,t2,...]" % os.path.basename(sys.argv[0])
+
+# #####################################################
+# Main
+# #####################################################
+if __name__ == "__main__":
+
+    # get parameters from the command line
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hi:d:o:e:t:r:", ["help", "input=", "data=", "output=", "extrude=", "type=", "ranges="])
+
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    infile = texturefile = outfile = ""
+
+    try:
+        for o, a in opts:
+            if o in ("-h", "--help"):
+                usage()
+                sys.exit()
+
+            elif o in ("-i", "--input"):
+                infile = a
+
+            elif o in ("-d", "--data"):
+                texturefile = a
+
+            elif o in ("-o", "--output"):
+                outfile = a
+
+            elif o in ("-e", "--extrude"):
+                EXTRUDE_MIN = float(a)
+
+            elif o in ("-t", "--type"):
+                if a in ("ascii", "binary"):
+                    TYPE = a
+
+            elif o in ("-r", "--ranges"):
+                THRESHOLDS = [float(t) for t in a.split(",")]
+
+    except ValueError:
+        usage()
+        sys.exit(2)
+
+    if infile == "" or texturefile == "" or outfile == "":
+        usage()
+        sys.exit(2)
+
+    print "Pruning [%s] with [%s] into [%s] ..." % (infile, texturefile, outfile)
+
+    prune_grid(infile, texturefile, outfile)
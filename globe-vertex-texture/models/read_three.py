@@ -0,0 +1,498 @@
+"""Read models written by convert_obj_three.py back into NumPy arrays
+
+Binary models (.js + .bin) are memory mapped and every part of the .bin
+is a NumPy view into the mapping, nothing is parsed or copied until it
+is used. ASCII models (.js) are parsed into arrays of the same layout,
+so an ASCII and a binary conversion of one OBJ, or outputs of an old
+and a new writer, can be compared directly.
+
+-------------------------
+How to use this reader
+-------------------------
+
+python read_three.py model.js [other.js]
+
+Notes:
+    - with one model prints its header, counts and face sections
+    - with two models compares them, exits with 1 when they differ
+      (positions up to the float / geodetic precision, normals up to
+      the binary signed byte precision, uvs, faces exactly)
+
+    - from Python:
+
+        import read_three
+
+        model = read_three.load("gridLand6_bin.js")
+        model.vertices                          # (nvertices, 3) float32 view (uint16 for geodetic)
+        model.sections["triangles_flat"]        # structured view: vertex (n, 3), material
+        model.positions()                       # float positions, geodetic ones decoded
+        model.close()
+
+    - needs NumPy
+
+-------------
+Model
+-------------
+
+    kind            "ascii" or "binary"
+    metadata        JSON object of the .js file (without the big arrays)
+    vertices        (nvertices, 3) float32, or uint16 lat / lng / offset for geodetic
+    normals         (nnormals, 3) int8 for binary, float for ASCII
+    uvs             (nuvs, 2) float32, v as stored (flipped, 1 - v of the OBJ)
+    sections        face sections in binary file order, structured arrays with
+                    fields vertex, material and, if the section has them, normal and uv
+                    (all 0-based, as in the .bin)
+    runs            (section, start, count) in draw order, faces of ASCII models
+                    can alternate between sections
+    sphere          center, radius, offset of geodetic models, else None
+    header          binary header sizes and counts, else None
+
+"""
+
+import collections
+import json
+import mmap
+import os.path
+import struct
+import sys
+
+import numpy
+
+# #####################################################
+# Configuration
+# #####################################################
+SIGNATURE = "Three.js"
+
+HEADER_SIZES = '<BBBBBBBB'
+HEADER_COUNTS = '<IIIIIIIIIII'
+HEADER_SPHERE = '<ffffff'
+
+# face sections in file order (counts in the header follow the same order):
+# name, vertices per face, vertex normals, vertex uvs
+SECTIONS = [
+("triangles_flat",      3, False, False),
+("triangles_smooth",    3, True,  False),
+("triangles_flat_uv",   3, False, True),
+("triangles_smooth_uv", 3, True,  True),
+("quads_flat",          4, False, False),
+("quads_smooth",        4, True,  False),
+("quads_flat_uv",       4, False, True),
+("quads_smooth_uv",     4, True,  True)
+]
+
+SIZE_FIELDS = ["header_bytes", "vertex_coordinate_bytes", "normal_coordinate_bytes", "uv_coordinate_bytes",
+               "vertex_index_bytes", "normal_index_bytes", "uv_index_bytes", "material_index_bytes"]
+COUNT_FIELDS = ["nvertices", "nnormals", "nuvs"] + ["n" + name for name, n, smooth, uv in SECTIONS]
+
+UNSIGNED = { 1: "u1", 2: "<u2", 4: "<u4" }
+SIGNED = { 1: "i1", 2: "<i2", 4: "<i4" }
+FLOATS = { 4: "<f4", 8: "<f8" }
+
+POSITION_TOLERANCE = 1e-4       # relative to model size
+NORMAL_TOLERANCE = 1.0 / 127
+UV_TOLERANCE = 1e-4
+
+# #####################################################
+# Sections
+# #####################################################
+def section_dtype(n, smooth, uv, vertex_bytes=4, normal_bytes=4, uv_bytes=4, material_bytes=2):
+    """Packed record of one face, as convert_binary writes it.
+    """
+
+    fields = [("vertex", UNSIGNED[vertex_bytes], (n,)), ("material", UNSIGNED[material_bytes])]
+    if smooth:
+        fields.append(("normal", UNSIGNED[normal_bytes], (n,)))
+    if uv:
+        fields.append(("uv", UNSIGNED[uv_bytes], (n,)))
+    return numpy.dtype(fields)
+
+def section_name(n, smooth, uv):
+    return "%s_%s%s" % ("triangles" if n == 3 else "quads", "smooth" if smooth else "flat", "_uv" if uv else "")
+
+# #####################################################
+# Model
+# #####################################################
+class Model:
+    def __init__(self, kind, metadata):
+        self.kind = kind
+        self.metadata = metadata
+        self.vertices = None
+        self.normals = None
+        self.uvs = None
+        self.sections = collections.OrderedDict()
+        self.runs = []
+        self.sphere = None
+        self.header = None
+
+        self.map = None
+        self.file = None
+
+    def nfaces(self):
+        return sum(len(s) for s in self.sections.values())
+
+    def positions(self):
+        """Float positions, decoded for geodetic models (view otherwise).
+        """
+
+        if self.sphere is None:
+            return self.vertices
+        return geodetic_positions(self.vertices, self.sphere)
+
+    def unit_normals(self):
+        """Normals as unit float vectors, radial for geodetic models with implied normals.
+        """
+
+        if self.normals is None or not len(self.normals):
+            if self.sphere is not None and self.sphere.get("impliedNormals"):
+                n = self.positions() - numpy.array(self.sphere["center"])
+            else:
+                return numpy.zeros((0, 3))
+        else:
+            n = self.normals.astype(numpy.float64)
+
+        length = numpy.sqrt((n * n).sum(axis=1))
+        return n / numpy.maximum(length, 1e-12)[:, None]
+
+    def faces(self):
+        """(vertex indices, materials) runs in draw order.
+        """
+
+        for name, start, count in self.runs:
+            records = self.sections[name][start:start + count]
+            yield records["vertex"], records["material"]
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.file.close()
+            self.map = self.file = None
+
+# #####################################################
+# .js
+# #####################################################
+def read_js(fname):
+    """JSON object of a converted .js file (between var model = and postMessage).
+    """
+
+    text = open(fname).read()
+    start = text.find("{")
+    end = text.rfind("}")
+    if start < 0 or end < start:
+        raise ValueError("[%s] is not a converted model" % fname)
+
+    try:
+        return json.loads(text[start:end + 1])
+    except ValueError, e:
+        raise ValueError("[%s] is not a converted model: %s" % (fname, e))
+
+def load(fname):
+    """Model from .js file (ASCII or binary, for binary the .bin is found
+    through "buffers"), or straight from a .bin file.
+    """
+
+    if os.path.splitext(fname)[1].lower() == ".bin":
+        return load_binary(fname, {})
+
+    metadata = read_js(fname)
+
+    if metadata.get("encoding") == "edgebreaker":
+        raise ValueError("[%s] is compressed, use convert_obj_three.decode_compressed" % fname)
+
+    if "buffers" in metadata:
+        return load_binary(os.path.join(os.path.dirname(fname), metadata["buffers"]), metadata)
+
+    return load_ascii(metadata)
+
+# #####################################################
+# ASCII
+# #####################################################
+def face_length(kind, nlayers):
+    n = 4 if kind & 1 else 3
+    return 1 + n + bool(kind & 2) + (kind & 4 and nlayers) + (kind & 8 and nlayers * n) + \
+           bool(kind & 16) + (kind & 32 and n) + bool(kind & 64) + (kind & 128 and n)
+
+def decode_faces(data, kind, nlayers):
+    """Faces of one type, (nfaces, length) ints, into face section records.
+    """
+
+    n = 4 if kind & 1 else 3
+    smooth = bool(kind & 32)
+    uv = bool(kind & 8)
+
+    records = numpy.zeros(len(data), dtype=section_dtype(n, smooth, uv))
+
+    column = 1
+    records["vertex"] = data[:, column:column + n]
+    column += n
+
+    if kind & 2:
+        records["material"] = data[:, column]
+        column += 1
+    if kind & 4:
+        column += nlayers
+    if uv:
+        records["uv"] = data[:, column:column + n]
+        column += nlayers * n
+    if kind & 16:
+        column += 1
+    if smooth:
+        records["normal"] = data[:, column:column + n]
+
+    return section_name(n, smooth, uv), records
+
+def split_faces(data, nlayers):
+    """Flat face list into runs of faces of the same type, [(type, start, count)].
+    """
+
+    runs = []
+    i = 0
+    count = 0
+    while i < len(data):
+        kind = data[i]
+        length = face_length(kind, nlayers)
+
+        # whole rest of the list is often one type, check it at once
+        rest = len(data) - i
+        if rest % length == 0 and (data[i:len(data):length] == kind).all():
+            runs.append((kind, i, rest // length))
+            break
+
+        if runs and runs[-1][0] == kind and runs[-1][1] + runs[-1][2] * length == i:
+            runs[-1] = (kind, runs[-1][1], runs[-1][2] + 1)
+        else:
+            runs.append((kind, i, 1))
+        i += length
+
+    return runs
+
+def load_ascii(metadata):
+    model = Model("ascii", dict((k, v) for k, v in metadata.items() if k not in ("vertices", "normals", "uvs", "faces", "colors")))
+
+    model.vertices = numpy.array(metadata.get("vertices", []), dtype=numpy.float32).reshape(-1, 3)
+    model.normals = numpy.array(metadata.get("normals", []), dtype=numpy.float32).reshape(-1, 3)
+
+    layers = metadata.get("uvs", [[]])
+    model.uvs = numpy.array(layers[0] if layers else [], dtype=numpy.float32).reshape(-1, 2)
+
+    data = numpy.array(metadata.get("faces", []), dtype=numpy.int64)
+    nlayers = max(1, len(layers))
+
+    parts = collections.defaultdict(list)
+    order = []
+    for kind, start, count in split_faces(data, nlayers):
+        length = face_length(kind, nlayers)
+        name, records = decode_faces(data[start:start + count * length].reshape(count, length), kind, nlayers)
+        order.append((name, sum(len(p) for p in parts[name]), count))
+        parts[name].append(records)
+
+    for name, n, smooth, uv in SECTIONS:
+        if parts[name]:
+            model.sections[name] = numpy.concatenate(parts[name])
+        else:
+            model.sections[name] = numpy.zeros(0, dtype=section_dtype(n, smooth, uv))
+
+    model.runs = order
+    return model
+
+# #####################################################
+# Binary
+# #####################################################
+def load_binary(binfile, metadata):
+    model = Model("binary", metadata)
+
+    model.file = open(binfile, "rb")
+    size = os.fstat(model.file.fileno()).st_size
+
+    fixed = struct.calcsize('<8s') + struct.calcsize(HEADER_SIZES) + struct.calcsize(HEADER_COUNTS)
+    if size < fixed:
+        model.file.close()
+        raise ValueError("[%s] is too short for a binary model" % binfile)
+
+    model.map = mmap.mmap(model.file.fileno(), 0, access=mmap.ACCESS_READ)
+    data = model.map
+
+    if data[:8] != SIGNATURE:
+        model.close()
+        raise ValueError("[%s] is not a binary Three.js model" % binfile)
+
+    sizes = struct.unpack_from(HEADER_SIZES, data, 8)
+    counts = struct.unpack_from(HEADER_COUNTS, data, 8 + struct.calcsize(HEADER_SIZES))
+
+    model.header = dict(zip(SIZE_FIELDS, sizes) + zip(COUNT_FIELDS, counts))
+    h = model.header
+
+    # geodetic header extension
+    if h["header_bytes"] >= fixed + struct.calcsize(HEADER_SPHERE):
+        cx, cy, cz, radius, lo, hi = struct.unpack_from(HEADER_SPHERE, data, fixed)
+        implied = metadata.get("sphere", {}).get("impliedNormals", False)
+        model.sphere = { "center": [cx, cy, cz], "radius": radius, "offset": [lo, hi], "impliedNormals": implied }
+
+    offset = h["header_bytes"]
+
+    def view(dtype, count):
+        dtype = numpy.dtype(dtype)
+        if offset + count * dtype.itemsize > size:
+            model.close()
+            raise ValueError("[%s] is truncated" % binfile)
+        return numpy.frombuffer(data, dtype=dtype, count=count, offset=offset)
+
+    vertex_type = UNSIGNED[2] if model.sphere else FLOATS[h["vertex_coordinate_bytes"]]
+    model.vertices = view(vertex_type, h["nvertices"] * 3).reshape(-1, 3)
+    offset += model.vertices.nbytes
+
+    model.normals = view(SIGNED[h["normal_coordinate_bytes"]], h["nnormals"] * 3).reshape(-1, 3)
+    offset += model.normals.nbytes
+
+    model.uvs = view(FLOATS[h["uv_coordinate_bytes"]], h["nuvs"] * 2).reshape(-1, 2)
+    offset += model.uvs.nbytes
+
+    for name, n, smooth, uv in SECTIONS:
+        dtype = section_dtype(n, smooth, uv, h["vertex_index_bytes"], h["normal_index_bytes"], h["uv_index_bytes"], h["material_index_bytes"])
+        model.sections[name] = view(dtype, h["n" + name])
+        offset += model.sections[name].nbytes
+
+        if len(model.sections[name]):
+            model.runs.append((name, 0, len(model.sections[name])))
+
+    if offset != size:
+        model.close()
+        raise ValueError("[%s] has %d bytes, header describes %d" % (binfile, size, offset))
+
+    return model
+
+def geodetic_positions(q, sphere):
+    """Decode quantized (latitude, longitude, radial offset), as geodetic_position does.
+    """
+
+    q = q.astype(numpy.float64) / 65535.0
+    lat = -numpy.pi / 2 + numpy.pi * q[:, 0]
+    lng = -numpy.pi + 2 * numpy.pi * q[:, 1]
+    r = sphere["radius"] + sphere["offset"][0] + (sphere["offset"][1] - sphere["offset"][0]) * q[:, 2]
+
+    return numpy.column_stack((sphere["center"][0] + r * numpy.cos(lat) * numpy.cos(lng),
+                               sphere["center"][1] + r * numpy.sin(lat),
+                               sphere["center"][2] + r * numpy.cos(lat) * numpy.sin(lng)))
+
+# #####################################################
+# Comparison
+# #####################################################
+def compare(a, b):
+    """Differences between two models, empty list when they match.
+    """
+
+    differences = []
+
+    pa = a.positions().astype(numpy.float64)
+    pb = b.positions().astype(numpy.float64)
+
+    if pa.shape != pb.shape:
+        differences.append("vertices: %d and %d" % (len(pa), len(pb)))
+    elif len(pa):
+        extent = max(numpy.abs(pa).max(), 1.0)
+        tolerance = POSITION_TOLERANCE * extent
+        if a.sphere is not None or b.sphere is not None:
+            # 16 bit latitude / longitude steps
+            tolerance = max(tolerance, 2 * numpy.pi / 65535 * extent)
+        error = numpy.abs(pa - pb).max()
+        if error > tolerance:
+            differences.append("positions differ by up to %g" % error)
+
+    na = a.unit_normals()
+    nb = b.unit_normals()
+    if len(na) and len(nb):
+        if na.shape != nb.shape:
+            differences.append("normals: %d and %d" % (len(na), len(nb)))
+        else:
+            error = numpy.abs(na - nb).max()
+            if error > 2 * NORMAL_TOLERANCE:
+                differences.append("normals differ by up to %g" % error)
+
+    if a.uvs.shape != b.uvs.shape:
+        differences.append("uvs: %d and %d" % (len(a.uvs), len(b.uvs)))
+    elif len(a.uvs):
+        error = numpy.abs(a.uvs.astype(numpy.float64) - b.uvs).max()
+        if error > UV_TOLERANCE:
+            differences.append("uvs differ by up to %g" % error)
+
+    implied = any(m.sphere is not None and m.sphere.get("impliedNormals") for m in (a, b))
+
+    for name, n, smooth, uv in SECTIONS:
+        sa = a.sections[name]
+        sb = b.sections[name]
+
+        if implied and name.replace("_smooth", "_flat") != name:
+            continue
+        if implied:
+            # implied normals move smooth faces into flat sections
+            sa = merge_smooth(a, name)
+            sb = merge_smooth(b, name)
+
+        if len(sa) != len(sb):
+            differences.append("%s: %d and %d faces" % (name, len(sa), len(sb)))
+            continue
+
+        for field in sa.dtype.names:
+            if field in (sb.dtype.names or ()) and not (sa[field] == sb[field]).all():
+                differences.append("%s: %s indices differ" % (name, field))
+
+    return differences
+
+def merge_smooth(model, flat):
+    """Faces of flat section together with its smooth section (without normal indices).
+    """
+
+    smooth = flat.replace("_flat", "_smooth")
+    parts = [model.sections[flat][["vertex", "material"] + (["uv"] if flat.endswith("_uv") else [])],
+             model.sections[smooth][["vertex", "material"] + (["uv"] if flat.endswith("_uv") else [])]]
+
+    fields = [(f, parts[0].dtype.fields[f][0]) for f in parts[0].dtype.names]
+    merged = numpy.zeros(len(parts[0]) + len(parts[1]), dtype=fields)
+    merged[:len(parts[0])] = parts[0]
+    merged[len(parts[0]):] = parts[1]
+    return merged
+
+# #####################################################
+# Helpers
+# #####################################################
+def describe(model):
+    print "%s model, %d vertices, %d normals, %d uvs, %d faces" % (model.kind, len(model.vertices), len(model.normals), len(model.uvs), model.nfaces())
+
+    if model.header:
+        print "    header: %s" % ", ".join("%s %d" % (k, model.header[k]) for k in SIZE_FIELDS)
+    if model.sphere:
+        print "    geodetic: center %s, radius %g, offset %s" % (model.sphere["center"], model.sphere["radius"], model.sphere["offset"])
+
+    for name, records in model.sections.items():
+        if len(records):
+            print "    %-20s %d" % (name, len(records))
+
+def usage():
+    print "Usage: %s model.js [other.js]" % os.path.basename(sys.argv[0])
+
+# #####################################################
+# Main
+# #####################################################
+if __name__ == "__main__":
+
+    if len(sys.argv) not in (2, 3) or sys.argv[1] in ("-h", "--help"):
+        usage()
+        sys.exit(2)
+
+    try:
+        models = [load(fname) for fname in sys.argv[1:]]
+    except (ValueError, IOError), e:
+        print "ERROR: %s" % e
+        sys.exit(1)
+
+    for fname, model in zip(sys.argv[1:], models):
+        print "[%s]" % fname
+        describe(model)
+
+    if len(models) == 2:
+        differences = compare(*models)
+        for d in differences:
+            print "DIFFERENT: %s" % d
+        if not differences:
+            print "models match"
+
+        sys.exit(1 if differences else 0)
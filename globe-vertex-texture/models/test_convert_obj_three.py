@@ -0,0 +1,171 @@
+"""Round trips of the compressed format through the reference decoder
+
+    python test_convert_obj_three.py
+
+Every model is encoded with encode_compressed and decoded again with
+decode_compressed, connectivity has to come back exactly (triangles up to
+rotation of their vertices, winding kept), positions and uvs within the
+quantization step, normals and materials exactly.
+"""
+
+import math
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import convert_obj_three
+
+MODELS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# two quads sharing an edge, with a UV seam and a hard edge along it
+SEAMED_OBJ = """
+v 0 0 0
+v 1 0 0
+v 1 1 0
+v 0 1 0
+v 2 0 1
+v 2 1 1
+vt 0 0
+vt 0.5 0
+vt 0.5 1
+vt 0 1
+vt 0.6 0
+vt 1 0
+vt 1 1
+vt 0.6 1
+vn 0 0 1
+vn -0.7071 0 0.7071
+f 1/1/1 2/2/1 3/3/1 4/4/1
+f 2/5/2 5/6/2 6/7/2 3/8/2
+"""
+
+def rotated(triangle):
+    """Triangle starting at its smallest index, winding kept.
+    """
+
+    i = triangle.index(min(triangle))
+    return tuple(triangle[i:]) + tuple(triangle[:i])
+
+def step(lo, hi, bits):
+    return (hi - lo) / float((1 << bits) - 1)
+
+class CompressedRoundTrip(unittest.TestCase):
+
+    bits = 16
+
+    def round_trip(self, name):
+        faces, vertices, uvs, normals, materials, mtllib = convert_obj_three.load_obj(os.path.join(MODELS_DIR, name + ".obj"))
+
+        data, order, torder = convert_obj_three.encode_compressed(faces, vertices, uvs, normals, self.bits)
+        triangles, positions, duvs, dnormals, dmaterials = convert_obj_three.decode_compressed(data)
+
+        original = convert_obj_three.triangulate(faces)
+
+        # connectivity
+
+        self.assertEqual(len(triangles), len(original))
+        self.assertEqual(sorted(torder), range(len(original)))
+        self.assertEqual(len(set(order)), len(order))
+
+        for t, triangle in enumerate(triangles):
+            self.assertEqual(rotated([order[i] for i in triangle]), rotated(original[torder[t]][0]))
+
+        # materials
+
+        self.assertEqual(dmaterials, [original[t][1] for t in torder])
+
+        # positions
+
+        self.assertEqual(len(positions), len(order))
+        for k in xrange(3):
+            values = [vertices[i][k] for i in order]
+            tolerance = step(min(values), max(values), self.bits) / 2.0 + 1e-4
+            for decoded, value in zip(positions, values):
+                self.assertLessEqual(abs(decoded[k] - value), tolerance)
+
+        # uvs (stored with v flipped, as in the binary format)
+
+        if convert_obj_three.per_vertex(faces, 'uv'):
+            self.assertEqual(len(duvs), len(order))
+            for k in xrange(2):
+                values = [uvs[i][k] if k == 0 else 1.0 - uvs[i][k] for i in order]
+                tolerance = step(min(values), max(values), self.bits) / 2.0 + 1e-6
+                for decoded, value in zip(duvs, values):
+                    self.assertLessEqual(abs(decoded[k] - value), tolerance)
+        else:
+            self.assertEqual(duvs, [])
+
+        # normals
+
+        if convert_obj_three.per_vertex(faces, 'normal') and convert_obj_three.SHADING == "smooth":
+            for decoded, i in zip(dnormals, order):
+                n = list(normals[i])
+                convert_obj_three.normalize(n)
+                self.assertEqual(decoded, [int(math.floor(c * 127 + 0.5)) for c in n])
+        else:
+            self.assertEqual(dnormals, [])
+
+    def test_cube(self):
+        self.round_trip("cube")
+
+    def test_hex(self):
+        self.round_trip("hex")
+
+    def test_sphere(self):
+        self.round_trip("sphere")
+
+    def test_gridLand0(self):
+        self.round_trip("gridLand0")
+
+    def test_seamed(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(tmpdir, "seamed.obj")
+            f = open(fname, "w")
+            f.write(SEAMED_OBJ)
+            f.close()
+            faces, vertices, uvs, normals, materials, mtllib = convert_obj_three.load_obj(fname)
+        finally:
+            shutil.rmtree(tmpdir)
+
+        sfaces, svertices, suvs, snormals = convert_obj_three.split_corners(faces, vertices, uvs, normals)
+        self.assertEqual(len(svertices), 8)
+        self.assertTrue(convert_obj_three.per_vertex(sfaces, 'uv'))
+
+        data, order, torder = convert_obj_three.encode_compressed(sfaces, svertices, suvs, snormals, self.bits)
+        triangles, positions, duvs, dnormals, dmaterials = convert_obj_three.decode_compressed(data)
+        self.assertEqual(len(duvs), 8)
+
+        # every decoded corner has the position, uv and normal of its face corner
+        corners = []
+        for f in faces:
+            c = zip(f['vertex'], f['uv'], f['normal'])
+            corners.append((c[0], c[1], c[2]))
+            corners.append((c[0], c[2], c[3]))
+
+        def close(a, b):
+            return all(abs(x - y) < 1e-3 for x, y in zip(a, b))
+
+        for t, triangle in enumerate(triangles):
+            original = corners[torder[t]]
+            matches = [r for r in xrange(3) if all(close(positions[triangle[(k + r) % 3]], vertices[original[k][0] - 1]) for k in xrange(3))]
+            self.assertEqual(len(matches), 1)
+            for k in xrange(3):
+                d = triangle[(k + matches[0]) % 3]
+                vi, ti, ni = original[k]
+                self.assertTrue(close(duvs[d], [uvs[ti - 1][0], 1.0 - uvs[ti - 1][1]]))
+                if convert_obj_three.SHADING == "smooth":
+                    n = list(normals[ni - 1])
+                    convert_obj_three.normalize(n)
+                    self.assertEqual(dnormals[d], [int(math.floor(c * 127 + 0.5)) for c in n])
+
+    def test_varints(self):
+        values = [0, 1, -1, 63, -64, 127, 128, -129, 1 << 20, -(1 << 31)]
+        encoded = convert_obj_three.write_varints(convert_obj_three.zigzag(v) for v in values)
+        decoded = [convert_obj_three.unzigzag(v) for v in convert_obj_three.read_varints(encoded)]
+        self.assertEqual(decoded, values)
+
+if __name__ == "__main__":
+    unittest.main()
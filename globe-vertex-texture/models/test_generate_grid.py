@@ -0,0 +1,73 @@
+"""Generated grids read back through read_three
+
+    python test_generate_grid.py
+"""
+
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+import generate_grid
+import read_three
+
+class GenerateGridTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cells = generate_grid.CELLS
+        self.type = generate_grid.TYPE
+        self.mask = generate_grid.load_mask(generate_grid.MASK)
+
+    def tearDown(self):
+        generate_grid.CELLS = self.cells
+        generate_grid.TYPE = self.type
+        shutil.rmtree(self.dir)
+
+    def generate(self, cells, kind):
+        generate_grid.CELLS = cells
+        generate_grid.TYPE = kind
+
+        # output directory is created
+        outdir = os.path.join(self.dir, kind, "grids")
+        generate_grid.generate_grid(0, self.mask, outdir)
+
+        return [read_three.load(os.path.join(outdir, "%s0.js" % name)) for name in ("gridLand", "gridWater")]
+
+    def test_grid(self):
+        land, water = self.generate(False, "binary")
+
+        ntriangles = sum(len(model.sections["triangles_flat"]) for model in (land, water))
+        self.assertEqual(ntriangles, 2000)
+
+        # coast vertices are in both meshes
+        points = numpy.vstack((land.positions(), water.positions()))
+        unique = numpy.unique(numpy.round(points * 1000).astype(numpy.int64), axis=0)
+        self.assertEqual(len(unique), 1002)
+
+        for model in (land, water):
+            model.close()
+
+    def test_cells_uv(self):
+        for kind in ("ascii", "binary"):
+            for model in self.generate(True, kind):
+                quads = model.sections["quads_smooth_uv"]
+                self.assertTrue(len(quads))
+
+                # stored uv (used as is by JSONLoader) is createPoints' uv of the cell center
+                positions = model.positions()
+                centers = positions[quads["vertex"]].mean(axis=1)
+                centers /= numpy.sqrt((centers * centers).sum(axis=1))[:, None]
+                u, v = generate_grid.uv(centers)
+
+                stored = numpy.asarray(model.uvs)[quads["uv"][:, 0]]
+                du = numpy.abs(stored[:, 0] - u)
+                self.assertTrue((numpy.minimum(du, 1 - du) < 1e-4).all(), kind)     # u = 0 and 1 are the same seam
+                self.assertTrue(numpy.allclose(stored[:, 1], v, atol=1e-4), kind)
+
+                model.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,329 @@
+"""Rasterize globe datasets into equirectangular data textures
+
+The data shader (shaders.js) displaces grid vertices by textureData.r
+sampled at the vertex uv, where createPoints in globe.js sets
+
+    u = (atan2(z, -x) + PI) / (2 PI)    = (lng + 180) / 360
+    v = acos(y / 200) / PI              = (90 - lat) / 180
+
+so the texture is a plain equirectangular map with north at the top row,
+the same layout as worldDataSample.jpg. This tool makes such textures
+from the lat / lng / magnitude arrays addData uses.
+
+-------------------------
+How to use this rasterizer
+-------------------------
+
+python rasterize_data.py -i ../globe/population909500.json -o worldData.png [-s 2048x1024] [-m max|sum|mean] [-g sigma] [-p uint8|uint16|float32] [-f magnitude|legend] [-n] [-l]
+
+Notes:
+    - flags
+        -i infile                   input dataset (JSON, CSV or compiled .bin, see globe/compile_data.py)
+        -o outfile.png|outfile.bin  output texture, PNG image or raw little-endian texels
+        -s WxH                      texture size
+        -m max|sum|mean             how magnitudes in one texel are combined
+        -g sigma                    gaussian splat radius in texels (at the equator)
+        -p uint8|uint16|float32     texel packing
+        -f magnitude|legend         data format (3 or 4 numbers per point)
+        -n                          normalize so the largest texel is 1
+        -l                          write mipmap levels
+
+    - by default:
+        texture is 2048x1024 (like worldDataSample.jpg)
+        magnitudes of one texel are combined with max
+        no splatting
+        texels are uint8
+        values are clipped to 0 - 1, not normalized
+        no mipmaps
+
+    - datasets with more series get one texture per series
+      (outfile with series name appended)
+
+    - needs NumPy, PNG output needs PIL (Python Imaging Library)
+
+-------------
+Packing
+-------------
+
+    uint8       PNG: grayscale (drop-in for worldDataSample.jpg)
+                raw: 1 byte per texel
+    uint16      PNG: RGB with high byte in red and low byte in green,
+                     so data.r is still the value in the current shader
+                     and data.r + data.g / 255.0 is the full precision one
+                raw: 2 bytes per texel
+    float32     raw only: 4 bytes per texel (for float textures)
+
+Mipmap levels halve the size (rounding up) down to 1x1, each texel is the
+average of the 2x2 texels above it. PNG levels go to outfile_mipN.png,
+raw levels follow each other in outfile, largest first.
+
+Splatting adds a gaussian exp(-d^2 / 2 sigma^2) of every texel's value
+(peak stays at the value for isolated points), horizontal sigma grows
+with 1 / cos(lat) so splats are round on the globe, rows wrap around
+at the date line.
+
+"""
+
+import getopt
+import os.path
+import struct
+import sys
+
+import numpy
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "globe"))
+
+import compile_data
+
+# #####################################################
+# Configuration
+# #####################################################
+FORMAT = "magnitude"    # magnitude legend
+WIDTH = 2048
+HEIGHT = 1024
+COMBINE = "max"         # max sum mean
+SIGMA = 0.0
+PACKING = "uint8"       # uint8 uint16 float32
+NORMALIZE = False
+MIPMAPS = False
+
+# #####################################################
+# Rasterizing
+# #####################################################
+def texel_indices(lat, lng, width, height):
+    """Flat texel index of every point (row 0 is north).
+    """
+
+    col = numpy.floor((lng + 180.0) / 360.0 * width).astype(numpy.int64)
+    row = numpy.floor((90.0 - lat) / 180.0 * height).astype(numpy.int64)
+
+    col = numpy.clip(col, 0, width - 1)
+    row = numpy.clip(row, 0, height - 1)
+
+    return row * width + col
+
+def bin_points(lat, lng, magnitude, width, height, combine):
+    index = texel_indices(lat, lng, width, height)
+
+    if combine == "max":
+        texels = numpy.zeros(width * height)
+        numpy.maximum.at(texels, index, magnitude)
+    else:
+        texels = numpy.bincount(index, weights=magnitude, minlength=width * height)
+        if combine == "mean":
+            count = numpy.bincount(index, minlength=width * height)
+            texels = texels / numpy.maximum(count, 1)
+
+    return texels.reshape(height, width)
+
+def gaussian(sigma, limit):
+    radius = min(int(numpy.ceil(3 * sigma)), limit)
+    x = numpy.arange(-radius, radius + 1)
+    return numpy.exp(-x * x / (2.0 * sigma * sigma))
+
+def splat(texels, sigma):
+    """Gaussian splat, rows wrap around, columns are clamped at the poles.
+    """
+
+    height, width = texels.shape
+
+    # vertical
+    kernel = gaussian(sigma, height)
+    radius = len(kernel) // 2
+    padded = numpy.pad(texels, ((radius, radius), (0, 0)), mode="constant")
+    result = numpy.zeros_like(texels)
+    for i, k in enumerate(kernel):
+        result += k * padded[i:i + height]
+
+    # horizontal, wider towards the poles
+    lat = 90.0 - (numpy.arange(height) + 0.5) * 180.0 / height
+    stretch = 1.0 / numpy.maximum(numpy.cos(numpy.radians(lat)), 1e-3)
+
+    for row in xrange(height):
+        if not result[row].any():
+            continue
+        kernel = gaussian(sigma * stretch[row], width // 2)
+        radius = len(kernel) // 2
+        padded = numpy.concatenate((result[row, -radius:], result[row], result[row, :radius])) if radius else result[row]
+        result[row] = numpy.convolve(padded, kernel, mode="valid")
+
+    return result
+
+def mipmaps(texels):
+    """Mipmap chain, largest first, box filtered down to 1x1.
+    """
+
+    levels = [texels]
+    while texels.shape[0] > 1 or texels.shape[1] > 1:
+        height, width = texels.shape
+
+        # odd sizes repeat the last row / column
+        if height % 2 and height > 1:
+            texels = numpy.vstack((texels, texels[-1:]))
+        if width % 2 and width > 1:
+            texels = numpy.hstack((texels, texels[:, -1:]))
+
+        h = max(1, height // 2 + height % 2)
+        w = max(1, width // 2 + width % 2)
+        fy = texels.shape[0] // h
+        fx = texels.shape[1] // w
+
+        texels = texels.reshape(h, fy, w, fx).mean(axis=(1, 3))
+        levels.append(texels)
+
+    return levels
+
+def rasterize(values, step):
+    """Texels in 0 - 1 for one series.
+    """
+
+    values = numpy.asarray(values, dtype=numpy.float64).reshape(-1, step)
+    texels = bin_points(values[:, 0], values[:, 1], values[:, 2], WIDTH, HEIGHT, COMBINE)
+
+    if SIGMA > 0:
+        texels = splat(texels, SIGMA)
+
+    if NORMALIZE and texels.max() > 0:
+        texels = texels / texels.max()
+
+    return numpy.clip(texels, 0, 1)
+
+# #####################################################
+# Output
+# #####################################################
+def pack(texels, packing):
+    if packing == "uint8":
+        return numpy.floor(texels * 255 + 0.5).astype(numpy.uint8)
+    if packing == "uint16":
+        return numpy.floor(texels * 65535 + 0.5).astype(numpy.uint16)
+    return texels.astype(numpy.float32)
+
+def write_png(fname, packed):
+    try:
+        from PIL import Image
+    except ImportError:
+        print "WARNING: PNG output needs PIL (Python Imaging Library), [%s] not written" % fname
+        return False
+
+    if packed.dtype == numpy.uint16:
+        rgb = numpy.zeros(packed.shape + (3,), dtype=numpy.uint8)
+        rgb[..., 0] = packed >> 8
+        rgb[..., 1] = packed & 0xff
+        image = Image.fromarray(rgb, "RGB")
+    else:
+        image = Image.fromarray(packed, "L")
+
+    image.save(fname)
+    return True
+
+def write_texture(fname, texels):
+    levels = mipmaps(texels) if MIPMAPS else [texels]
+    packed = [pack(level, PACKING) for level in levels]
+
+    root, ext = os.path.splitext(fname)
+
+    if ext.lower() == ".png":
+        for i, level in enumerate(packed):
+            name = fname if i == 0 else "%s_mip%d%s" % (root, i, ext)
+            if write_png(name, level):
+                print "[%s] %dx%d" % (name, level.shape[1], level.shape[0])
+    else:
+        out = open(fname, "wb")
+        for level in packed:
+            out.write(level.astype(level.dtype.newbyteorder('<')).tostring())
+        out.close()
+        print "[%s] %dx%d %s, %d levels" % (fname, WIDTH, HEIGHT, PACKING, len(packed))
+
+# #####################################################
+# API
+# #####################################################
+def rasterize_dataset(infile, outfile):
+    """Rasterize infile dataset into outfile texture (or one per series).
+    """
+
+    if PACKING == "float32" and os.path.splitext(outfile)[1].lower() == ".png":
+        raise ValueError("float32 textures can only be written raw")
+
+    step = compile_data.STEPS[FORMAT]
+    series = compile_data.load_series(infile, step)
+    compile_data.validate(series, step)
+
+    for name, values in series:
+        fname = outfile
+        if len(series) > 1:
+            root, ext = os.path.splitext(outfile)
+            fname = "%s_%s%s" % (root, name, ext)
+
+        write_texture(fname, rasterize(values, step))
+
+# #####################################################
+# Helpers
+# #####################################################
+def usage():
+    print "Usage: %s -i dataset -o outfile.png|outfile.bin [-s WxH] [-m max|sum|mean] [-g sigma] [-p uint8|uint16|float32] [-f magnitude|legend] [-n] [-l]" % os.path.basename(sys.argv[0])
+
+# #####################################################
+# Main
+# #####################################################
+if __name__ == "__main__":
+
+    # get parameters from the command line
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hnli:o:s:m:g:p:f:", ["help", "normalize", "mipmaps", "input=", "output=", "size=", "combine=", "sigma=", "packing=", "format="])
+
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    infile = outfile = ""
+
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            usage()
+            sys.exit()
+
+        elif o in ("-i", "--input"):
+            infile = a
+
+        elif o in ("-o", "--output"):
+            outfile = a
+
+        elif o in ("-s", "--size"):
+            try:
+                WIDTH, HEIGHT = [max(1, int(v)) for v in a.lower().split("x")]
+            except ValueError:
+                usage()
+                sys.exit(2)
+
+        elif o in ("-m", "--combine"):
+            if a in ("max", "sum", "mean"):
+                COMBINE = a
+
+        elif o in ("-g", "--sigma"):
+            SIGMA = max(0.0, float(a))
+
+        elif o in ("-p", "--packing"):
+            if a in ("uint8", "uint16", "float32"):
+                PACKING = a
+
+        elif o in ("-f", "--format"):
+            if a in ("magnitude", "legend"):
+                FORMAT = a
+
+        elif o in ("-n", "--normalize"):
+            NORMALIZE = True
+
+        elif o in ("-l", "--mipmaps"):
+            MIPMAPS = True
+
+    if infile == "" or outfile == "":
+        usage()
+        sys.exit(2)
+
+    print "Rasterizing [%s] into [%s] ..." % (infile, outfile)
+
+    try:
+        rasterize_dataset(infile, outfile)
+    except ValueError, e:
+        print "ERROR: %s" % e
+        sys.exit(1)
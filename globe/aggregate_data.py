@@ -0,0 +1,340 @@
+"""Aggregate globe datasets into a pyramid of levels on an equal-area grid
+
+At globe zoom levels many points fall into the same screen pixel, so this
+tool bins points onto an equal-area spherical grid at several resolutions
+and writes one globe JSON file per level (cell centers with summed or
+averaged magnitudes) plus an index telling which level to load for which
+camera distance (DAT.Globe zooms between 350 and 1000).
+
+-------------------------
+How to use this tool
+-------------------------
+
+python aggregate_data.py -i population909500.json -o population909500 [-f magnitude|legend] [-m sum|mean] [-l levels]
+
+Notes:
+    - flags
+        -i infile                   input dataset (JSON, CSV or compiled .bin, see compile_data.py)
+        -o outdir                   output directory for level files and index.json
+        -f magnitude|legend         data format (3 or 4 numbers per point)
+        -m sum|mean                 how magnitudes in one cell are combined
+        -l levels                   number of levels (coarsest ones never used inside 350 - 1000 are left out)
+
+    - by default:
+        format is magnitude
+        magnitudes are summed (and normalized so largest cell of each level is 1)
+        4 levels (16, 32, 64 and 128 rings), 16 rings would only be used
+        beyond 1000, so 3 levels are written (32, 64 and 128 rings)
+
+    - needs NumPy
+
+-------------
+Grid
+-------------
+
+Level l has BASE_RINGS * 2^l rings of latitude. Ring i gets
+round(2 * nrings * cos(lat_i)) cells (square cells at the equator)
+and ring borders are placed in z = sin(lat) so that every cell of
+the level has exactly the same area (HEALPix-like isolatitude grid).
+
+Every series is binned on the same cells, and level files list the
+union of occupied cells in the same order for all series (empty cells
+have magnitude 0), so levels can be used with animated: true.
+
+With legend format cell gets the legend with the largest magnitude.
+
+-------------
+Index
+-------------
+
+index.json:
+
+    {
+    "grid"     : "equal-area",
+    "format"   : "magnitude",
+    "combine"  : "sum",
+    "series"   : ["1990", "1995", "2000"],
+    "levels"   : [
+        { "level": 0, "file": "level0.json", "rings": 32, "cells": 1302, "occupied": 494,
+          "cellSize": 5.629, "distance": [800.4, 1000.0] },
+        ...
+        { "level": 2, "file": "level2.json", "rings": 128, "cells": 20862, "occupied": 4752,
+          "cellSize": 1.406, "distance": [350.0, 500.0] }
+        ]
+    }
+
+"distance" is the [min, max] camera distance the level is meant for.
+Finest level starts at 350, each coarser level (cells twice as big) takes
+over where cells look as big on screen as the finer ones did, so the next
+ones start at 500 and 800. Coarser levels would start beyond 1000, no
+zoom ever selects them, so they are not written and level 0 is the
+coarsest one in use.
+
+"""
+
+import getopt
+import json
+import math
+import os
+import os.path
+import sys
+
+import numpy
+
+import bake_bars
+import compile_data
+
+# #####################################################
+# Configuration
+# #####################################################
+FORMAT = "magnitude"    # magnitude legend
+COMBINE = "sum"         # sum mean
+LEVELS = 4
+
+BASE_RINGS = 16
+
+# camera as in globe.js
+RADIUS = 200.0
+MIN_DISTANCE = 350.0
+MAX_DISTANCE = 1000.0
+
+# #####################################################
+# Grid
+# #####################################################
+class Grid(object):
+    """Equal-area isolatitude grid with nrings rings.
+    """
+
+    def __init__(self, nrings):
+        self.nrings = nrings
+
+        centers = -90 + (numpy.arange(nrings) + 0.5) * 180.0 / nrings
+        self.ncols = numpy.maximum(1, numpy.round(2 * nrings * numpy.cos(numpy.radians(centers)))).astype(numpy.int64)
+        self.offsets = numpy.concatenate(([0], numpy.cumsum(self.ncols)))
+        self.ncells = int(self.offsets[-1])
+
+        # ring borders in z, ring area proportional to its cell count
+        self.borders = -1 + 2.0 * self.offsets / self.ncells
+
+    def cell_size(self):
+        """Cell size in degrees (square root of cell area).
+        """
+
+        return math.degrees(math.sqrt(4 * math.pi / self.ncells))
+
+    def cells(self, lat, lng):
+        z = numpy.sin(numpy.radians(lat))
+        ring = numpy.clip(numpy.searchsorted(self.borders, z, side="right") - 1, 0, self.nrings - 1)
+
+        ncols = self.ncols[ring]
+        col = numpy.floor((lng + 180.0) / 360.0 * ncols).astype(numpy.int64)
+        col = numpy.clip(col, 0, ncols - 1)
+
+        return self.offsets[ring] + col
+
+    def centers(self, cells):
+        ring = numpy.searchsorted(self.offsets, cells, side="right") - 1
+        col = cells - self.offsets[ring]
+
+        z = (self.borders[ring] + self.borders[ring + 1]) / 2
+        lat = numpy.degrees(numpy.arcsin(z))
+        lng = -180.0 + (col + 0.5) * 360.0 / self.ncols[ring]
+
+        return lat, lng
+
+# #####################################################
+# Zoom
+# #####################################################
+def distance_ranges(sizes):
+    """[min, max] camera distance for each level (sizes from coarse to fine).
+
+    Finest level is used from the closest zoom, every coarser level takes
+    over where its cells look as big on screen as finest cells at MIN_DISTANCE
+    (on screen size of the surface goes with 1 / (distance - RADIUS)).
+    """
+
+    limits = [RADIUS + (MIN_DISTANCE - RADIUS) * size / sizes[-1] for size in sizes]
+
+    ranges = []
+    for i in xrange(len(sizes)):
+        high = MAX_DISTANCE if i == 0 else min(limits[i - 1], MAX_DISTANCE)
+        low = max(limits[i], MIN_DISTANCE)
+        ranges.append([round(low, 1), round(high, 1)] if low < high else None)
+
+    return ranges
+
+# #####################################################
+# Aggregation
+# #####################################################
+def combine(cells, magnitude, occupied):
+    """Magnitudes combined per occupied cell.
+    """
+
+    index = numpy.searchsorted(occupied, cells)
+    total = numpy.bincount(index, weights=magnitude, minlength=len(occupied))
+
+    if COMBINE == "mean":
+        count = numpy.bincount(index, minlength=len(occupied))
+        total = total / numpy.maximum(count, 1)
+
+    return total
+
+def dominant_legend(cells, magnitude, legend, occupied):
+    """Legend with the largest magnitude in each occupied cell.
+    """
+
+    keys = numpy.searchsorted(occupied, cells) * 256 + legend.astype(numpy.int64)
+    unique, inverse = numpy.unique(keys, return_inverse=True)
+    weight = numpy.bincount(inverse, weights=magnitude)
+
+    # sort by cell, then weight, last one of each cell wins
+    order = numpy.lexsort((weight, unique // 256))
+    result = numpy.zeros(len(occupied), dtype=numpy.int64)
+    result[unique[order] // 256] = unique[order] % 256
+
+    return result
+
+def aggregate_level(grid, series, step):
+    columns = [bake_bars.columns(values, step) for name, values in series]
+    cells = [grid.cells(lat, lng) for lat, lng, magnitude, legend in columns]
+
+    occupied = numpy.unique(numpy.concatenate(cells))
+    lat, lng = grid.centers(occupied)
+
+    magnitudes = []
+    legends = []
+    for (slat, slng, magnitude, legend), scells in zip(columns, cells):
+        magnitudes.append(combine(scells, magnitude, occupied))
+        if step == 4:
+            legends.append(dominant_legend(scells, magnitude, legend, occupied))
+
+    if COMBINE == "sum":
+        peak = max(m.max() for m in magnitudes)
+        if peak > 0:
+            magnitudes = [m / peak for m in magnitudes]
+
+    level = []
+    for i, (name, values) in enumerate(series):
+        data = [lat, lng, magnitudes[i]]
+        if step == 4:
+            data.append(legends[i])
+
+        flat = numpy.column_stack(data).reshape(-1)
+        values = [round(v, 4) for v in flat.tolist()]
+        if step == 4:
+            values[3::4] = [int(v) for v in values[3::4]]
+        level.append([name, values])
+
+    return level, len(occupied)
+
+# #####################################################
+# API
+# #####################################################
+def aggregate_dataset(infile, outdir):
+    """Aggregate infile dataset into levels and index.json in outdir.
+    """
+
+    step = compile_data.STEPS[FORMAT]
+    series = compile_data.load_series(infile, step)
+    compile_data.validate(series, step)
+
+    if not os.path.isdir(outdir):
+        os.makedirs(outdir)
+
+    grids = [Grid(BASE_RINGS * 2 ** level) for level in xrange(LEVELS)]
+    ranges = distance_ranges([grid.cell_size() for grid in grids])
+
+    # coarse levels no camera distance selects are left out
+    used = [i for i, r in enumerate(ranges) if r is not None]
+    if len(used) < len(grids):
+        print "skipping %d coarsest level(s), not used between %g and %g" % (len(grids) - len(used), MIN_DISTANCE, MAX_DISTANCE)
+        grids = [grids[i] for i in used]
+        ranges = [ranges[i] for i in used]
+
+    levels = []
+    for level, grid in enumerate(grids):
+        data, occupied = aggregate_level(grid, series, step)
+
+        fname = "level%d.json" % level
+        out = open(os.path.join(outdir, fname), "w")
+        json.dump(data, out, separators=(",", ":"))
+        out.close()
+
+        levels.append({
+            "level"    : level,
+            "file"     : fname,
+            "rings"    : grid.nrings,
+            "cells"    : grid.ncells,
+            "occupied" : occupied,
+            "cellSize" : round(grid.cell_size(), 3),
+            "distance" : ranges[level]
+        })
+
+        print "level %d: %d cells, %d occupied, cell %.2f deg, distance %s" % (level, grid.ncells, occupied, grid.cell_size(), ranges[level])
+
+    index = {
+        "grid"    : "equal-area",
+        "format"  : FORMAT,
+        "combine" : COMBINE,
+        "series"  : [name for name, values in series],
+        "levels"  : levels
+    }
+
+    out = open(os.path.join(outdir, "index.json"), "w")
+    json.dump(index, out, indent=4, sort_keys=True)
+    out.close()
+
+# #####################################################
+# Helpers
+# #####################################################
+def usage():
+    print "Usage: %s -i dataset -o outdir [-f magnitude|legend] [-m sum|mean] [-l levels]" % os.path.basename(sys.argv[0])
+
+# #####################################################
+# Main
+# #####################################################
+if __name__ == "__main__":
+
+    # get parameters from the command line
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hi:o:f:m:l:", ["help", "input=", "output=", "format=", "combine=", "levels="])
+
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    infile = outdir = ""
+
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            usage()
+            sys.exit()
+
+        elif o in ("-i", "--input"):
+            infile = a
+
+        elif o in ("-o", "--output"):
+            outdir = a
+
+        elif o in ("-f", "--format"):
+            if a in ("magnitude", "legend"):
+                FORMAT = a
+
+        elif o in ("-m", "--combine"):
+            if a in ("sum", "mean"):
+                COMBINE = a
+
+        elif o in ("-l", "--levels"):
+            LEVELS = max(1, int(a))
+
+    if infile == "" or outdir == "":
+        usage()
+        sys.exit(2)
+
+    print "Aggregating [%s] into [%s] ..." % (infile, outdir)
+
+    try:
+        aggregate_dataset(infile, outdir)
+    except ValueError, e:
+        print "ERROR: %s" % e
+        sys.exit(1)
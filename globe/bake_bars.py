@@ -0,0 +1,363 @@
+"""Bake globe bars into ready to upload geometry buffers
+
+Does offline what DAT.Globe.addData / addPoint do in the browser:
+every point becomes a 0.75 x 0.75 box standing on the globe (radius 200),
+oriented with lookAt towards the globe center and scaled along its axis
+by Math.max(size, 0.1), where size is magnitude * 200. Colors come
+from the default colorFn (HSL 0.6 - x * 0.5, 1.0, 0.5).
+
+-------------------------
+How to use this baker
+-------------------------
+
+python bake_bars.py -i population909500.json -o population909500.bars [-f magnitude|legend] [-a]
+
+Notes:
+    - flags
+        -i infile                   input dataset (JSON, CSV or compiled .bin, see compile_data.py)
+        -o outfile                  output geometry file
+        -f magnitude|legend         data format (3 or 4 numbers per point)
+        -a                          animated, one morph target per series (like addData with animated: true)
+
+    - by default:
+        format is magnitude
+        not animated, every series is baked into its own geometry file
+        (outfile with series name appended, when there are more series)
+
+    - needs NumPy
+
+-------------
+Binary format
+-------------
+
+All data is little-endian, every section starts at 4 byte boundary:
+
+    signature           8s      "DATBARS1"
+    npoints             I
+    nvertices           I       8 per point
+    nindices            I       36 per point
+    nmorph              I
+    positions offset    I       nvertices * 3 float32
+    colors offset       I       nvertices * 3 float32 (r, g, b in 0-1)
+    indices offset      I       nindices uint32
+    morph offset        I       nmorph * nvertices * 3 float32
+    names offset        I       nmorph * (name length I, utf-8 name padded to 4)
+
+Every point has the vertices of one box (THREE.BoxGeometry with merged
+vertices), all of the point's faces have the point's color, so colors
+are stored per vertex. In animated mode positions are the base geometry
+(size 0) and colors come from the first series, as in addData.
+
+"""
+
+import getopt
+import os.path
+import struct
+import sys
+
+import numpy
+
+import compile_data
+
+# #####################################################
+# Configuration
+# #####################################################
+FORMAT = "magnitude"    # magnitude legend
+ANIMATED = False
+
+RADIUS = 200.0
+BAR_WIDTH = 0.75
+BAR_DEPTH = 1.0
+MIN_SCALE = 0.1
+
+SIGNATURE = "DATBARS1"
+HEADER = '<8sIIIIIIIII'
+
+# #####################################################
+# Box
+# #####################################################
+def box_geometry(width, height, depth):
+    """Vertices and faces of THREE.BoxGeometry(width, height, depth)
+    after its mergeVertices, in the same order.
+    """
+
+    vertices = []
+    faces = []
+
+    def plane(u, v, udir, vdir, w, h, offset):
+        # one segment plane, as in BoxGeometry buildPlane
+        axis = ({"x", "y", "z"} - {u, v}).pop()
+        start = len(vertices)
+        for iy in xrange(2):
+            for ix in xrange(2):
+                p = {}
+                p[u] = (ix * w - w / 2.0) * udir
+                p[v] = (iy * h - h / 2.0) * vdir
+                p[axis] = offset
+                vertices.append((p["x"], p["y"], p["z"]))
+        faces.append((start + 0, start + 2, start + 1))
+        faces.append((start + 2, start + 3, start + 1))
+
+    plane("z", "y", -1, -1, depth, height, width / 2.0)
+    plane("z", "y", 1, -1, depth, height, -width / 2.0)
+    plane("x", "z", 1, 1, width, depth, height / 2.0)
+    plane("x", "z", 1, -1, width, depth, -height / 2.0)
+    plane("x", "y", 1, -1, width, height, depth / 2.0)
+    plane("x", "y", -1, -1, width, height, -depth / 2.0)
+
+    # mergeVertices (keys rounded to 4 decimals)
+    unique = {}
+    merged = []
+    remap = []
+    for v in vertices:
+        key = tuple(int(round(c * 1e4)) for c in v)
+        if key not in unique:
+            unique[key] = len(merged)
+            merged.append(v)
+        remap.append(unique[key])
+
+    faces = [(remap[a], remap[b], remap[c]) for a, b, c in faces]
+
+    return numpy.array(merged), numpy.array(faces, dtype=numpy.uint32)
+
+def bar_geometry():
+    """Box used for bars, moved so it starts at the surface and goes out along -z.
+    """
+
+    vertices, faces = box_geometry(BAR_WIDTH, BAR_WIDTH, BAR_DEPTH)
+    vertices[:, 2] -= 0.5
+    return vertices, faces
+
+# #####################################################
+# Transforms
+# #####################################################
+def positions(lat, lng):
+    """Point positions on the globe (addPoint phi / theta).
+    """
+
+    phi = (90 - lat) * numpy.pi / 180
+    theta = (180 - lng) * numpy.pi / 180
+
+    return numpy.column_stack((RADIUS * numpy.sin(phi) * numpy.cos(theta),
+                               RADIUS * numpy.cos(phi),
+                               RADIUS * numpy.sin(phi) * numpy.sin(theta)))
+
+def normalize_rows(v):
+    length = numpy.sqrt((v * v).sum(axis=1))
+    nonzero = length > 0
+    v[nonzero] /= length[nonzero, None]
+    return v, nonzero
+
+def look_at_axes(position):
+    """Rotation axes of Object3D.lookAt(origin) for each position
+    (THREE.Matrix4.lookAt with eye = origin, target = position, up = y).
+    """
+
+    z, nonzero = normalize_rows(-position)
+    z[~nonzero] = (0, 0, 1)
+
+    # up x z, with up = (0, 1, 0)
+    x = numpy.column_stack((z[:, 2], numpy.zeros(len(z)), -z[:, 0]))
+    x, nonzero = normalize_rows(x)
+
+    # looking straight up / down, three.js nudges z
+    pole = ~nonzero
+    if pole.any():
+        z[pole, 0] += 1e-4
+        x[pole] = numpy.column_stack((z[pole, 2], numpy.zeros(pole.sum()), -z[pole, 0]))
+        x[pole] = normalize_rows(x[pole])[0]
+
+    y = numpy.cross(z, x)
+
+    return x, y, z
+
+def bake(lat, lng, size, box):
+    """Vertices of all bars, (npoints * nbox, 3).
+    """
+
+    position = positions(lat, lng)
+    x, y, z = look_at_axes(position)
+    scale = numpy.maximum(size, MIN_SCALE)
+
+    # v' = position + x * v.x + y * v.y + z * v.z * scale
+    bx = box[:, 0][None, :, None]
+    by = box[:, 1][None, :, None]
+    bz = box[:, 2][None, :, None]
+
+    vertices = (position[:, None, :] +
+                x[:, None, :] * bx +
+                y[:, None, :] * by +
+                z[:, None, :] * (bz * scale[:, None, None]))
+
+    return vertices.reshape(-1, 3)
+
+def hsl_colors(x):
+    """Default colorFn: THREE.Color().setHSL(0.6 - x * 0.5, 1.0, 0.5).
+    """
+
+    h = 0.6 - x * 0.5
+    l = 0.5
+    s = 1.0
+
+    if l <= 0.5:
+        p = l * (1 + s)
+    else:
+        p = l + s - l * s
+    q = 2 * l - p
+
+    def hue2rgb(t):
+        t = numpy.where(t < 0, t + 1, t)
+        t = numpy.where(t > 1, t - 1, t)
+        return numpy.where(t < 1 / 6.0, q + 6 * (p - q) * t,
+               numpy.where(t < 0.5, p,
+               numpy.where(t < 2 / 3.0, q + 6 * (p - q) * (2 / 3.0 - t), q)))
+
+    return numpy.column_stack((hue2rgb(h + 1 / 3.0), hue2rgb(h), hue2rgb(h - 1 / 3.0)))
+
+def indices(npoints, faces, nbox):
+    offsets = (numpy.arange(npoints, dtype=numpy.uint32) * nbox)[:, None]
+    return (faces.reshape(1, -1) + offsets).reshape(-1)
+
+# #####################################################
+# Output
+# #####################################################
+def columns(values, step):
+    values = numpy.asarray(values, dtype=numpy.float64).reshape(-1, step)
+    return values[:, 0], values[:, 1], values[:, 2], values[:, step - 1]
+
+def bytes_le(a, dtype):
+    data = a.astype(numpy.dtype(dtype).newbyteorder('<')).tostring()
+    return data + "\0" * (-len(data) % 4)
+
+def encode_names(names):
+    data = ""
+    for name in names:
+        encoded = name.encode("utf-8")
+        data += struct.pack('<I', len(encoded)) + encoded + "\0" * (-len(encoded) % 4)
+    return data
+
+def pack(base, colors, index, morphs, names, npoints):
+    sections = [bytes_le(base, 'f4'),
+                bytes_le(colors, 'f4'),
+                bytes_le(index, 'u4'),
+                "".join(bytes_le(m, 'f4') for m in morphs),
+                encode_names(names)]
+
+    offset = struct.calcsize(HEADER)
+    offsets = []
+    for data in sections:
+        offsets.append(offset)
+        offset += len(data)
+
+    header = struct.pack(HEADER, SIGNATURE, npoints, len(base), len(index), len(morphs), *offsets)
+    return header + "".join(sections)
+
+def bake_series(values, step, box, faces):
+    lat, lng, magnitude, color = columns(values, step)
+    vertices = bake(lat, lng, magnitude * 200, box)
+    colors = numpy.repeat(hsl_colors(color), len(box), axis=0)
+    return vertices, colors, indices(len(lat), faces, len(box))
+
+def bake_animated(series, step, box, faces):
+    """Base geometry (size 0, colors of first series) and morph target per series.
+    """
+
+    npoints = len(series[0][1]) / step
+    for name, values in series:
+        if len(values) / step != npoints:
+            raise ValueError("series [%s] has %d points, first series has %d" % (name, len(values) / step, npoints))
+
+    lat, lng, magnitude, color = columns(series[0][1], step)
+    base = bake(lat, lng, numpy.zeros(npoints), box)
+    colors = numpy.repeat(hsl_colors(color), len(box), axis=0)
+
+    morphs = []
+    for name, values in series:
+        lat, lng, magnitude, color = columns(values, step)
+        morphs.append(bake(lat, lng, magnitude * 200, box))
+
+    return base, colors, indices(npoints, faces, len(box)), morphs, npoints
+
+# #####################################################
+# API
+# #####################################################
+def bake_dataset(infile, outfile):
+    """Bake infile dataset into outfile geometry (or one file per series).
+    """
+
+    step = compile_data.STEPS[FORMAT]
+    series = compile_data.load_series(infile, step)
+    compile_data.validate(series, step)
+
+    box, faces = bar_geometry()
+
+    if ANIMATED:
+        base, colors, index, morphs, npoints = bake_animated(series, step, box, faces)
+        outputs = [(outfile, pack(base, colors, index, morphs, [name for name, values in series], npoints))]
+    else:
+        outputs = []
+        for name, values in series:
+            vertices, colors, index = bake_series(values, step, box, faces)
+            fname = outfile
+            if len(series) > 1:
+                root, ext = os.path.splitext(outfile)
+                fname = "%s_%s%s" % (root, name, ext)
+            outputs.append((fname, pack(vertices, colors, index, [], [], len(values) / step)))
+
+    for fname, data in outputs:
+        out = open(fname, "wb")
+        out.write(data)
+        out.close()
+
+        print "[%s] %d bytes" % (fname, len(data))
+
+# #####################################################
+# Helpers
+# #####################################################
+def usage():
+    print "Usage: %s -i dataset -o outfile [-f magnitude|legend] [-a]" % os.path.basename(sys.argv[0])
+
+# #####################################################
+# Main
+# #####################################################
+if __name__ == "__main__":
+
+    # get parameters from the command line
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hai:o:f:", ["help", "animated", "input=", "output=", "format="])
+
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    infile = outfile = ""
+
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            usage()
+            sys.exit()
+
+        elif o in ("-i", "--input"):
+            infile = a
+
+        elif o in ("-o", "--output"):
+            outfile = a
+
+        elif o in ("-f", "--format"):
+            if a in ("magnitude", "legend"):
+                FORMAT = a
+
+        elif o in ("-a", "--animated"):
+            ANIMATED = True
+
+    if infile == "" or outfile == "":
+        usage()
+        sys.exit(2)
+
+    print "Baking [%s] into [%s] ..." % (infile, outfile)
+
+    try:
+        bake_dataset(infile, outfile)
+    except ValueError, e:
+        print "ERROR: %s" % e
+        sys.exit(1)
@@ -0,0 +1,436 @@
+"""Compile WebGL Globe datasets (JSON / CSV) into columnar binary series
+
+-------------------------
+How to use this compiler
+-------------------------
+
+python compile_data.py -i population909500.json -o population909500.bin [-f magnitude|legend] [-c float32|int16]
+
+Notes:
+    - flags
+        -i infile.json|infile.csv   input dataset (compiled .bin and segment_store.py .seg files are read too)
+        -o outfile.bin              output binary dataset
+        -f magnitude|legend         data format (3 or 4 numbers per point), as in DAT.Globe.addData
+        -c float32|int16            coordinate encoding (int16 is lat * 32767 / 90, lng * 32767 / 180)
+
+    - by default:
+        format is magnitude
+        coordinates are float32
+
+    - JSON input is what DAT.Globe expects:
+        [["seriesA", [lat, lng, magnitude, ...]], ["seriesB", [...]], ...]
+      or one flat array (single series without name):
+        [lat, lng, magnitude, legend, ...]
+
+    - CSV input has header row with lat, lng, magnitude columns
+      and optional legend and series columns
+
+-------------
+Binary format
+-------------
+
+All data is little-endian, every section starts at 4 byte boundary,
+so in the browser each column is a single typed array view:
+
+    signature           8s      "DATGLOBE"
+    version             I       1
+    step                I       3 (magnitude) or 4 (legend)
+    nseries             I
+    npoints             I       all series together
+    coordinates         I       0 = float32, 1 = int16
+    lat offset          I       byte offsets of columns (legend is 0 for magnitude format)
+    lng offset          I
+    magnitude offset    I
+    legend offset       I
+
+    series table        nseries * (point offset I, point count I, name offset I, name length I)
+    names               utf-8
+
+    lat                 npoints * float32 | int16
+    lng                 npoints * float32 | int16
+    magnitude           npoints * float32
+    legend              npoints * uint8
+
+    // e.g.
+    var lat = new Float32Array(buffer, latOffset, npoints);
+
+"""
+
+import array
+import csv
+import getopt
+import json
+import math
+import os.path
+import struct
+import sys
+
+# #####################################################
+# Configuration
+# #####################################################
+FORMAT = "magnitude"        # magnitude legend
+COORDINATES = "float32"     # float32 int16
+
+SIGNATURE = "DATGLOBE"
+VERSION = 1
+
+STEPS = { "magnitude": 3, "legend": 4 }
+COORDINATE_TYPES = { "float32": 0, "int16": 1 }
+
+HEADER = '<8sIIIIIIIII'
+SERIES = '<IIII'
+
+# #####################################################
+# Utils
+# #####################################################
+def align4(n):
+    return (n + 3) & ~3
+
+def pad(data):
+    return data + "\0" * (align4(len(data)) - len(data))
+
+def little_endian(a):
+    """Array as little-endian bytes.
+    """
+
+    if sys.byteorder != "little":
+        a = array.array(a.typecode, a)
+        a.byteswap()
+    return a.tostring()
+
+# #####################################################
+# Input
+# #####################################################
+def load_json(fname):
+    """Load globe JSON, returns list of (name, flat data).
+    """
+
+    f = open(fname, "r")
+    data = json.load(f)
+    f.close()
+
+    if data and not isinstance(data[0], list):
+        return [("", data)]
+
+    return [(unicode(name), values) for name, values in data]
+
+def load_csv(fname, step):
+    """Load CSV with lat, lng, magnitude [, legend] [, series] columns,
+    returns list of (name, flat data).
+    """
+
+    series = []
+    index = {}
+
+    f = open(fname, "rb")
+    for row in csv.DictReader(f):
+        row = dict((k.strip().lower(), v) for k, v in row.items() if k)
+
+        name = row.get("series", "").decode("utf-8")
+        if name not in index:
+            index[name] = len(series)
+            series.append((name, []))
+
+        values = series[index[name]][1]
+        values.extend((float(row["lat"]), float(row["lng"]), float(row["magnitude"])))
+        if step == 4:
+            values.append(int(row["legend"]))
+    f.close()
+
+    return series
+
+def load_series(fname, step):
+    """Load dataset from JSON, CSV, compiled binary or segment store file.
+
+    Compiled binaries and segment stores know their format, ValueError is
+    raised when it isn't the one of step.
+    """
+
+    ext = os.path.splitext(fname)[1].lower()
+    if ext == ".csv":
+        return load_csv(fname, step)
+    if ext == ".bin":
+        dataset = read_dataset(fname)
+        check_step(fname, dataset.step, step)
+        return [(series.name, series.flat()) for series in dataset.series]
+    if ext == ".seg":
+        import segment_store
+        store = segment_store.Store(fname)
+        try:
+            check_step(fname, store.step, step)
+            return store.to_series()
+        finally:
+            store.close()
+    return load_json(fname)
+
+def check_step(fname, stored, step):
+    if stored != step:
+        name = lambda s: "legend" if s == 4 else "magnitude"
+        raise ValueError("[%s] has %s format, not %s (see -f)" % (fname, name(stored), name(step)))
+
+def validate(series, step):
+    """Check series are complete points with valid coordinates, raise ValueError otherwise.
+    """
+
+    for name, values in series:
+        if len(values) % step:
+            raise ValueError("series [%s] has %d numbers, not a multiple of %d" % (name, len(values), step))
+
+        for i in xrange(0, len(values), step):
+            lat = values[i]
+            lng = values[i + 1]
+            magnitude = values[i + 2]
+
+            if not -90 <= lat <= 90:
+                raise ValueError("series [%s] point %d: latitude %s out of range" % (name, i / step, lat))
+            if not -180 <= lng <= 180:
+                raise ValueError("series [%s] point %d: longitude %s out of range" % (name, i / step, lng))
+            if math.isnan(magnitude) or math.isinf(magnitude):
+                raise ValueError("series [%s] point %d: magnitude %s is not a number" % (name, i / step, magnitude))
+
+            if step == 4:
+                legend = values[i + 3]
+                if legend != int(legend) or not 0 <= legend <= 255:
+                    raise ValueError("series [%s] point %d: legend %s is not in 0-255" % (name, i / step, legend))
+
+# #####################################################
+# Output
+# #####################################################
+def quantize_coordinate(value, limit):
+    return int(math.floor(value / limit * 32767 + 0.5))
+
+def compile_series(series, step, coordinates):
+    """Build binary dataset from list of (name, flat data).
+    """
+
+    lat = array.array('f')
+    lng = array.array('f')
+    magnitude = array.array('f')
+    legend = array.array('B')
+
+    table = []
+    names = ""
+
+    for name, values in series:
+        encoded = name.encode("utf-8")
+        table.append((len(magnitude), len(values) / step, len(names), len(encoded)))
+        names += encoded
+
+        lat.extend(values[0::step])
+        lng.extend(values[1::step])
+        magnitude.extend(values[2::step])
+        if step == 4:
+            legend.extend(int(v) for v in values[3::step])
+
+    if coordinates == "int16":
+        lat = array.array('h', [quantize_coordinate(v, 90.0) for v in lat])
+        lng = array.array('h', [quantize_coordinate(v, 180.0) for v in lng])
+
+    npoints = len(magnitude)
+
+    columns = [pad(little_endian(lat)), pad(little_endian(lng)), pad(little_endian(magnitude))]
+    if step == 4:
+        columns.append(pad(little_endian(legend)))
+
+    offset = struct.calcsize(HEADER) + struct.calcsize(SERIES) * len(series) + align4(len(names))
+
+    offsets = []
+    for column in columns:
+        offsets.append(offset)
+        offset += len(column)
+    if step == 3:
+        offsets.append(0)
+
+    buffer = [struct.pack(HEADER, SIGNATURE, VERSION, step, len(series), npoints,
+                          COORDINATE_TYPES[coordinates], *offsets)]
+    for entry in table:
+        buffer.append(struct.pack(SERIES, *entry))
+    buffer.append(pad(names))
+    buffer.extend(columns)
+
+    return "".join(buffer)
+
+# #####################################################
+# Reader API
+# #####################################################
+class Series(object):
+    """One named series, columns are arrays (lat, lng in degrees).
+    """
+
+    def __init__(self, name, lat, lng, magnitude, legend):
+        self.name = name
+        self.lat = lat
+        self.lng = lng
+        self.magnitude = magnitude
+        self.legend = legend
+
+    def __len__(self):
+        return len(self.magnitude)
+
+    def flat(self):
+        """Series as flat list, the way DAT.Globe.addData takes it.
+        """
+
+        if self.legend is None:
+            columns = (self.lat, self.lng, self.magnitude)
+        else:
+            columns = (self.lat, self.lng, self.magnitude, self.legend)
+
+        values = []
+        for point in zip(*columns):
+            values.extend(point)
+        return values
+
+class Dataset(object):
+    """Compiled dataset.
+
+        dataset = read_dataset("population909500.bin")
+        for series in dataset.series:
+            print series.name, len(series), series.magnitude[0]
+    """
+
+    def __init__(self, step, series):
+        self.step = step
+        self.format = "legend" if step == 4 else "magnitude"
+        self.series = series
+
+    def __getitem__(self, name):
+        for series in self.series:
+            if series.name == name:
+                return series
+        raise KeyError(name)
+
+    def to_globe(self):
+        """Dataset in globe JSON structure ([[name, flat data], ...]).
+        """
+
+        return [[series.name, series.flat()] for series in self.series]
+
+def read_array(typecode, data, offset, count):
+    a = array.array(typecode)
+    a.fromstring(data[offset:offset + a.itemsize * count])
+    if sys.byteorder != "little":
+        a.byteswap()
+    return a
+
+def parse_dataset(data):
+    """Parse compiled dataset from bytes.
+    """
+
+    header = struct.unpack_from(HEADER, data, 0)
+    signature, version, step, nseries, npoints, coordinates = header[:6]
+    lat_offset, lng_offset, magnitude_offset, legend_offset = header[6:]
+
+    if signature != SIGNATURE:
+        raise ValueError("not a compiled globe dataset")
+    if version != VERSION:
+        raise ValueError("unsupported dataset version %d" % version)
+
+    if coordinates == COORDINATE_TYPES["int16"]:
+        lat = [v * 90.0 / 32767 for v in read_array('h', data, lat_offset, npoints)]
+        lng = [v * 180.0 / 32767 for v in read_array('h', data, lng_offset, npoints)]
+    else:
+        lat = read_array('f', data, lat_offset, npoints)
+        lng = read_array('f', data, lng_offset, npoints)
+
+    magnitude = read_array('f', data, magnitude_offset, npoints)
+
+    legend = None
+    if step == 4:
+        legend = read_array('B', data, legend_offset, npoints)
+
+    table_offset = struct.calcsize(HEADER)
+    names_offset = table_offset + struct.calcsize(SERIES) * nseries
+
+    series = []
+    for i in xrange(nseries):
+        start, count, name_start, name_length = struct.unpack_from(SERIES, data, table_offset + i * struct.calcsize(SERIES))
+        name = data[names_offset + name_start:names_offset + name_start + name_length].decode("utf-8")
+        end = start + count
+        series.append(Series(name, lat[start:end], lng[start:end], magnitude[start:end],
+                             legend[start:end] if legend is not None else None))
+
+    return Dataset(step, series)
+
+def read_dataset(fname):
+    """Read compiled dataset file.
+    """
+
+    f = open(fname, "rb")
+    data = f.read()
+    f.close()
+
+    return parse_dataset(data)
+
+# #####################################################
+# API
+# #####################################################
+def compile_dataset(infile, outfile):
+    """Compile infile.json / infile.csv to outfile.bin
+    """
+
+    step = STEPS[FORMAT]
+
+    series = load_series(infile, step)
+    validate(series, step)
+
+    data = compile_series(series, step, COORDINATES)
+
+    out = open(outfile, "wb")
+    out.write(data)
+    out.close()
+
+    npoints = sum(len(values) for name, values in series) / step
+    print "%d series, %d points, %d bytes" % (len(series), npoints, len(data))
+
+# #####################################################
+# Helpers
+# #####################################################
+def usage():
+    print "Usage: %s -i filename.json|filename.csv -o filename.bin [-f magnitude|legend] [-c float32|int16]" % os.path.basename(sys.argv[0])
+
+# #####################################################
+# Main
+# #####################################################
+if __name__ == "__main__":
+
+    # get parameters from the command line
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hi:o:f:c:", ["help", "input=", "output=", "format=", "coordinates="])
+
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    infile = outfile = ""
+
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            usage()
+            sys.exit()
+
+        elif o in ("-i", "--input"):
+            infile = a
+
+        elif o in ("-o", "--output"):
+            outfile = a
+
+        elif o in ("-f", "--format"):
+            if a in ("magnitude", "legend"):
+                FORMAT = a
+
+        elif o in ("-c", "--coordinates"):
+            if a in ("float32", "int16"):
+                COORDINATES = a
+
+    if infile == "" or outfile == "":
+        usage()
+        sys.exit(2)
+
+    print "Compiling [%s] into [%s] ..." % (infile, outfile)
+
+    try:
+        compile_dataset(infile, outfile)
+    except ValueError, e:
+        print "ERROR: %s" % e
+        sys.exit(1)
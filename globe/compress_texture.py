@@ -0,0 +1,498 @@
+"""Encode globe textures into GPU block compressed formats
+
+world.jpg, worldMask.jpg and data textures end up on the GPU as decoded
+RGBA, 4 bytes per texel. DXT1 (S3TC, desktop) and ETC1 (OpenGL ES) keep
+every 4x4 block of texels in 8 bytes, half a byte per texel, and the
+GPU samples them without decoding. This tool encodes a texture with its
+mip chain into DDS (DXT1) and KTX (ETC1) files and reports the PSNR of
+every level against the uncompressed one.
+
+-------------------------
+How to use this tool
+-------------------------
+
+python compress_texture.py -i world.jpg -o world [-f dxt1|etc1|all] [-j processes] [-n]
+
+Notes:
+    - flags
+        -i infile                   texture (anything PIL reads, grayscale is used as RGB)
+        -o outfile                  output name, .dds and / or .ktx is appended
+        -f dxt1|etc1|all            block format
+        -j processes                encoder processes
+        -n                          no mipmaps, top level only
+
+    - by default:
+        both formats are written
+        one process per CPU
+        mip chain goes down to 1x1
+
+    - sizes that are not multiples of 4 are padded by repeating the last
+      row / column (WebGL wants power of two sizes for mipmapping anyway)
+
+    - needs NumPy and PIL (Python Imaging Library)
+
+-------------
+Encoders
+-------------
+
+DXT1: endpoints are the extremes of the block along its principal color
+axis, refined once by least squares on the chosen indices, always in
+4 color mode (no 1 bit alpha).
+
+ETC1: for both subblock splits (2x4 and 4x2) the subblock base colors
+are the average colors, stored differentially when close enough and
+as two RGB444 colors otherwise, then the intensity table with the
+least error is picked per subblock. Block keeps the better split.
+
+Blocks are encoded in chunks of CHUNK_BLOCKS on a process pool.
+
+-------------
+Containers
+-------------
+
+    .dds    DDS header with FourCC "DXT1", mip levels follow largest first
+    .ktx    KTX 1 with glInternalFormat ETC1_RGB8_OES (0x8D64), every level
+            preceded by its uint32 size
+
+Mip levels are (width / 2^i) x (height / 2^i), at least 1, box filtered.
+
+"""
+
+import getopt
+import math
+import multiprocessing
+import os.path
+import struct
+import sys
+
+import numpy
+
+from PIL import Image
+
+# #####################################################
+# Configuration
+# #####################################################
+FORMATS = ["dxt1", "etc1"]
+PROCESSES = multiprocessing.cpu_count()
+MIPMAPS = True
+
+CHUNK_BLOCKS = 1024
+
+# ETC1 intensity modifier tables, pixel index 0 .. 3 is +a, +b, -a, -b
+ETC1_TABLES = numpy.array([[2, 8, -2, -8], [5, 17, -5, -17], [9, 29, -9, -29], [13, 42, -13, -42],
+                           [18, 60, -18, -60], [24, 80, -24, -80], [33, 106, -33, -106], [47, 183, -47, -183]], dtype=numpy.float32)
+
+# DXT1 palette weights of endpoint 0 for index 0 .. 3
+DXT1_WEIGHTS = numpy.array([1.0, 0.0, 2.0 / 3, 1.0 / 3], dtype=numpy.float32)
+
+# #####################################################
+# Blocks
+# #####################################################
+def to_blocks(pixels):
+    """(height, width, 3) pixels into (nblocks, 4, 4, 3) blocks, row by row, edges repeated.
+    """
+
+    height, width = pixels.shape[:2]
+    padded = numpy.pad(pixels, ((0, -height % 4), (0, -width % 4), (0, 0)), mode="edge")
+
+    rows, cols = padded.shape[0] // 4, padded.shape[1] // 4
+    return padded.reshape(rows, 4, cols, 4, 3).transpose(0, 2, 1, 3, 4).reshape(-1, 4, 4, 3)
+
+def from_blocks(blocks, width, height):
+    rows, cols = (height + 3) // 4, (width + 3) // 4
+    pixels = blocks.reshape(rows, cols, 4, 4, 3).transpose(0, 2, 1, 3, 4).reshape(rows * 4, cols * 4, 3)
+    return pixels[:height, :width]
+
+# #####################################################
+# DXT1
+# #####################################################
+def quantize_565(colors):
+    """Colors (..., 3) in 0 - 255 to 5:6:5 values and their expanded colors.
+    """
+
+    c = numpy.clip(colors, 0, 255)
+    r = numpy.floor(c[..., 0] * 31 / 255.0 + 0.5).astype(numpy.uint32)
+    g = numpy.floor(c[..., 1] * 63 / 255.0 + 0.5).astype(numpy.uint32)
+    b = numpy.floor(c[..., 2] * 31 / 255.0 + 0.5).astype(numpy.uint32)
+
+    expanded = numpy.stack(((r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)), axis=-1).astype(numpy.float32)
+    return (r << 11) | (g << 5) | b, expanded
+
+def dxt1_fit(texels, c0, c1):
+    """Quantized endpoints, best indices and squared error for endpoint guesses.
+    """
+
+    v0, e0 = quantize_565(c0)
+    v1, e1 = quantize_565(c1)
+
+    palette = DXT1_WEIGHTS[None, :, None] * e0[:, None, :] + (1 - DXT1_WEIGHTS)[None, :, None] * e1[:, None, :]
+    distance = ((texels[:, :, None, :] - palette[:, None, :, :]) ** 2).sum(axis=3)
+
+    indices = distance.argmin(axis=2)
+    error = distance.min(axis=2).sum(axis=1)
+
+    return v0, v1, indices, error
+
+def encode_dxt1(blocks):
+    texels = blocks.reshape(-1, 16, 3).astype(numpy.float32)
+
+    # principal axis by power iteration on the covariance
+    mean = texels.mean(axis=1)
+    centered = texels - mean[:, None, :]
+    covariance = numpy.einsum("nki,nkj->nij", centered, centered)
+
+    axis = numpy.ones((len(texels), 3), dtype=numpy.float32)
+    for i in xrange(8):
+        axis = numpy.einsum("nij,nj->ni", covariance, axis)
+        axis /= numpy.maximum(numpy.abs(axis).max(axis=1), 1e-12)[:, None]
+
+    projection = numpy.einsum("nki,ni->nk", centered, axis)
+    norm = numpy.maximum((axis * axis).sum(axis=1), 1e-12)
+    c0 = mean + axis * (projection.max(axis=1) / norm)[:, None]
+    c1 = mean + axis * (projection.min(axis=1) / norm)[:, None]
+
+    v0, v1, indices, error = dxt1_fit(texels, c0, c1)
+
+    # least squares endpoints for the chosen indices
+    w = DXT1_WEIGHTS[indices]
+    aa = (w * w).sum(axis=1)
+    bb = ((1 - w) * (1 - w)).sum(axis=1)
+    ab = (w * (1 - w)).sum(axis=1)
+    ax = (w[:, :, None] * texels).sum(axis=1)
+    bx = ((1 - w)[:, :, None] * texels).sum(axis=1)
+
+    det = aa * bb - ab * ab
+    solvable = numpy.abs(det) > 1e-6
+    det[~solvable] = 1.0
+    l0 = (ax * bb[:, None] - bx * ab[:, None]) / det[:, None]
+    l1 = (bx * aa[:, None] - ax * ab[:, None]) / det[:, None]
+
+    r0, r1, rindices, rerror = dxt1_fit(texels, l0, l1)
+    better = solvable & (rerror < error)
+    v0[better], v1[better], indices[better] = r0[better], r1[better], rindices[better]
+
+    # 4 color mode needs c0 > c1, swapping endpoints swaps indices 0 <-> 1 and 2 <-> 3
+    swap = v0 < v1
+    v0[swap], v1[swap] = v1[swap], v0[swap]
+    indices[swap] ^= 1
+
+    indices[v0 == v1] = 0
+
+    bits = (indices.astype(numpy.uint32) << (2 * numpy.arange(16, dtype=numpy.uint32))).sum(axis=1).astype(numpy.uint32)
+
+    packed = numpy.empty(len(texels), dtype=[("c0", "<u2"), ("c1", "<u2"), ("indices", "<u4")])
+    packed["c0"] = v0
+    packed["c1"] = v1
+    packed["indices"] = bits
+    return packed.tostring()
+
+def decode_dxt1(data, nblocks):
+    packed = numpy.frombuffer(data, dtype=[("c0", "<u2"), ("c1", "<u2"), ("indices", "<u4")], count=nblocks)
+
+    def expand(v):
+        v = v.astype(numpy.uint32)
+        r, g, b = v >> 11, (v >> 5) & 63, v & 31
+        return numpy.stack(((r << 3) | (r >> 2), (g << 2) | (g >> 4), (b << 3) | (b >> 2)), axis=-1).astype(numpy.float32)
+
+    c0 = expand(packed["c0"])
+    c1 = expand(packed["c1"])
+
+    four = (packed["c0"] > packed["c1"])[:, None]
+    palette = numpy.stack((c0, c1,
+                           numpy.where(four, (2 * c0 + c1) / 3, (c0 + c1) / 2),
+                           numpy.where(four, (c0 + 2 * c1) / 3, 0)), axis=1)
+
+    indices = (packed["indices"][:, None] >> (2 * numpy.arange(16, dtype=numpy.uint32))) & 3
+    texels = palette[numpy.arange(nblocks)[:, None], indices]
+
+    return numpy.floor(texels + 0.5).reshape(-1, 4, 4, 3)
+
+# #####################################################
+# ETC1
+# #####################################################
+def etc1_subblocks(blocks, flip):
+    """Texels of both subblocks (nblocks, 2, 8, 3) and their pixel numbers (x * 4 + y).
+    """
+
+    if flip:
+        halves = (blocks[:, :2], blocks[:, 2:])
+        numbers = [[x * 4 + y for y in rows for x in xrange(4)] for rows in ((0, 1), (2, 3))]
+    else:
+        halves = (blocks[:, :, :2], blocks[:, :, 2:])
+        numbers = [[x * 4 + y for y in xrange(4) for x in cols] for cols in ((0, 1), (2, 3))]
+
+    texels = numpy.stack([h.reshape(len(blocks), 8, 3) for h in halves], axis=1)
+    return texels, numpy.array(numbers, dtype=numpy.uint32)
+
+def etc1_base_colors(average):
+    """Base colors for subblock averages (nblocks, 2, 3): differential flag,
+    stored values and expanded colors.
+    """
+
+    c5 = numpy.clip(numpy.floor(average * 31 / 255.0 + 0.5), 0, 31).astype(numpy.int32)
+    delta = c5[:, 1] - c5[:, 0]
+    differential = ((delta >= -4) & (delta <= 3)).all(axis=1)
+
+    c4 = numpy.clip(numpy.floor(average * 15 / 255.0 + 0.5), 0, 15).astype(numpy.int32)
+
+    expanded5 = (c5 << 3) | (c5 >> 2)
+    expanded4 = (c4 << 4) | c4
+
+    colors = numpy.where(differential[:, None, None], expanded5, expanded4).astype(numpy.float32)
+    return differential, c5, delta, c4, colors
+
+def etc1_tables(texels, colors):
+    """Best table, pixel indices and error of every subblock.
+    """
+
+    # (nblocks, 2 subblocks, 8 tables, 8 pixels, 4 modifiers, 3 channels)
+    candidates = numpy.clip(colors[:, :, None, None, None, :] + ETC1_TABLES[None, None, :, None, :, None], 0, 255)
+    distance = ((candidates - texels[:, :, None, :, None, :]) ** 2).sum(axis=5)
+
+    indices = distance.argmin(axis=4)
+    errors = distance.min(axis=4).sum(axis=3)
+
+    table = errors.argmin(axis=2)
+    n = numpy.arange(len(texels))[:, None]
+    s = numpy.arange(2)[None, :]
+
+    return table, indices[n, s, table], errors[n, s, table].sum(axis=1)
+
+def etc1_candidate(blocks, flip):
+    texels, numbers = etc1_subblocks(blocks, flip)
+    differential, c5, delta, c4, colors = etc1_base_colors(texels.mean(axis=2))
+    table, indices, error = etc1_tables(texels, colors)
+
+    numbers = numpy.repeat(numbers[None], len(blocks), axis=0)
+    return [differential, c5, delta, c4, table, indices, numbers], error
+
+def encode_etc1(blocks):
+    blocks = blocks.astype(numpy.float32)
+    nblocks = len(blocks)
+
+    # keep the better subblock split of every block
+    fields0, error0 = etc1_candidate(blocks, 0)
+    fields1, error1 = etc1_candidate(blocks, 1)
+    flip = error1 < error0
+
+    differential, c5, delta, c4, table, indices, numbers = \
+        [numpy.where(flip.reshape((-1,) + (1,) * (f0.ndim - 1)), f1, f0) for f0, f1 in zip(fields0, fields1)]
+
+    high = numpy.zeros(nblocks, dtype=numpy.uint32)
+    for channel, shift in ((0, 24), (1, 16), (2, 8)):
+        diff_bits = (c5[:, 0, channel] << 3) | (delta[:, channel] & 7)
+        individual_bits = (c4[:, 0, channel] << 4) | c4[:, 1, channel]
+        high |= (numpy.where(differential, diff_bits, individual_bits).astype(numpy.uint32) << shift)
+
+    high |= table[:, 0].astype(numpy.uint32) << 5
+    high |= table[:, 1].astype(numpy.uint32) << 2
+    high |= differential.astype(numpy.uint32) << 1
+    high |= flip.astype(numpy.uint32)
+
+    # pixel index msb at bit 16 + pixel number, lsb at bit pixel number
+    indices = indices.reshape(nblocks, 16).astype(numpy.uint32)
+    numbers = numbers.reshape(nblocks, 16)
+    low = (((indices >> 1) << (numbers + 16)) | ((indices & 1) << numbers)).sum(axis=1).astype(numpy.uint32)
+
+    packed = numpy.empty(nblocks, dtype=[("high", ">u4"), ("low", ">u4")])
+    packed["high"] = high
+    packed["low"] = low
+    return packed.tostring()
+
+def decode_etc1(data, nblocks):
+    packed = numpy.frombuffer(data, dtype=[("high", ">u4"), ("low", ">u4")], count=nblocks)
+    high = packed["high"].astype(numpy.int64)
+    low = packed["low"].astype(numpy.int64)
+
+    differential = (high >> 1) & 1
+    flip = high & 1
+
+    colors = numpy.empty((nblocks, 2, 3))
+    for channel, shift in ((0, 24), (1, 16), (2, 8)):
+        byte = (high >> shift) & 255
+
+        base = byte >> 3
+        delta = (byte & 7) - ((byte & 4) << 1)
+        d0 = (base << 3) | (base >> 2)
+        second = base + delta
+        d1 = (second << 3) | (second >> 2)
+
+        i0 = byte >> 4
+        i1 = byte & 15
+
+        colors[:, 0, channel] = numpy.where(differential, d0, (i0 << 4) | i0)
+        colors[:, 1, channel] = numpy.where(differential, d1, (i1 << 4) | i1)
+
+    tables = numpy.stack(((high >> 5) & 7, (high >> 2) & 7), axis=1)
+
+    blocks = numpy.empty((nblocks, 4, 4, 3))
+    for x in xrange(4):
+        for y in xrange(4):
+            number = x * 4 + y
+            index = (((low >> (number + 16)) & 1) << 1) | ((low >> number) & 1)
+            subblock = numpy.where(flip, y >= 2, x >= 2).astype(numpy.int64)
+
+            n = numpy.arange(nblocks)
+            modifier = ETC1_TABLES[tables[n, subblock], index]
+            blocks[:, y, x] = numpy.clip(colors[n, subblock] + modifier[:, None], 0, 255)
+
+    return blocks
+
+# #####################################################
+# Encoding
+# #####################################################
+ENCODERS = { "dxt1": encode_dxt1, "etc1": encode_etc1 }
+DECODERS = { "dxt1": decode_dxt1, "etc1": decode_etc1 }
+
+def encode_chunk(args):
+    fmt, blocks = args
+    return ENCODERS[fmt](blocks)
+
+def encode_level(pool, fmt, pixels):
+    blocks = to_blocks(pixels)
+    chunks = [(fmt, blocks[i:i + CHUNK_BLOCKS]) for i in xrange(0, len(blocks), CHUNK_BLOCKS)]
+
+    if pool is None or len(chunks) == 1:
+        return "".join(encode_chunk(c) for c in chunks)
+    return "".join(pool.map(encode_chunk, chunks))
+
+def psnr(fmt, data, pixels):
+    height, width = pixels.shape[:2]
+    nblocks = ((height + 3) // 4) * ((width + 3) // 4)
+
+    decoded = from_blocks(DECODERS[fmt](data, nblocks), width, height)
+    mse = ((decoded - pixels) ** 2).mean()
+
+    return float("inf") if mse == 0 else 10 * math.log10(255.0 * 255.0 / mse)
+
+def mip_chain(image):
+    levels = [image]
+    while MIPMAPS and (image.size[0] > 1 or image.size[1] > 1):
+        image = image.resize((max(1, image.size[0] // 2), max(1, image.size[1] // 2)), Image.BOX)
+        levels.append(image)
+    return [numpy.asarray(level, dtype=numpy.float32) for level in levels]
+
+# #####################################################
+# Containers
+# #####################################################
+def dds_header(width, height, levels):
+    flags = 0x1 | 0x2 | 0x4 | 0x1000 | 0x80000 | (0x20000 if len(levels) > 1 else 0)
+    caps = 0x1000 | (0x8 | 0x400000 if len(levels) > 1 else 0)
+
+    pixelformat = struct.pack('<II4sIIIII', 32, 0x4, "DXT1", 0, 0, 0, 0, 0)
+    return "DDS " + struct.pack('<IIIIIII44x', 124, flags, height, width, len(levels[0]), 0, len(levels)) + \
+           pixelformat + struct.pack('<IIII4x', caps, 0, 0, 0)
+
+def ktx_header(width, height, levels):
+    return "\xabKTX 11\xbb\r\n\x1a\n" + struct.pack('<13I', 0x04030201, 0, 1, 0, 0x8D64, 0x1907,
+                                                       width, height, 0, 0, 1, len(levels), 0)
+
+def write_dds(fname, width, height, levels):
+    out = open(fname, "wb")
+    out.write(dds_header(width, height, levels))
+    for level in levels:
+        out.write(level)
+    out.close()
+
+def write_ktx(fname, width, height, levels):
+    out = open(fname, "wb")
+    out.write(ktx_header(width, height, levels))
+    for level in levels:
+        out.write(struct.pack('<I', len(level)))
+        out.write(level)
+    out.close()
+
+WRITERS = { "dxt1": (".dds", write_dds), "etc1": (".ktx", write_ktx) }
+
+# #####################################################
+# API
+# #####################################################
+def compress_texture(infile, outfile):
+    """Encode infile into every format in FORMATS, returns { format: [psnr per level] }.
+    """
+
+    image = Image.open(infile).convert("RGB")
+    width, height = image.size
+    chain = mip_chain(image)
+
+    pool = multiprocessing.Pool(PROCESSES) if PROCESSES > 1 else None
+
+    results = {}
+    try:
+        for fmt in FORMATS:
+            levels = [encode_level(pool, fmt, pixels) for pixels in chain]
+            results[fmt] = [psnr(fmt, data, pixels) for data, pixels in zip(levels, chain)]
+
+            ext, writer = WRITERS[fmt]
+            writer(outfile + ext, width, height, levels)
+
+            size = sum(len(level) for level in levels)
+            rgba = sum(pixels.shape[0] * pixels.shape[1] * 4 for pixels in chain)
+            print "[%s%s] %dx%d, %d levels, %d bytes (RGBA %d, %.1fx), PSNR %.2f dB top level" % \
+                  (outfile, ext, width, height, len(levels), size, rgba, rgba / float(size), results[fmt][0])
+
+            for i, value in enumerate(results[fmt][1:]):
+                print "    level %d: %.2f dB" % (i + 1, value)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return results
+
+# #####################################################
+# Helpers
+# #####################################################
+def usage():
+    print "Usage: %s -i infile -o outfile [-f dxt1|etc1|all] [-j processes] [-n]" % os.path.basename(sys.argv[0])
+
+# #####################################################
+# Main
+# #####################################################
+if __name__ == "__main__":
+
+    # get parameters from the command line
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hni:o:f:j:", ["help", "nomipmaps", "input=", "output=", "format=", "processes="])
+
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    infile = outfile = ""
+
+    try:
+        for o, a in opts:
+            if o in ("-h", "--help"):
+                usage()
+                sys.exit()
+
+            elif o in ("-i", "--input"):
+                infile = a
+
+            elif o in ("-o", "--output"):
+                outfile = a
+
+            elif o in ("-f", "--format"):
+                if a in ("dxt1", "etc1"):
+                    FORMATS = [a]
+                elif a == "all":
+                    FORMATS = ["dxt1", "etc1"]
+
+            elif o in ("-j", "--processes"):
+                PROCESSES = max(1, int(a))
+
+            elif o in ("-n", "--nomipmaps"):
+                MIPMAPS = False
+
+    except ValueError:
+        usage()
+        sys.exit(2)
+
+    if infile == "" or outfile == "":
+        usage()
+        sys.exit(2)
+
+    print "Compressing [%s] into [%s] ..." % (infile, outfile)
+
+    compress_texture(infile, outfile)
@@ -0,0 +1,272 @@
+"""Export globe datasets as one prototype bar mesh plus per-instance buffers
+
+Instead of merging a whole box per point (as DAT.Globe.addPoint does,
+see also bake_bars.py) the bar shape is converted once from an OBJ model
+(cube.obj or hex.obj from globe-vertex-texture/models, through
+convert_obj_three.py) and every point is just a few bytes of instance
+data, drawn with instancing.
+
+-------------------------
+How to use this exporter
+-------------------------
+
+python export_instances.py -i population909500.json -o population909500.inst [-m cube|hex|model.obj] [-f magnitude|legend] [-a]
+
+Notes:
+    - flags
+        -i infile                   input dataset (JSON, CSV or compiled .bin, see compile_data.py)
+        -o outfile                  output instances file, prototype is written next to it (outfile_bar.js + .bin)
+        -m cube|hex|model.obj       prototype model
+        -f magnitude|legend         data format (3 or 4 numbers per point)
+        -a                          animated, one height column per series (series must share coordinates)
+
+    - by default:
+        prototype is cube
+        format is magnitude
+        not animated, every series is exported into its own instances file
+
+    - needs NumPy
+
+-------------
+Binary format
+-------------
+
+All data is little-endian, every section starts at 4 byte boundary:
+
+    signature           8s      "DATINST1"
+    ninstances          I
+    nheights            I       height columns (series)
+    palette size        I
+    direction offset    I       ninstances * 3 int16 (unit vector * 32767, normalized attribute)
+    heights offset      I       nheights * ninstances float32
+    color offset        I       ninstances uint8 (palette index)
+    palette offset      I       palette size * 3 float32 (r, g, b in 0-1)
+    names offset        I       nheights * (name length I, utf-8 name padded to 4)
+
+Instance transform is what addPoint computes: position is direction * 200,
+rotation is lookAt towards globe center (bake_bars.look_at_axes), scale
+along the bar axis is height (Math.max(magnitude * 200, 0.1)). The
+prototype is scaled across the bar axis (x, y) so its widest side is
+0.75 (bake_bars.BAR_WIDTH), like addPoint's box, length along the axis
+(z, 1 for cube and hex) stays as it is in the model.
+
+Palette is the default colorFn: for magnitude format 256 entries
+with colorFn(index / 255), for legend format colorFn(legend index).
+
+"""
+
+import getopt
+import os.path
+import struct
+import sys
+
+import numpy
+
+import bake_bars
+import compile_data
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "globe-vertex-texture", "models"))
+
+import convert_obj_three
+
+# #####################################################
+# Configuration
+# #####################################################
+FORMAT = "magnitude"    # magnitude legend
+ANIMATED = False
+MODEL = "cube"          # cube hex or path to OBJ file
+
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "globe-vertex-texture", "models")
+
+PALETTE_SIZE = 256
+
+SIGNATURE = "DATINST1"
+HEADER = '<8sIIIIIIII'
+
+# #####################################################
+# Prototype
+# #####################################################
+def model_path(model):
+    if model in ("cube", "hex"):
+        return os.path.join(MODELS_DIR, model + ".obj")
+    return model
+
+def scale_cross_section(vertices, width):
+    """Scale x and y of vertices so the wider side of their bounding box is width.
+    """
+
+    bb = convert_obj_three.bbox(vertices)
+    size = max(bb['x'][1] - bb['x'][0], bb['y'][1] - bb['y'][0])
+    if size <= 0:
+        raise ValueError("prototype has no cross-section")
+
+    scale = width / size
+    vertices[:] = [[v[0] * scale, v[1] * scale, v[2]] for v in vertices]
+
+    # bounds gathered by the parser are stale now
+    vertices.bb = None
+
+def convert_prototype(model, outfile):
+    """Convert prototype OBJ with the OBJ -> Three.js converter (binary format),
+    as wide as addPoint's bars.
+    """
+
+    root, ext = os.path.splitext(outfile)
+    protofile = root + "_bar.js"
+
+    infile = model_path(model)
+    if not convert_obj_three.file_exists(infile):
+        raise ValueError("couldn't find prototype [%s]" % infile)
+
+    obj = convert_obj_three.load_obj(infile)
+    scale_cross_section(obj[1], bake_bars.BAR_WIDTH)
+
+    convert_obj_three.TYPE = "binary"
+    convert_obj_three.convert_binary(infile, protofile, obj)
+
+    return protofile
+
+# #####################################################
+# Instances
+# #####################################################
+def directions(lat, lng):
+    """Unit vectors of points (addPoint position / 200).
+    """
+
+    return bake_bars.positions(lat, lng) / bake_bars.RADIUS
+
+def heights(magnitude):
+    return numpy.maximum(magnitude * 200, bake_bars.MIN_SCALE)
+
+def palette(step):
+    if step == 4:
+        return bake_bars.hsl_colors(numpy.arange(PALETTE_SIZE, dtype=numpy.float64))
+    return bake_bars.hsl_colors(numpy.arange(PALETTE_SIZE) / float(PALETTE_SIZE - 1))
+
+def color_indices(color, step):
+    if step == 4:
+        return color.astype(numpy.uint8)
+    index = numpy.floor(numpy.clip(color, 0, 1) * (PALETTE_SIZE - 1) + 0.5)
+    return index.astype(numpy.uint8)
+
+def pack(direction, height_columns, colors, colormap, names):
+    sections = [bake_bars.bytes_le(numpy.round(direction * 32767), 'i2'),
+                "".join(bake_bars.bytes_le(h, 'f4') for h in height_columns),
+                bake_bars.bytes_le(colors, 'u1'),
+                bake_bars.bytes_le(colormap, 'f4'),
+                bake_bars.encode_names(names)]
+
+    offset = struct.calcsize(HEADER)
+    offsets = []
+    for data in sections:
+        offsets.append(offset)
+        offset += len(data)
+
+    header = struct.pack(HEADER, SIGNATURE, len(direction), len(height_columns), len(colormap), *offsets)
+    return header + "".join(sections)
+
+def export_series(values, step, name):
+    lat, lng, magnitude, color = bake_bars.columns(values, step)
+    return pack(directions(lat, lng), [heights(magnitude)], color_indices(color, step), palette(step), [name])
+
+def export_animated(series, step):
+    """Shared directions and colors of first series, height column per series.
+    """
+
+    lat, lng, magnitude, color = bake_bars.columns(series[0][1], step)
+
+    columns = []
+    for name, values in series:
+        slat, slng, smagnitude, scolor = bake_bars.columns(values, step)
+        if len(slat) != len(lat) or (slat != lat).any() or (slng != lng).any():
+            raise ValueError("series [%s] doesn't have the same coordinates as the first series" % name)
+        columns.append(heights(smagnitude))
+
+    return pack(directions(lat, lng), columns, color_indices(color, step), palette(step), [name for name, values in series])
+
+# #####################################################
+# API
+# #####################################################
+def export_dataset(infile, outfile):
+    """Export infile dataset into outfile instances (or one file per series)
+    and the prototype mesh.
+    """
+
+    step = compile_data.STEPS[FORMAT]
+    series = compile_data.load_series(infile, step)
+    compile_data.validate(series, step)
+
+    if ANIMATED:
+        outputs = [(outfile, export_animated(series, step))]
+    else:
+        outputs = []
+        for name, values in series:
+            fname = outfile
+            if len(series) > 1:
+                root, ext = os.path.splitext(outfile)
+                fname = "%s_%s%s" % (root, name, ext)
+            outputs.append((fname, export_series(values, step, name)))
+
+    for fname, data in outputs:
+        out = open(fname, "wb")
+        out.write(data)
+        out.close()
+
+        print "[%s] %d bytes" % (fname, len(data))
+
+    protofile = convert_prototype(MODEL, outfile)
+    print "prototype [%s]" % protofile
+
+# #####################################################
+# Helpers
+# #####################################################
+def usage():
+    print "Usage: %s -i dataset -o outfile [-m cube|hex|model.obj] [-f magnitude|legend] [-a]" % os.path.basename(sys.argv[0])
+
+# #####################################################
+# Main
+# #####################################################
+if __name__ == "__main__":
+
+    # get parameters from the command line
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hai:o:f:m:", ["help", "animated", "input=", "output=", "format=", "model="])
+
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    infile = outfile = ""
+
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            usage()
+            sys.exit()
+
+        elif o in ("-i", "--input"):
+            infile = a
+
+        elif o in ("-o", "--output"):
+            outfile = a
+
+        elif o in ("-f", "--format"):
+            if a in ("magnitude", "legend"):
+                FORMAT = a
+
+        elif o in ("-m", "--model"):
+            MODEL = a
+
+        elif o in ("-a", "--animated"):
+            ANIMATED = True
+
+    if infile == "" or outfile == "":
+        usage()
+        sys.exit(2)
+
+    print "Exporting [%s] into [%s] ..." % (infile, outfile)
+
+    try:
+        export_dataset(infile, outfile)
+    except ValueError, e:
+        print "ERROR: %s" % e
+        sys.exit(1)
@@ -0,0 +1,370 @@
+"""Pack multi-series globe datasets with shared positions and delta magnitudes
+
+In animated datasets like population909500.json (1990, 1995, 2000) every
+series repeats the same coordinates, only magnitudes change. This packer
+finds series with the same coordinate set, stores their positions once
+and keeps only a quantized, delta-encoded magnitude column per series.
+
+-------------------------
+How to use this packer
+-------------------------
+
+python pack_series.py -i population909500.json -o population909500.pack [-f magnitude|legend] [-c float32|int16] [-b bits]
+
+Notes:
+    - flags
+        -i infile                   input dataset (JSON, CSV or compiled .bin, see compile_data.py)
+        -o outfile                  output packed dataset
+        -f magnitude|legend         data format (3 or 4 numbers per point)
+        -c float32|int16            coordinate encoding (as in compile_data.py)
+        -b bits                     magnitude quantization bits (1 - 24)
+
+    - by default:
+        format is magnitude
+        coordinates are float32
+        magnitudes are quantized to 16 bits
+
+    - sizes of input JSON, compiled dataset (compile_data.py) and packed
+      dataset are reported, raw and deflated (close to gzip transfer size)
+
+-------------
+Binary format
+-------------
+
+All data is little-endian, every section starts at 4 byte boundary:
+
+    signature           8s      "DATPACK1"
+    step                I       3 (magnitude) or 4 (legend)
+    nseries             I
+    ngroups             I       distinct coordinate sets
+    coordinates         I       0 = float32, 1 = int16
+    bits                I       magnitude quantization bits
+
+    group table         ngroups * (npoints I, lat offset I, lng offset I, legend offset I, min f, max f)
+    series table        nseries * (group I, name offset I, name length I, data offset I, data length I)
+    names               utf-8
+
+    lat, lng, legend    per group, as in compile_data.py
+    magnitudes          per series, varints
+
+Series belong to the same group when lat, lng (and legend) are equal point
+by point. Magnitudes of a group are quantized over the group's [min, max]:
+
+    q = round((magnitude - min) / (max - min) * (2^bits - 1))
+
+and every series stores zigzag varints of q minus q of the previous series
+of the same group (first series of a group is delta to 0), so a point that
+doesn't change between years costs one byte.
+
+"""
+
+import array
+import getopt
+import json
+import math
+import os.path
+import struct
+import sys
+import zlib
+
+import compile_data
+
+# #####################################################
+# Configuration
+# #####################################################
+FORMAT = "magnitude"        # magnitude legend
+COORDINATES = "float32"     # float32 int16
+BITS = 16
+
+SIGNATURE = "DATPACK1"
+
+HEADER = '<8sIIIII'
+GROUP = '<IIIIff'
+SERIES = '<IIIII'
+
+# #####################################################
+# Varints
+# #####################################################
+def zigzag(v):
+    if v < 0:
+        return (-v << 1) - 1
+    return v << 1
+
+def unzigzag(v):
+    if v & 1:
+        return -((v + 1) >> 1)
+    return v >> 1
+
+def write_varints(values):
+    data = bytearray()
+    for v in values:
+        while v > 0x7f:
+            data.append((v & 0x7f) | 0x80)
+            v >>= 7
+        data.append(v)
+    return str(data)
+
+def read_varints(data):
+    values = []
+    v = shift = 0
+    for b in bytearray(data):
+        v |= (b & 0x7f) << shift
+        if b & 0x80:
+            shift += 7
+        else:
+            values.append(v)
+            v = shift = 0
+    return values
+
+# #####################################################
+# Packing
+# #####################################################
+def group_series(series, step):
+    """Group series by coordinate set, returns list of (coordinates, [series indices]).
+    """
+
+    groups = []
+    index = {}
+
+    for i, (name, values) in enumerate(series):
+        lat = array.array('d', values[0::step])
+        lng = array.array('d', values[1::step])
+        legend = array.array('d', values[3::step]) if step == 4 else array.array('d')
+
+        key = (lat.tostring(), lng.tostring(), legend.tostring())
+        if key not in index:
+            index[key] = len(groups)
+            groups.append(((lat, lng, legend), []))
+        groups[index[key]][1].append(i)
+
+    return groups
+
+def quantize_magnitudes(magnitude, lo, hi, bits):
+    top = (1 << bits) - 1
+    if hi <= lo:
+        return [0] * len(magnitude)
+    scale = top / (hi - lo)
+    return [int(math.floor((m - lo) * scale + 0.5)) for m in magnitude]
+
+def pack_series(series, step, coordinates, bits):
+    """Build packed dataset from list of (name, flat data).
+    """
+
+    groups = group_series(series, step)
+
+    group_table = []
+    series_table = [None] * len(series)
+    sections = []
+
+    names = ""
+    name_entries = []
+    for name, values in series:
+        encoded = name.encode("utf-8")
+        name_entries.append((len(names), len(encoded)))
+        names += encoded
+
+    for g, ((lat, lng, legend), members) in enumerate(groups):
+        if coordinates == "int16":
+            lat = array.array('h', [compile_data.quantize_coordinate(v, 90.0) for v in lat])
+            lng = array.array('h', [compile_data.quantize_coordinate(v, 180.0) for v in lng])
+        else:
+            lat = array.array('f', lat)
+            lng = array.array('f', lng)
+
+        columns = [compile_data.pad(compile_data.little_endian(lat)),
+                   compile_data.pad(compile_data.little_endian(lng))]
+        if step == 4:
+            columns.append(compile_data.pad(compile_data.little_endian(array.array('B', [int(v) for v in legend]))))
+
+        magnitudes = [series[i][1][2::step] for i in members]
+        lo = min(min(m) for m in magnitudes) if lat else 0.0
+        hi = max(max(m) for m in magnitudes) if lat else 0.0
+
+        # float32 range stored in the file is what the decoder uses
+        lo, hi = struct.unpack('<ff', struct.pack('<ff', lo, hi))
+
+        group_table.append((len(lat), columns[0], columns[1], columns[2] if step == 4 else None, lo, hi))
+
+        previous = [0] * len(lat)
+        for i, magnitude in zip(members, magnitudes):
+            q = quantize_magnitudes(magnitude, lo, hi, bits)
+            data = write_varints(zigzag(a - b) for a, b in zip(q, previous))
+            previous = q
+            series_table[i] = (g, name_entries[i], data)
+
+    # layout
+    offset = (struct.calcsize(HEADER) + struct.calcsize(GROUP) * len(groups) +
+              struct.calcsize(SERIES) * len(series) + compile_data.align4(len(names)))
+
+    def place(data):
+        start = offset + sum(len(s) for s in sections)
+        sections.append(compile_data.pad(data))
+        return start
+
+    buffer = [struct.pack(HEADER, SIGNATURE, step, len(series), len(groups), compile_data.COORDINATE_TYPES[coordinates], bits)]
+
+    for npoints, lat, lng, legend, lo, hi in group_table:
+        buffer.append(struct.pack(GROUP, npoints, place(lat), place(lng), place(legend) if legend is not None else 0, lo, hi))
+
+    for g, (name_offset, name_length), data in series_table:
+        buffer.append(struct.pack(SERIES, g, name_offset, name_length, place(data), len(data)))
+
+    buffer.append(compile_data.pad(names))
+    buffer.extend(sections)
+
+    return "".join(buffer), len(groups)
+
+# #####################################################
+# Reader API
+# #####################################################
+def parse_packed(data):
+    """Parse packed dataset from bytes into compile_data.Dataset.
+    """
+
+    signature, step, nseries, ngroups, coordinates, bits = struct.unpack_from(HEADER, data, 0)
+    if signature != SIGNATURE:
+        raise ValueError("not a packed globe dataset")
+
+    top = float((1 << bits) - 1)
+
+    offset = struct.calcsize(HEADER)
+    groups = []
+    for g in xrange(ngroups):
+        npoints, lat_offset, lng_offset, legend_offset, lo, hi = struct.unpack_from(GROUP, data, offset)
+        offset += struct.calcsize(GROUP)
+
+        if coordinates == compile_data.COORDINATE_TYPES["int16"]:
+            lat = [v * 90.0 / 32767 for v in compile_data.read_array('h', data, lat_offset, npoints)]
+            lng = [v * 180.0 / 32767 for v in compile_data.read_array('h', data, lng_offset, npoints)]
+        else:
+            lat = compile_data.read_array('f', data, lat_offset, npoints)
+            lng = compile_data.read_array('f', data, lng_offset, npoints)
+
+        legend = None
+        if step == 4:
+            legend = compile_data.read_array('B', data, legend_offset, npoints)
+
+        groups.append([lat, lng, legend, lo, hi, [0] * npoints])
+
+    names_offset = offset + struct.calcsize(SERIES) * nseries
+
+    series = []
+    for i in xrange(nseries):
+        g, name_offset, name_length, data_offset, data_length = struct.unpack_from(SERIES, data, offset)
+        offset += struct.calcsize(SERIES)
+
+        name = data[names_offset + name_offset:names_offset + name_offset + name_length].decode("utf-8")
+
+        lat, lng, legend, lo, hi, previous = groups[g]
+        deltas = read_varints(data[data_offset:data_offset + data_length])
+        q = [p + unzigzag(d) for p, d in zip(previous, deltas)]
+        groups[g][5] = q
+
+        magnitude = array.array('f', [lo + (hi - lo) * v / top for v in q])
+        series.append(compile_data.Series(name, lat, lng, magnitude, legend))
+
+    return compile_data.Dataset(step, series)
+
+def read_packed(fname):
+    """Read packed dataset file.
+    """
+
+    f = open(fname, "rb")
+    data = f.read()
+    f.close()
+
+    return parse_packed(data)
+
+# #####################################################
+# Report
+# #####################################################
+def report(rows):
+    print "%-12s %12s %12s" % ("", "bytes", "deflated")
+    base = rows[0][1]
+    for label, data in rows:
+        print "%-12s %12d %12d   %5.1f%%" % (label, len(data), len(zlib.compress(data, 9)), 100.0 * len(data) / len(base))
+
+# #####################################################
+# API
+# #####################################################
+def pack_dataset(infile, outfile):
+    """Pack infile dataset into outfile and report sizes.
+    """
+
+    step = compile_data.STEPS[FORMAT]
+    series = compile_data.load_series(infile, step)
+    compile_data.validate(series, step)
+
+    data, ngroups = pack_series(series, step, COORDINATES, BITS)
+
+    out = open(outfile, "wb")
+    out.write(data)
+    out.close()
+
+    npoints = sum(len(values) for name, values in series) / step
+    print "%d series, %d points, %d coordinate sets" % (len(series), npoints, ngroups)
+
+    source = json.dumps([[name, values] for name, values in series], separators=(",", ":"))
+    if os.path.splitext(infile)[1].lower() == ".json":
+        f = open(infile, "rb")
+        source = f.read()
+        f.close()
+
+    report([("json", source),
+            ("compiled", compile_data.compile_series(series, step, COORDINATES)),
+            ("packed", data)])
+
+# #####################################################
+# Helpers
+# #####################################################
+def usage():
+    print "Usage: %s -i dataset -o outfile [-f magnitude|legend] [-c float32|int16] [-b bits]" % os.path.basename(sys.argv[0])
+
+# #####################################################
+# Main
+# #####################################################
+if __name__ == "__main__":
+
+    # get parameters from the command line
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hi:o:f:c:b:", ["help", "input=", "output=", "format=", "coordinates=", "bits="])
+
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    infile = outfile = ""
+
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            usage()
+            sys.exit()
+
+        elif o in ("-i", "--input"):
+            infile = a
+
+        elif o in ("-o", "--output"):
+            outfile = a
+
+        elif o in ("-f", "--format"):
+            if a in ("magnitude", "legend"):
+                FORMAT = a
+
+        elif o in ("-c", "--coordinates"):
+            if a in ("float32", "int16"):
+                COORDINATES = a
+
+        elif o in ("-b", "--bits"):
+            BITS = min(24, max(1, int(a)))
+
+    if infile == "" or outfile == "":
+        usage()
+        sys.exit(2)
+
+    print "Packing [%s] into [%s] ..." % (infile, outfile)
+
+    try:
+        pack_dataset(infile, outfile)
+    except ValueError, e:
+        print "ERROR: %s" % e
+        sys.exit(1)
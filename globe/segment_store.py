@@ -0,0 +1,535 @@
+"""Append-only segmented storage for globe data series
+
+Every series lives in its own segment of one store file. Adding a new
+series (e.g. a new year of population909500.json) appends a segment and
+a new footer index after everything already in the file: existing bytes
+never change, so older segments stay cached by clients and CDNs
+(fetched with range requests at offsets from the footer).
+
+Input JSON is parsed incrementally and points are written out in blocks,
+so memory use doesn't grow with the size of the input.
+
+-------------------------
+How to use this store
+-------------------------
+
+python segment_store.py -s population.seg -i population909500.json [-f magnitude|legend] [-n name]
+python segment_store.py -s population.seg -l
+
+Notes:
+    - flags
+        -s store                    store file, created when it doesn't exist
+        -i infile                   JSON to append, globe format ([["name", [...]], ...]) or flat array
+        -f magnitude|legend         data format (3 or 4 numbers per point), fixed when store is created
+        -n name                     series name for flat array input (default is input file name)
+        -l                          list segments
+
+    - by default:
+        format is magnitude
+
+    - stores can be read with compile_data.py tools (load_series takes .seg files)
+
+-------------
+File format
+-------------
+
+All data is little-endian:
+
+    header              16 bytes, written once with an empty footer and trailer
+        signature       8s      "DATSEGS1"
+        version         I       1
+        step            I       3 (magnitude) or 4 (legend)
+
+    segment             npoints * step float32 (lat, lng, magnitude [, legend] per point)
+    ...
+    footer              nsegments * (offset Q, npoints I, name offset I, name length I, crc32 I)
+                        names, utf-8
+    trailer             24 bytes
+        footer offset   Q
+        nsegments       I
+        footer crc32    I
+        signature       8s      "DATINDEX"
+
+Appending writes new segments after the current trailer, then a new footer
+and trailer listing all segments. Old footers stay in the file as unused
+bytes, and when the last append didn't finish, the last complete trailer
+is used. New stores are written to a temporary file with header and empty
+footer and renamed into place, so even a crash during the first append
+leaves a store that opens (without segments).
+
+"""
+
+import array
+import getopt
+import json
+import mmap
+import os
+import os.path
+import re
+import struct
+import sys
+import zlib
+
+import compile_data
+
+# #####################################################
+# Configuration
+# #####################################################
+FORMAT = "magnitude"    # magnitude legend
+
+SIGNATURE = "DATSEGS1"
+INDEX_SIGNATURE = "DATINDEX"
+VERSION = 1
+
+HEADER = '<8sII'
+ENTRY = '<QIIII'
+TRAILER = '<QII8s'
+
+CHUNK_SIZE = 1 << 16        # bytes read from input at once
+NUMBER_TAIL = 2             # exponent chars ("e-") a number match can stop short of
+BLOCK_POINTS = 1 << 14      # points buffered before writing
+
+# #####################################################
+# Streaming JSON
+# #####################################################
+TOKEN = re.compile(r'\s*(?:([\[\]{},:])|("(?:[^"\\]|\\.)*")|(-?\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)|(true|false|null))', re.S)
+SPACE = re.compile(r'\s*')
+
+class Tokenizer(object):
+    """Incremental JSON tokenizer, reads file in chunks.
+
+    Tokens are ("punct", char), ("string", value), ("number", value) or ("literal", value).
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.lookahead = None
+
+    def fill(self):
+        chunk = self.f.read(CHUNK_SIZE)
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        self.eof = not chunk
+
+    def scan(self):
+        while True:
+            m = TOKEN.match(self.buffer, self.pos)
+
+            # token could continue in the next chunk, "1e-05" split after
+            # "1e" matches just "1", so numbers need a few more bytes
+            end = m.end() if m else len(self.buffer)
+            if m and (m.group(3) or m.group(4)):
+                end += NUMBER_TAIL
+            if end >= len(self.buffer) and not self.eof:
+                self.fill()
+                continue
+
+            if not m:
+                if SPACE.match(self.buffer, self.pos).end() == len(self.buffer):
+                    return None
+                raise ValueError("invalid JSON near [%s]" % self.buffer[self.pos:self.pos + 20].strip())
+
+            self.pos = m.end()
+            punct, string, number, literal = m.groups()
+
+            if punct:
+                return ("punct", punct)
+            if string:
+                return ("string", json.loads(string))
+            if number:
+                return ("number", float(number))
+            return ("literal", literal)
+
+    def peek(self):
+        if self.lookahead is None:
+            self.lookahead = self.scan()
+        return self.lookahead
+
+    def next(self):
+        token = self.peek()
+        self.lookahead = None
+        if token is None:
+            raise ValueError("unexpected end of JSON")
+        return token
+
+    def expect(self, char):
+        token = self.next()
+        if token != ("punct", char):
+            raise ValueError("expected [%s] in JSON, got [%s]" % (char, token[1]))
+
+def read_numbers(tokens, sink):
+    """Read numbers of an array up to its closing bracket (opening one already read).
+    """
+
+    if tokens.peek() == ("punct", "]"):
+        tokens.next()
+        return
+
+    while True:
+        kind, value = tokens.next()
+        if kind != "number":
+            raise ValueError("expected number in data array, got [%s]" % value)
+        sink.add(value)
+
+        kind, value = tokens.next()
+        if value == "]":
+            return
+        if value != ",":
+            raise ValueError("expected [,] in data array, got [%s]" % value)
+
+def stream_series(f, store, default_name):
+    """Parse globe JSON from f, appending every series to store as it is read.
+    """
+
+    tokens = Tokenizer(f)
+    tokens.expect("[")
+
+    # flat array, single series
+    if tokens.peek() != ("punct", "["):
+        sink = store.segment(default_name)
+        read_numbers(tokens, sink)
+        sink.close()
+        return
+
+    while True:
+        tokens.expect("[")
+        kind, name = tokens.next()
+        if kind != "string":
+            raise ValueError("expected series name, got [%s]" % name)
+        tokens.expect(",")
+        tokens.expect("[")
+
+        sink = store.segment(name)
+        read_numbers(tokens, sink)
+        sink.close()
+
+        tokens.expect("]")
+
+        kind, value = tokens.next()
+        if value == "]":
+            return
+        if value != ",":
+            raise ValueError("expected [,] between series, got [%s]" % value)
+
+# #####################################################
+# Writing
+# #####################################################
+def write_footer(f, entries):
+    """Footer and trailer listing entries (name, offset, npoints, crc), at current position.
+    """
+
+    footer_offset = f.tell()
+
+    names = ""
+    packed = []
+    for name, offset, npoints, crc in entries:
+        encoded = name.encode("utf-8")
+        packed.append(struct.pack(ENTRY, offset, npoints, len(names), len(encoded), crc))
+        names += encoded
+
+    footer = "".join(packed) + names
+    f.write(footer)
+    f.write(struct.pack(TRAILER, footer_offset, len(entries), zlib.crc32(footer) & 0xffffffff, INDEX_SIGNATURE))
+
+def create_store(fname, step):
+    """Empty store, header and footer go to a temporary file that is then
+    renamed, so there is never a store without footer.
+    """
+
+    tmpname = fname + ".tmp"
+    f = open(tmpname, "wb")
+    try:
+        f.write(struct.pack(HEADER, SIGNATURE, VERSION, step))
+        write_footer(f, [])
+        f.flush()
+        os.fsync(f.fileno())
+    finally:
+        f.close()
+    os.rename(tmpname, fname)
+
+class SegmentWriter(object):
+    """Writes points of one series in blocks, validating them on the way.
+    """
+
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+        self.offset = store.f.tell()
+        self.block = array.array('f')
+        self.count = 0
+        self.crc = 0
+
+    def add(self, value):
+        self.count += 1
+        self.block.append(value)
+        if len(self.block) >= BLOCK_POINTS * self.store.step:
+            self.flush()
+
+    def check(self):
+        step = self.store.step
+        first = (self.count - len(self.block)) / step
+        for i in xrange(0, len(self.block) - step + 1, step):
+            lat, lng = self.block[i], self.block[i + 1]
+            if not -90 <= lat <= 90:
+                raise ValueError("series [%s] point %d: latitude %s out of range" % (self.name, first + i / step, lat))
+            if not -180 <= lng <= 180:
+                raise ValueError("series [%s] point %d: longitude %s out of range" % (self.name, first + i / step, lng))
+
+    def flush(self):
+        self.check()
+        data = compile_data.little_endian(self.block)
+        self.store.f.write(data)
+        self.crc = zlib.crc32(data, self.crc)
+        self.block = array.array('f')
+
+    def close(self):
+        if self.count % self.store.step:
+            raise ValueError("series [%s] has %d numbers, not a multiple of %d" % (self.name, self.count, self.store.step))
+        self.flush()
+        self.store.add_entry(self.name, self.offset, self.count / self.store.step, self.crc & 0xffffffff)
+
+class StoreWriter(object):
+    """Appends segments to store, footer is written by commit.
+    """
+
+    def __init__(self, fname, step):
+        if not os.path.exists(fname):
+            create_store(fname, step)
+
+        store = Store(fname)
+        self.step = store.step
+        self.entries = [(s.name, s.offset, s.npoints, s.crc) for s in store.segments]
+        store.close()
+
+        if self.step != step:
+            raise ValueError("store has %s format" % ("legend" if self.step == 4 else "magnitude"))
+
+        self.f = open(fname, "r+b")
+        self.f.seek(0, os.SEEK_END)
+
+        self.start = self.f.tell()
+        self.added = []
+
+    def segment(self, name):
+        if name in [entry[0] for entry in self.entries]:
+            raise ValueError("store already has series [%s]" % name)
+        return SegmentWriter(self, name)
+
+    def add_entry(self, name, offset, npoints, crc):
+        self.entries.append((name, offset, npoints, crc))
+        self.added.append(name)
+
+    def commit(self):
+        # segments are written, now the footer that points to them
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+        write_footer(self.f, self.entries)
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.f.close()
+
+    def abort(self):
+        # drop partial segments, file is back to what it was
+        self.f.truncate(self.start)
+        self.f.close()
+
+# #####################################################
+# Reader API
+# #####################################################
+class Segment(object):
+    def __init__(self, name, offset, npoints, crc):
+        self.name = name
+        self.offset = offset
+        self.npoints = npoints
+        self.crc = crc
+
+class Store(object):
+    """Read-only view of store file.
+
+        store = Store("population.seg")
+        for segment in store.segments:
+            print segment.name, segment.npoints
+        values = store.values("1990")
+    """
+
+    def __init__(self, fname):
+        self.f = open(fname, "rb")
+        self.data = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        signature, version, step = struct.unpack_from(HEADER, self.data, 0)
+        if signature != SIGNATURE:
+            raise ValueError("[%s] is not a segment store" % fname)
+        if version != VERSION:
+            raise ValueError("unsupported store version %d" % version)
+
+        self.step = step
+        self.segments = self.read_footer()
+
+    def read_footer(self):
+        """Segments from the last complete trailer.
+        """
+
+        size = struct.calcsize(TRAILER)
+        end = len(self.data)
+
+        while True:
+            pos = self.data.rfind(INDEX_SIGNATURE, struct.calcsize(HEADER), end)
+            if pos < 0:
+                if len(self.data) == struct.calcsize(HEADER):
+                    return []
+                raise ValueError("store has no valid footer")
+
+            start = pos + len(INDEX_SIGNATURE) - size
+            end = pos
+            if start < struct.calcsize(HEADER):
+                continue
+
+            footer_offset, nsegments, crc, signature = struct.unpack_from(TRAILER, self.data, start)
+            if footer_offset > start or zlib.crc32(self.data[footer_offset:start]) & 0xffffffff != crc:
+                continue
+
+            names_offset = footer_offset + struct.calcsize(ENTRY) * nsegments
+
+            segments = []
+            for i in xrange(nsegments):
+                offset, npoints, name_offset, name_length, scrc = struct.unpack_from(ENTRY, self.data, footer_offset + i * struct.calcsize(ENTRY))
+                name = self.data[names_offset + name_offset:names_offset + name_offset + name_length].decode("utf-8")
+                segments.append(Segment(name, offset, npoints, scrc))
+            return segments
+
+    def segment(self, name):
+        for segment in self.segments:
+            if segment.name == name:
+                return segment
+        raise KeyError(name)
+
+    def values(self, name, verify=False):
+        """Flat float32 array of series, the way DAT.Globe.addData takes it.
+        """
+
+        segment = self.segment(name)
+        length = segment.npoints * self.step * 4
+        data = self.data[segment.offset:segment.offset + length]
+
+        if verify and zlib.crc32(data) & 0xffffffff != segment.crc:
+            raise ValueError("segment [%s] is corrupted" % name)
+
+        a = array.array('f')
+        a.fromstring(data)
+        if sys.byteorder != "little":
+            a.byteswap()
+        return a
+
+    def to_series(self):
+        """List of (name, flat data), as compile_data.load_series returns.
+        """
+
+        return [(segment.name, self.values(segment.name).tolist()) for segment in self.segments]
+
+    def close(self):
+        self.data.close()
+        self.f.close()
+
+def read_store(fname):
+    store = Store(fname)
+    series = store.to_series()
+    store.close()
+    return series
+
+# #####################################################
+# API
+# #####################################################
+def append_file(storefile, infile, name=None):
+    """Stream infile JSON into storefile, returns names of added series.
+    """
+
+    step = compile_data.STEPS[FORMAT]
+    writer = StoreWriter(storefile, step)
+
+    if name is None:
+        name = os.path.splitext(os.path.basename(infile))[0].decode("utf-8")
+
+    f = open(infile, "rb")
+    try:
+        stream_series(f, writer, name)
+    except:
+        writer.abort()
+        raise
+    finally:
+        f.close()
+
+    writer.commit()
+    return writer.added
+
+def list_store(storefile):
+    store = Store(storefile)
+    print "%s format, %d segments, %d bytes" % ("legend" if store.step == 4 else "magnitude", len(store.segments), len(store.data))
+    for segment in store.segments:
+        print "%-20s offset %10d %8d points  crc %08x" % (segment.name, segment.offset, segment.npoints, segment.crc)
+    store.close()
+
+# #####################################################
+# Helpers
+# #####################################################
+def usage():
+    print "Usage: %s -s store -i infile.json [-f magnitude|legend] [-n name]" % os.path.basename(sys.argv[0])
+    print "       %s -s store -l" % os.path.basename(sys.argv[0])
+
+# #####################################################
+# Main
+# #####################################################
+if __name__ == "__main__":
+
+    # get parameters from the command line
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hls:i:f:n:", ["help", "list", "store=", "input=", "format=", "name="])
+
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    storefile = infile = ""
+    name = None
+    listing = False
+
+    for o, a in opts:
+        if o in ("-h", "--help"):
+            usage()
+            sys.exit()
+
+        elif o in ("-s", "--store"):
+            storefile = a
+
+        elif o in ("-i", "--input"):
+            infile = a
+
+        elif o in ("-f", "--format"):
+            if a in ("magnitude", "legend"):
+                FORMAT = a
+
+        elif o in ("-n", "--name"):
+            name = a.decode("utf-8")
+
+        elif o in ("-l", "--list"):
+            listing = True
+
+    if storefile == "" or (infile == "" and not listing):
+        usage()
+        sys.exit(2)
+
+    try:
+        if infile:
+            print "Appending [%s] to [%s] ..." % (infile, storefile)
+            added = append_file(storefile, infile, name)
+            print "added series %s" % ", ".join(added)
+
+        if listing:
+            list_store(storefile)
+
+    except ValueError, e:
+        print "ERROR: %s" % e
+        sys.exit(1)
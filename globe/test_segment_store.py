@@ -0,0 +1,82 @@
+"""Streaming JSON and crash safety of segment stores
+
+    python test_segment_store.py
+"""
+
+import array
+import os
+import os.path
+import shutil
+import StringIO
+import tempfile
+import unittest
+
+import segment_store
+
+DATA = '[["a",[1.0,2.0,1e-05,-3.5,4E1,2.5e+2]],\n ["b", [ 10 , -20.125 , 3e-1 ]]]'
+EXPECTED = [("a", [1.0, 2.0, 1e-05, -3.5, 40.0, 250.0]), ("b", [10.0, -20.125, 0.3])]
+
+def float32(values):
+    return array.array('f', values).tolist()
+
+class SegmentStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.dir, "test.seg")
+        self.chunk_size = segment_store.CHUNK_SIZE
+
+    def tearDown(self):
+        segment_store.CHUNK_SIZE = self.chunk_size
+        shutil.rmtree(self.dir)
+
+    def append(self, text, name=u"flat"):
+        writer = segment_store.StoreWriter(self.fname, 3)
+        segment_store.stream_series(StringIO.StringIO(text), writer, name)
+        writer.commit()
+
+    def test_tokens_across_chunks(self):
+        text = '[1e-05, -2.5E+10, true, null, "x\\"y", {"k": false}]'
+        expected = None
+        for size in xrange(1, 33):
+            segment_store.CHUNK_SIZE = size
+            tokenizer = segment_store.Tokenizer(StringIO.StringIO(text))
+            tokens = []
+            while tokenizer.peek() is not None:
+                tokens.append(tokenizer.next())
+            if expected is None:
+                expected = tokens
+            self.assertEqual(tokens, expected, "chunk size %d" % size)
+        self.assertIn(("number", 1e-05), expected)
+        self.assertIn(("string", u'x"y'), expected)
+
+    def test_series_across_chunks(self):
+        for size in xrange(1, 33):
+            segment_store.CHUNK_SIZE = size
+            if os.path.exists(self.fname):
+                os.remove(self.fname)
+
+            self.append(DATA)
+
+            series = segment_store.read_store(self.fname)
+            self.assertEqual(series, [(name, float32(values)) for name, values in EXPECTED], "chunk size %d" % size)
+
+    def test_crash_in_first_append(self):
+        # first append dies after writing points, before commit
+        writer = segment_store.StoreWriter(self.fname, 3)
+        sink = writer.segment(u"a")
+        for value in [1.0, 2.0, 3.0] * 100:
+            sink.add(value)
+        sink.flush()
+        writer.f.close()
+
+        store = segment_store.Store(self.fname)
+        self.assertEqual(store.segments, [])
+        store.close()
+
+        self.append(DATA)
+        self.assertEqual([name for name, values in segment_store.read_store(self.fname)], ["a", "b"])
+        self.assertFalse(os.path.exists(self.fname + ".tmp"))
+
+if __name__ == "__main__":
+    unittest.main()
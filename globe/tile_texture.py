@@ -0,0 +1,344 @@
+"""Cut equirectangular textures into a quadtree tile pyramid
+
+Both globes load world.jpg (and the vertex texture one worldMask.jpg and
+worldDataSample.jpg) whole with THREE.ImageUtils.loadTexture before the
+first frame. This tool cuts such a texture into tiles at several
+resolutions plus a small whole-world base image, so a client can show
+the base right away and fetch finer tiles only where the camera looks.
+
+Source is read in horizontal strips and the pyramid is built level by
+level from the strips, only a strip per level is kept in memory.
+
+-------------------------
+How to use this tool
+-------------------------
+
+python tile_texture.py -i world.jpg -o world [-t tileSize] [-f jpg|png] [-q quality] [-l maxLevel]
+
+Notes:
+    - flags
+        -i infile                   equirectangular texture (2:1, north at the top)
+        -o outdir                   output directory for tiles, base image and manifest.json
+        -t tileSize                 tile width and height in pixels
+        -f jpg|png                  tile format
+        -q quality                  JPEG quality
+        -l maxLevel                 finest level
+
+    - by default:
+        tiles are 256x256
+        format is jpg with quality 90 (use png for data textures, they should not be lossy)
+        finest level is the first one at least as big as the source
+
+    - binary PPM / PGM sources (P6 / P5, 8 bit) are read from disk strip
+      by strip, so they can be larger than memory (convert huge JPEGs
+      with e.g. djpeg first); other formats are decoded whole by PIL
+
+    - needs NumPy and PIL (Python Imaging Library)
+
+-------------
+Pyramid
+-------------
+
+Level l is 2^(l + 1) x 2^l tiles, that is 2^(l + 1) * tileSize by
+2^l * tileSize pixels, so level 0 is two tiles (western and eastern
+hemisphere). Finest level is resampled from the source (Lanczos),
+every coarser level averages 2x2 pixels of the one below, as the
+mipmaps of rasterize_data.py.
+
+Tile x, y of level l covers
+
+    lng     -180 + x * 360 / 2^(l + 1)  ..  -180 + (x + 1) * 360 / 2^(l + 1)
+    lat       90 - y * 180 / 2^l        ..    90 - (y + 1) * 180 / 2^l
+
+and is written to <level>/<x>/<y>.<format>. Base image is the whole of
+level 0 in one file.
+
+manifest.json:
+
+    {
+    "source"   : "world.jpg",
+    "width"    : 2048,
+    "height"   : 1024,
+    "tileSize" : 256,
+    "format"   : "jpg",
+    "base"     : "base.jpg",
+    "tiles"    : "{level}/{x}/{y}.jpg",
+    "levels"   : [
+        { "level": 0, "columns": 2, "rows": 1, "width": 512, "height": 256 },
+        ...
+        ]
+    }
+
+"""
+
+import getopt
+import json
+import math
+import os
+import os.path
+import sys
+
+import numpy
+
+from PIL import Image
+
+# #####################################################
+# Configuration
+# #####################################################
+TILE_SIZE = 256
+FORMAT = "jpg"          # jpg png
+QUALITY = 90
+MAX_LEVEL = None
+
+LANCZOS_SUPPORT = 3     # source rows around a strip the filter reaches (per unit of scale)
+
+# #####################################################
+# Sources
+# #####################################################
+class PNMSource:
+    """Binary PPM / PGM read row by row from disk.
+    """
+
+    def __init__(self, fname):
+        self.file = open(fname, "rb")
+
+        tokens = []
+        while len(tokens) < 4:
+            line = self.file.readline()
+            if not line:
+                raise ValueError("truncated PNM header in [%s]" % fname)
+            tokens.extend(line.split("#")[0].split())
+
+        magic, width, height, maxval = tokens[:4]
+        if magic not in ("P5", "P6") or int(maxval) > 255:
+            raise ValueError("only 8 bit binary PGM (P5) and PPM (P6) are streamed, not [%s]" % fname)
+
+        self.width = int(width)
+        self.height = int(height)
+        self.channels = 3 if magic == "P6" else 1
+        self.mode = "RGB" if magic == "P6" else "L"
+        self.offset = self.file.tell()
+
+    def rows(self, y0, y1):
+        stride = self.width * self.channels
+
+        self.file.seek(self.offset + y0 * stride)
+        data = numpy.frombuffer(self.file.read((y1 - y0) * stride), dtype=numpy.uint8)
+
+        if self.channels == 1:
+            return data.reshape(y1 - y0, self.width)
+        return data.reshape(y1 - y0, self.width, self.channels)
+
+class ImageSource:
+    """Any image PIL reads.
+    """
+
+    def __init__(self, fname):
+        image = Image.open(fname)
+        if image.mode not in ("L", "RGB", "RGBA"):
+            image = image.convert("RGB")
+
+        self.image = image
+        self.width, self.height = image.size
+        self.mode = image.mode
+
+    def rows(self, y0, y1):
+        return numpy.asarray(self.image.crop((0, y0, self.width, y1)))
+
+def open_source(fname):
+    if os.path.splitext(fname)[1].lower() in (".ppm", ".pgm", ".pnm"):
+        return PNMSource(fname)
+    return ImageSource(fname)
+
+# #####################################################
+# Pyramid
+# #####################################################
+def finest_level(width, height):
+    """First level at least as big as the source.
+    """
+
+    level = 0
+    while (2 << level) * TILE_SIZE < width or (1 << level) * TILE_SIZE < height:
+        level += 1
+    return level
+
+def read_strip(source, row, level):
+    """Tile row of level resampled from the source, float pixels.
+    """
+
+    width = (2 << level) * TILE_SIZE
+    height = (1 << level) * TILE_SIZE
+
+    scale = float(source.height) / height
+    top = row * TILE_SIZE * scale
+    bottom = (row + 1) * TILE_SIZE * scale
+
+    if source.width == width and source.height == height:
+        return source.rows(int(top), int(bottom)).astype(numpy.float64)
+
+    # read enough rows around the strip for the filter, so strips meet seamlessly
+    margin = int(math.ceil(LANCZOS_SUPPORT * max(scale, 1.0))) + 1
+    y0 = max(0, int(math.floor(top)) - margin)
+    y1 = min(source.height, int(math.ceil(bottom)) + margin)
+
+    strip = Image.fromarray(source.rows(y0, y1), source.mode)
+    strip = strip.resize((width, TILE_SIZE), Image.LANCZOS, box=(0, top - y0, source.width, bottom - y0))
+
+    return numpy.asarray(strip, dtype=numpy.float64)
+
+def downsample(strip):
+    """Half size strip, average of 2x2 pixels.
+    """
+
+    height, width = strip.shape[:2]
+    return strip.reshape((height // 2, 2, width // 2, 2) + strip.shape[2:]).mean(axis=(1, 3))
+
+def save_image(pixels, mode, fname):
+    image = Image.fromarray(numpy.clip(numpy.floor(pixels + 0.5), 0, 255).astype(numpy.uint8), mode)
+
+    if FORMAT == "jpg":
+        if image.mode == "RGBA":
+            image = image.convert("RGB")
+        image.save(fname, "JPEG", quality=QUALITY)
+    else:
+        image.save(fname, "PNG")
+
+def write_tiles(outdir, level, row, strip, mode):
+    for x in xrange(strip.shape[1] // TILE_SIZE):
+        folder = os.path.join(outdir, str(level), str(x))
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        tile = strip[:, x * TILE_SIZE:(x + 1) * TILE_SIZE]
+        save_image(tile, mode, os.path.join(folder, "%d.%s" % (row, FORMAT)))
+
+class Pyramid:
+    """Takes tile rows of the finest level in order, writes them and
+    feeds every coarser level as soon as it has a full tile row.
+    """
+
+    def __init__(self, outdir, levels, mode):
+        self.outdir = outdir
+        self.mode = mode
+        self.pending = [[] for l in xrange(levels)]
+        self.rows = [0] * levels
+        self.tiles = 0
+
+    def add(self, level, strip):
+        write_tiles(self.outdir, level, self.rows[level], strip, self.mode)
+        self.rows[level] += 1
+        self.tiles += strip.shape[1] // TILE_SIZE
+
+        if level == 0:
+            save_image(strip, self.mode, os.path.join(self.outdir, "base.%s" % FORMAT))
+            return
+
+        pending = self.pending[level - 1]
+        pending.append(downsample(strip))
+
+        if sum(len(p) for p in pending) == TILE_SIZE:
+            self.pending[level - 1] = []
+            self.add(level - 1, numpy.concatenate(pending))
+
+# #####################################################
+# API
+# #####################################################
+def tile_texture(infile, outdir):
+    """Write tile pyramid of infile into outdir, returns the manifest.
+    """
+
+    if TILE_SIZE < 2 or TILE_SIZE & (TILE_SIZE - 1):
+        raise ValueError("tile size has to be a power of two, not %d" % TILE_SIZE)
+
+    source = open_source(infile)
+
+    top = finest_level(source.width, source.height) if MAX_LEVEL is None else MAX_LEVEL
+
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    pyramid = Pyramid(outdir, top + 1, source.mode)
+    for row in xrange(1 << top):
+        pyramid.add(top, read_strip(source, row, top))
+
+    manifest = {
+        "source"   : os.path.basename(infile),
+        "width"    : source.width,
+        "height"   : source.height,
+        "tileSize" : TILE_SIZE,
+        "format"   : FORMAT,
+        "base"     : "base.%s" % FORMAT,
+        "tiles"    : "{level}/{x}/{y}.%s" % FORMAT,
+        "levels"   : [{ "level": l, "columns": 2 << l, "rows": 1 << l,
+                        "width": (2 << l) * TILE_SIZE, "height": (1 << l) * TILE_SIZE } for l in xrange(top + 1)]
+    }
+
+    out = open(os.path.join(outdir, "manifest.json"), "w")
+    json.dump(manifest, out, indent=4)
+    out.close()
+
+    print "%dx%d source, %d levels, %d tiles" % (source.width, source.height, top + 1, pyramid.tiles)
+
+    return manifest
+
+# #####################################################
+# Helpers
+# #####################################################
+def usage():
+    print "Usage: %s -i infile -o outdir [-t tileSize] [-f jpg|png] [-q quality] [-l maxLevel]" % os.path.basename(sys.argv[0])
+
+# #####################################################
+# Main
+# #####################################################
+if __name__ == "__main__":
+
+    # get parameters from the command line
+    try:
+        opts, args = getopt.getopt(sys.argv[1:], "hi:o:t:f:q:l:", ["help", "input=", "output=", "tilesize=", "format=", "quality=", "level="])
+
+    except getopt.GetoptError:
+        usage()
+        sys.exit(2)
+
+    infile = outdir = ""
+
+    try:
+        for o, a in opts:
+            if o in ("-h", "--help"):
+                usage()
+                sys.exit()
+
+            elif o in ("-i", "--input"):
+                infile = a
+
+            elif o in ("-o", "--output"):
+                outdir = a
+
+            elif o in ("-t", "--tilesize"):
+                TILE_SIZE = int(a)
+
+            elif o in ("-f", "--format"):
+                if a in ("jpg", "png"):
+                    FORMAT = a
+
+            elif o in ("-q", "--quality"):
+                QUALITY = max(1, min(100, int(a)))
+
+            elif o in ("-l", "--level"):
+                MAX_LEVEL = max(0, int(a))
+
+    except ValueError:
+        usage()
+        sys.exit(2)
+
+    if infile == "" or outdir == "":
+        usage()
+        sys.exit(2)
+
+    print "Tiling [%s] into [%s] ..." % (infile, outdir)
+
+    try:
+        tile_texture(infile, outdir)
+    except ValueError, e:
+        print "ERROR: %s" % e
+        sys.exit(1)
@@ -74,11 +74,38 @@ parser.add_argument(
     "--load-list", type=argparse.FileType('r'),
     help="List of tests to run.")
 
+# Parallel runs
+parser.add_argument(
+    "--shards", type=int, default=1,
+    help="Split the tests over this many browser sessions running in"
+         " parallel.")
+
+parser.add_argument(
+    "--timeout", type=int, default=600,
+    help="Seconds a browser may take for all its tests, 0 for no limit.")
+
+parser.add_argument(
+    "--test-timeout", type=int, default=30,
+    help="Seconds a browser may go without posting a result before its"
+         " remaining tests are failed as hung.")
+
+parser.add_argument(
+    "--durations", type=str, default=None,
+    help="File with per test durations of earlier runs, used to balance"
+         " the shards and updated at the end of the run. Defaults to"
+         " .test-durations.json with --shards, otherwise none is written.")
+
 args = parser.parse_args()
 
 if args.verbose and args.subunit:
     raise SystemExit("--verbose and --subunit are not compatible.")
 
+if args.shards < 1:
+    raise SystemExit("--shards must be at least 1.")
+
+if args.durations is None and args.shards > 1:
+    args.durations = ".test-durations.json"
+
 # Make sure the repository is setup and the dependencies exist
 # -----------------------------------------------------------------------------
 
@@ -298,9 +325,15 @@ import subunit
 import testtools
 import unittest
 
+
+def all_tests():
+    """Every test file listed in test/testcases.js."""
+    return re.compile("(?<=').+(?=')").findall(
+        file("test/testcases.js").read())
+
+
 if args.list:
-    data = file("test/testcases.js").read()
-    for test in re.compile("(?<=').+(?=')").findall(data):
+    for test in all_tests():
         print test[:-5]
     sys.exit(-1)
 
@@ -310,6 +343,55 @@ if args.load_list:
 else:
     tests = []
 
+# Split the tests into shards
+# -----------------------------------------------------------------------------
+import heapq
+
+durations = {}
+if args.durations and os.path.exists(args.durations):
+    try:
+        durations = simplejson.load(file(args.durations))
+    except ValueError:
+        durations = {}
+
+
+def partition(tests, shards):
+    """Longest first onto the least loaded shard, using earlier durations."""
+    known = [durations[t[:-5]] for t in tests if t[:-5] in durations]
+    default = sum(known) / len(known) if known else 1.0
+
+    # The runner filters tests with a regex search, so a test whose name
+    # matches another one has to be in the same shard as it.
+    def related(a, b):
+        return re.search(a, b) or re.search(b, a)
+
+    groups = []
+    for test in sorted(tests):
+        matching = [g for g in groups if any(related(t, test) for t in g)]
+        merged = [test]
+        for g in matching:
+            groups.remove(g)
+            merged.extend(g)
+        groups.append(merged)
+
+    cost = lambda g: sum(durations.get(t[:-5], default) for t in g)
+    groups.sort(key=cost, reverse=True)
+
+    heap = [(0.0, i, []) for i in range(shards)]
+    for group in groups:
+        load, i, shard = heapq.heappop(heap)
+        heapq.heappush(heap, (load + cost(group), i, shard + group))
+
+    return [sorted(shard) for load, i, shard in sorted(heap, key=lambda x: x[1])
+            if shard]
+
+if args.shards > 1:
+    if not tests:
+        tests = all_tests()
+    shards = partition(tests, args.shards)
+else:
+    shards = [tests]
+
 # Collect summary of all the individual test runs
 summary = testtools.StreamSummary()
 
@@ -332,8 +414,7 @@ else:
     if args.list:
         output = subunit.CopyStreamResult([summary, pertest])
         output.startTestRun()
-        for test in re.compile("(?<=').+(?=')").findall(
-                file("test/testcases.js").read()):
+        for test in all_tests():
             output.status(test_status='exists', test_id=test[:-5])
 
         output.stopTestRun()
@@ -355,6 +436,89 @@ import itertools
 import mimetools
 import mimetypes
 
+# Shards post their results at the same time.
+output_lock = threading.Lock()
+
+# Notified whenever a runner page posts, see TestRun.
+progress = threading.Condition()
+
+
+class TestRun(object):
+    """Progress of one test-runner.html page, updated by ServerHandler."""
+
+    def __init__(self, index, tests):
+        if not tests:
+            tests = all_tests()
+
+        self.index = index
+        self.tests = [t[:-5] for t in tests]
+        self.reported = set()
+        self.finished = False
+        self.closed = False
+        self.pending = 0
+        self.posts = 0
+        self.started = self.last = time.time()
+
+    def claim(self, tests):
+        """Starts handling a post reporting tests, returns the ones not
+        reported before or None if the run is over and the post has to be
+        dropped."""
+        with progress:
+            if self.closed:
+                return None
+            tests = [t for t in tests if t not in self.reported]
+            self.reported.update(tests)
+            self.pending += 1
+            return tests
+
+    def post(self, finished=False):
+        """Done handling a claimed post."""
+        with progress:
+            self.pending -= 1
+            if finished:
+                self.finished = self.closed = True
+            self.posts += 1
+            self.last = time.time()
+            progress.notify_all()
+
+    def wait(self, posts):
+        """Waits for another post, returns the post count or None if hung."""
+        with progress:
+            while not self.finished and self.posts == posts:
+                deadline = self.last + args.test_timeout
+                if args.timeout:
+                    deadline = min(deadline, self.started + args.timeout)
+
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                progress.wait(remaining)
+
+            return self.posts
+
+    def close(self):
+        """Drops later posts and waits for the ones being handled, returns
+        the tests which never posted a result."""
+        with progress:
+            self.closed = True
+            while self.pending:
+                progress.wait()
+            return [t for t in self.tests if t not in self.reported]
+
+runs = {}
+
+
+def timeout_status(test, message):
+    with output_lock:
+        output.status(
+            test_id=test,
+            test_status='fail',
+            test_tags=[args.browser],
+            file_name='message',
+            file_bytes=message,
+            mime_type='text/plain; charset=UTF-8',
+            eof=True)
+
 
 class MultiPartForm(object):
     """Accumulate the data to be used when posting a form."""
@@ -437,6 +601,35 @@ class ServerHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
             })
 
         data = simplejson.loads(form.getvalue('data'))
+        run = runs.get(data.get('run'))
+        finished = data.get('type') == 'finished'
+
+        # Late posts of a finished or timed out run were already reported.
+        if finished:
+            tests = [test[:-5] for test in data['timedOut']]
+        else:
+            tests = [data['testName'][:-5]]
+        if run:
+            tests = run.claim(tests)
+            if tests is None:
+                self.respond()
+                return
+
+        try:
+            if finished:
+                for test in tests:
+                    timeout_status(test, "Timed out in the test runner.")
+            else:
+                self.report(data)
+        finally:
+            if run:
+                run.post(finished=finished)
+
+        self.respond()
+
+    def report(self, data):
+        if 'duration' in data:
+            durations[data['testName'][:-5]] = data['duration'] / 1000.0
 
         overall_status = 0
         for result in data['results']:
@@ -444,14 +637,15 @@ class ServerHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
             info.pop('_structured_clone', None)
 
             overall_status += result['status']
-            output.status(
-                test_id="%s:%s" % (data['testName'][:-5], result['name']),
-                test_status=self.STATUS[result['status']],
-                test_tags=[args.browser],
-                file_name='message',
-                file_bytes=repr(result['message']),
-                mime_type='text/plain; charset=UTF-8',
-                eof=True)
+            with output_lock:
+                output.status(
+                    test_id="%s:%s" % (data['testName'][:-5], result['name']),
+                    test_status=self.STATUS[result['status']],
+                    test_tags=[args.browser],
+                    file_name='message',
+                    file_bytes=repr(result['message']),
+                    mime_type='text/plain; charset=UTF-8',
+                    eof=True)
 
         # Take a screenshot of result if a failure occurred.
         if overall_status > 0 and args.virtual:
@@ -474,6 +668,7 @@ class ServerHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
                 result = urllib2.urlopen(request).read()
                 print "Screenshot at:", re.findall("""<td><textarea wrap='off' onmouseover='this.focus\(\)' onfocus='this.select\(\)' id="code_1" scrolling="no">([^<]*)</textarea></td>""", result)  # noqa
 
+    def respond(self):
         response = "OK"
         self.send_response(200)
         self.send_header("Content-type", "text/plain")
@@ -482,7 +677,11 @@ class ServerHandler(SimpleHTTPServer.SimpleHTTPRequestHandler):
         self.wfile.write(response)
         self.wfile.close()
 
-httpd = SocketServer.TCPServer(
+
+class ThreadingServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+    daemon_threads = True
+
+httpd = ThreadingServer(
     ("127.0.0.1", 0),  # Bind to any port on localhost
     ServerHandler)
 httpd_thread = threading.Thread(target=httpd.serve_forever)
@@ -513,69 +712,84 @@ if args.virtual and args.browser != "PhantomJS":
 
 from selenium import webdriver
 
-driver_arguments = {}
-if args.browser == "Chrome":
-    import tempfile
-    import shutil
+import tempfile
+import shutil
 
-    # We reference shutil to make sure it isn't garbaged collected before we
-    # use it.
-    def directory_cleanup(directory, shutil=shutil):
-        try:
-            shutil.rmtree(directory)
-        except OSError, e:
-            pass
 
+# We reference shutil to make sure it isn't garbaged collected before we
+# use it.
+def directory_cleanup(directory, shutil=shutil):
     try:
-        user_data_dir = tempfile.mkdtemp()
-        atexit.register(directory_cleanup, user_data_dir)
-    except:
-        directory_cleanup(user_data_dir)
-        raise
+        shutil.rmtree(directory)
+    except OSError, e:
+        pass
 
-    driver_arguments['chrome_options'] = webdriver.ChromeOptions()
-    # Make printable
-    webdriver.ChromeOptions.__repr__ = lambda self: str(self.__dict__)
-    driver_arguments['chrome_options'].add_argument(
-        '--user-data-dir=%s' % user_data_dir)
-    driver_arguments['chrome_options'].add_argument(
-        '--enable-logging')
-
-    driver_arguments['chrome_options'].binary_location = (
-        '/usr/bin/google-chrome')
-    driver_arguments['executable_path'] = chromedriver
-
-    # Travis-CI uses OpenVZ containers which are incompatible with the sandbox
-    # technology.
-    # See https://code.google.com/p/chromium/issues/detail?id=31077 for more
-    # information.
-    if 'TRAVIS' in os.environ:
-        driver_arguments['chrome_options'].add_argument('--no-sandbox')
-
-elif args.browser == "Firefox":
-    driver_arguments['firefox_profile'] = webdriver.FirefoxProfile()
-
-elif args.browser == "PhantomJS":
-    driver_arguments['executable_path'] = phantomjs
-    driver_arguments['service_args'] = ['--remote-debugger-port=9000']
-
-elif args.browser == "Remote":
-    driver_arguments['command_executor'] = args.remote_executor
-    caps = {}
-
-    for arg in args.remote_caps:
-        if not arg.strip():
-            continue
-
-        if arg.find('=') < 0:
-            caps.update(getattr(
-                webdriver.DesiredCapabilities, arg.strip().upper()))
-        else:
-            key, value = arg.split('=', 1)
-            caps[key] = value
-    driver_arguments['desired_capabilities'] = caps
+user_data_dirs = {}
+
+
+def browser_arguments(shard):
+    """WebDriver arguments, every shard gets its own profile."""
+    driver_arguments = {}
+    if args.browser == "Chrome":
+        user_data_dir = None
+        try:
+            user_data_dir = tempfile.mkdtemp()
+            atexit.register(directory_cleanup, user_data_dir)
+        except:
+            if user_data_dir:
+                directory_cleanup(user_data_dir)
+            raise
+        user_data_dirs[shard] = user_data_dir
+
+        driver_arguments['chrome_options'] = webdriver.ChromeOptions()
+        # Make printable
+        webdriver.ChromeOptions.__repr__ = lambda self: str(self.__dict__)
+        driver_arguments['chrome_options'].add_argument(
+            '--user-data-dir=%s' % user_data_dir)
+        driver_arguments['chrome_options'].add_argument(
+            '--enable-logging')
+
+        driver_arguments['chrome_options'].binary_location = (
+            '/usr/bin/google-chrome')
+        driver_arguments['executable_path'] = chromedriver
+
+        # Travis-CI uses OpenVZ containers which are incompatible with the
+        # sandbox technology.
+        # See https://code.google.com/p/chromium/issues/detail?id=31077 for
+        # more information.
+        if 'TRAVIS' in os.environ:
+            driver_arguments['chrome_options'].add_argument('--no-sandbox')
+
+    elif args.browser == "Firefox":
+        driver_arguments['firefox_profile'] = webdriver.FirefoxProfile()
+
+    elif args.browser == "PhantomJS":
+        driver_arguments['executable_path'] = phantomjs
+        driver_arguments['service_args'] = [
+            '--remote-debugger-port=%i' % (9000 + shard)]
+
+    elif args.browser == "Remote":
+        driver_arguments['command_executor'] = args.remote_executor
+        caps = {}
+
+        for arg in args.remote_caps:
+            if not arg.strip():
+                continue
+
+            if arg.find('=') < 0:
+                caps.update(getattr(
+                    webdriver.DesiredCapabilities, arg.strip().upper()))
+            else:
+                key, value = arg.split('=', 1)
+                caps[key] = value
+        driver_arguments['desired_capabilities'] = caps
+
+    return driver_arguments
+
+
+def start_browser(shard):
+    driver_arguments = browser_arguments(shard)
 
-try:
     browser = None
     try:
         if args.verbose:
@@ -586,39 +800,104 @@ try:
         if browser:
             browser.close()
         raise
+    return browser
 
-    url = 'http://localhost:%i/test/test-runner.html?%s' % (
-        port, "|".join(tests))
-    browser.get(url)
 
-    def close_other_windows(browser, url):
-        for win in browser.window_handles:
-            browser.switch_to_window(win)
-            if browser.current_url != url:
-                browser.close()
-        browser.switch_to_window(browser.window_handles[0])
+def close_other_windows(browser, url):
+    for win in browser.window_handles:
+        browser.switch_to_window(win)
+        if browser.current_url != url:
+            browser.close()
+    browser.switch_to_window(browser.window_handles[0])
+
+
+def run_tests(browser, index, tests):
+    run = runs[str(index)] = TestRun(index, tests)
+
+    url = 'http://localhost:%i/test/test-runner.html?%s&run=%i' % (
+        port, "|".join(tests), index)
+    browser.get(url)
 
+    # The runner page posts every result and a final 'finished', wake up on
+    # those rather than asking the browser.
+    posts = 0
     while True:
         # Sometimes other windows are accidently opened (such as an extension
         # popup), close them.
         if len(browser.window_handles) > 1:
             close_other_windows(browser, url)
 
-        if not browser.execute_script('return window.finished'):
-            time.sleep(1)
-            continue
-        else:
+        if run.finished:
+            break
+
+        posts = run.wait(posts)
+        if posts is None:
+            elapsed = time.time() - run.last
+            for test in run.close():
+                timeout_status(
+                    test, "No result from the browser for %i seconds." % (
+                        elapsed,))
+
+            # Stop the page, anything it still posts is dropped.
+            browser.get('about:blank')
             break
 
+
+class Shard(threading.Thread):
+    """Runs one shard of the tests in its own browser."""
+
+    def __init__(self, index, tests):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.index = index
+        self.tests = tests
+        self.browser = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.browser = start_browser(self.index)
+            run_tests(self.browser, self.index, self.tests)
+        except Exception, e:
+            self.error = e
+
+browsers = []
+try:
+    if len(shards) == 1:
+        browsers.append(start_browser(0))
+        run_tests(browsers[0], 0, shards[0])
+    else:
+        workers = [Shard(i, shard) for i, shard in enumerate(shards)]
+        for worker in workers:
+            worker.start()
+
+        # Join with a timeout so Ctrl-C still reaches the main thread.
+        for worker in workers:
+            while worker.is_alive():
+                worker.join(1)
+            if worker.browser:
+                browsers.append(worker.browser)
+
+        for worker in workers:
+            if worker.error:
+                raise worker.error
+
 finally:
     output.stopTestRun()
 
-    if args.browser == "Chrome":
-        shutil.copy(os.path.join(user_data_dir, "chrome_debug.log"), ".")
+    for shard, user_data_dir in sorted(user_data_dirs.items()):
+        log = "chrome_debug.log"
+        if len(shards) > 1:
+            log = "chrome_debug.%i.log" % shard
+        shutil.copy(os.path.join(user_data_dir, "chrome_debug.log"), log)
 
-while args.dontexit and browser.window_handles:
-    time.sleep(1)
+    if args.durations and durations:
+        out = file(args.durations, "w")
+        simplejson.dump(durations, out, indent=2, sort_keys=True)
+        out.close()
 
+while args.dontexit and any(b.window_handles for b in browsers):
+    time.sleep(1)
 if summary.testsRun == 0:
    print
    print "FAIL: No tests run!"